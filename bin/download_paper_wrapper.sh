@@ -4,4 +4,12 @@ SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 PYTHON_DIR="$SCRIPT_DIR/python"
 PYTHON="python3.12"
 
-"$PYTHON" $PYTHON_DIR/cli.py --download
+# Arxiv papers passed as arguments are downloaded by Citerius daemon 
+# (without prompts), everything else goes through interactive cli
+if [[ "$#" -ge 1 ]]; then
+    for arxiv_id in "$@"; do
+        "$PYTHON" "$PYTHON_DIR/client.py" download "$arxiv_id"
+    done
+else
+    "$PYTHON" $PYTHON_DIR/cli.py --download
+fi
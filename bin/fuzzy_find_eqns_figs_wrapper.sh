@@ -2,17 +2,20 @@
 
 # Configuration variables for paths
 parent_dir="$HOME/research/references" # Directory containing reference materials
+config_file="$HOME/.config/citerius/config.json" # Citerius config of that library
 
 # Determine script directory for relative path operations
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 PYTHON_DIR="$SCRIPT_DIR/python"
 CITERIUS_DIR="$SCRIPT_DIR/.."
 BIN_DIR="$SCRIPT_DIR"
+PYTHON="python3.12"
 
 main_wrapper() {
     # Use fzf to select a paper from the CSV file, ignoring the header line
 	
-    local label=$($PYTHON_DIR/config.py "$parent_dir")
+    local label
+    label=$("$PYTHON" "$PYTHON_DIR/client.py" --config "$config_file" fzf) || exit 0
     echo "LEGEND: f for figures, e for equations, followed by the number of item"
     read -p "Enter the items you want to find (e.g., 'f5 e12' for 5th figure and 12th equation): " input_line
 	
@@ -20,7 +23,7 @@ main_wrapper() {
 	#label="MFM"
 	#input_line="f30"
 	
-	$BIN_DIR/fuzzy_find_eqns_figs.sh "$parent_dir" "$label" "$input_line"
+	$BIN_DIR/fuzzy_find_eqns_figs.sh "$parent_dir" "$label" "$input_line" "$config_file"
 }
 
 # Call the main function to start the script
@@ -11,8 +11,10 @@ BIN_DIR="$SCRIPT_DIR"
 PYTHON="python3.12"
 
 main_wrapper() {
-    # Use fzf to select a paper from the CSV file, ignoring the header line
-    local label=$($PYTHON $PYTHON_DIR/config.py "$parent_dir")
+    # Use fzf to select a paper (the lines come from Citerius daemon, 
+    # which is started on the first call)
+    local label
+    label=$("$PYTHON" "$PYTHON_DIR/client.py" fzf) || exit 0
 	$BIN_DIR/fuzzy_find_paper.sh "$parent_dir" "$label"
 }
 
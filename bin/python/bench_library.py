@@ -0,0 +1,250 @@
+"""
+Scaling benchmark of Citerius operations on synthetic libraries.
+
+For every library size, a synthetic library is generated (see
+synthetic_library.py), and every operation is run in a fresh python process
+after its setup code. The median wall time and the peak memory allocated
+by python (tracemalloc, measured in a separate run) are reported. With
+--baseline, the results are compared against a previously saved run (--save),
+and the script exits with non-zero status if any operation got slower or
+uses more memory than the tolerance allows.
+
+The bulk download runs offline: the metadata of the new papers is put into
+the cache, and their pdfs are served by the replay stand-in (see replay.py)
+without rate limits, so only the work of Citerius itself is measured.
+
+Usage:
+    python bench_library.py [--sizes 1000 10000 100000] [--repeat N]
+                            [--only OPERATION ...] [--save FILE] [--baseline FILE]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+from synthetic_library import create_library
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# New papers added by one run of the bulk download, and size of their pdfs
+BULK_PAPERS = 20
+BULK_PDF_BYTES = 200_000
+
+# Operation name -> (setup code, measured code). In the code, {config} is
+# replaced by the path to the config file of the library. Operations that
+# change the library pick a different paper every run.
+OPERATIONS = {
+    "load_df": (
+        "import config\n"
+        "c = config.CiteriusConfig({config!r})",
+        "c.load_df()"),
+    "fzf lines (build)": (
+        "import config, os\n"
+        "c = config.CiteriusConfig({config!r})\n"
+        "out = open(os.devnull, 'wb')",
+        "c.build_fzf_lines(out)"),
+    "papers index (rebuild)": (
+        "import config\n"
+        "c = config.CiteriusConfig({config!r})\n"
+        "c.index",
+        "c.index.rebuild()"),
+    "label lookup": (
+        "import config\n"
+        "c = config.CiteriusConfig({config!r})\n"
+        "label = c.index.labels()[len(c.index.labels()) // 2]",
+        "c.get_paper_info(label)"),
+    "find_bibtex_entry": (
+        "import config\n"
+        "c = config.CiteriusConfig({config!r})\n"
+        "label = c.index.labels()[len(c.index.labels()) // 2]",
+        "c.cutils.find_bibtex_entry(open(c.bibtex_file).read(), label)"),
+    "bibtex entry (index)": (
+        "import config\n"
+        "c = config.CiteriusConfig({config!r})\n"
+        "label = c.index.labels()[len(c.index.labels()) // 2]\n"
+        "c.bib_index.sync()",
+        "c.get_bibtex_entry(label)"),
+    "append_bibtex": (
+        "import time, contextlib, io\n"
+        "from paper_downloader import PaperDownloader\n"
+        "label = f'BenchNew{{time.time_ns()}}'\n"
+        "citation = '@article{{2401.00001,\\n    author = {{Smith, A. and Wang, B.}},\\n'"
+        " + '    title = {{Benchmark paper}},\\n    year = {{2024}}\\n}}\\n'\n"
+        "with contextlib.redirect_stdout(io.StringIO()):\n"
+        "    p = PaperDownloader({config!r}, '2401.00001', no_commits=True,"
+        " citation_str=citation)\n"
+        "p.label = label\n"
+        "p.download_ans, p.download_src_ans = 'n', 'n'\n"
+        "p.replace_label_for_citation()\n"
+        "p.setup_download_paths()\n"
+        "p.citerius.index.sync(); p.citerius.bib_index.sync()",
+        "p.append_bibtex()"),
+    "remove_paper": (
+        "import config\n"
+        "c = config.CiteriusConfig({config!r})\n"
+        "label = c.index.labels()[len(c.index.labels()) // 2]\n"
+        "c.bib_index.sync(); c.repo",
+        "c.remove_paper(label)"),
+    "restore plan (BulkDownloader)": (
+        "from paper_downloader import BulkDownloader\n"
+        "b = BulkDownloader({config!r})\n"
+        "b.citerius.index.sync()",
+        "b.plan_restore()"),
+    "bulk download (BulkDownloader)": (
+        "import bench_library, contextlib, io\n"
+        "b, arxiv_ids = bench_library.prepare_bulk_download({config!r})",
+        "with contextlib.redirect_stdout(io.StringIO()):\n"
+        "    failed = b.download_from_list(arxiv_ids)\n"
+        "assert not failed, f'Bulk download failed: {{failed}}'"),
+}
+
+def prepare_bulk_download(config_file, n_papers=BULK_PAPERS):
+    """
+    Sets up offline bulk download of new arxiv papers (a different set
+    every run): their bibtex and arxiv results are put into the metadata
+    cache, and their pdfs are served by the replay stand-in
+    Returns:
+        (BulkDownloader, list of arxiv ids)
+    """
+    import time
+    import arxiv
+    import replay
+    from paper_downloader import BulkDownloader, HostRateLimiter, ARXIV_HOST
+    fixture_dir = tempfile.mkdtemp(prefix="citerius-bench-")
+    store = replay.FixtureStore(fixture_dir)
+    # Yymm.number ids that don't repeat between runs
+    first = time.time_ns() // 1000 % 90000
+    arxiv_ids = [ f"2401.{first + i:05d}" for i in range(n_papers) ]
+    limiter = HostRateLimiter(host_limits={ARXIV_HOST: 4},
+                              min_intervals={ARXIV_HOST: 0})
+    b = BulkDownloader(config_file, workers=4, limiter=limiter)
+    for arxiv_id in arxiv_ids:
+        # Labels come from author, first word of title and year, so the
+        # first word is made unique (digits of the id as letters)
+        word = "".join( chr(ord("a") + int(digit)) for digit in arxiv_id[-5:] )
+        b.cutils.set_cached("bibtex", arxiv_id,
+                            f"@article{{{arxiv_id},\n    author = {{Smith, A. and Wang, B.}},\n"
+                            f"    title = {{{word.capitalize()} benchmark paper}},\n    year = {{2024}},\n"
+                            f"    eprint = {{{arxiv_id}}}\n}}")
+        pdf_url = f"http://arxiv.org/pdf/{arxiv_id}v1"
+        b.cutils.set_cached("arxiv", arxiv_id, arxiv.Result(
+            entry_id=f"http://arxiv.org/abs/{arxiv_id}v1", title=f"Benchmark paper {arxiv_id}",
+            links=[ arxiv.Result.Link(pdf_url, title="pdf") ]))
+        store.put("GET", pdf_url, 200, { "Content-Type": "application/pdf" },
+                  b"%PDF-1.4\n" + os.urandom(BULK_PDF_BYTES) + b"\n%%EOF\n")
+    server = replay.serve(replay.Standin(fixture_dir), 0)
+    os.environ["CITERIUS_STANDIN_URL"] = f"http://127.0.0.1:{server.server_port}"
+    b.citerius.index.sync(); b.citerius.bib_index.sync(); b.citerius.repo
+    return b, arxiv_ids
+
+RUNNER = """
+import sys, json, time
+{setup}
+if {trace}:
+    import tracemalloc
+    tracemalloc.start()
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+peak = tracemalloc.get_traced_memory()[1] if {trace} else 0
+print(json.dumps([elapsed, peak]))
+"""
+
+def run_operation(setup, code, config_file, trace):
+    """
+    Runs the operation in a fresh process, returns (seconds, peak bytes)
+    """
+    script = RUNNER.format(setup=setup.format(config=config_file),
+                           code=code.format(config=config_file), trace=trace)
+    result = subprocess.run([sys.executable, "-c", script], cwd=SCRIPT_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Operation failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def benchmark_size(n_papers, operations, repeat, tmp_dir):
+    """
+    Returns dictionary operation -> {"time_ms", "peak_mb"}
+    """
+    library_dir = os.path.join(tmp_dir, f"library_{n_papers}")
+    config_file = create_library(library_dir, n_papers)
+    results = {}
+    for name in operations:
+        setup, code = OPERATIONS[name]
+        times = [ run_operation(setup, code, config_file, False)[0]
+                  for _ in range(repeat) ]
+        _, peak = run_operation(setup, code, config_file, True)
+        results[name] = { "time_ms": statistics.median(times) * 1000,
+                          "peak_mb": peak / 2**20 }
+        print(f"{n_papers:>7} {name:<30} {results[name]['time_ms']:10.1f} ms "
+              f"{results[name]['peak_mb']:9.2f} MB", flush=True)
+    return results
+
+def compare(results, baseline, tolerance, slack_ms, slack_mb):
+    """
+    Prints comparison with the baseline, returns whether there are regressions
+    """
+    failed = False
+    for size, operations in results.items():
+        for name, result in operations.items():
+            if name not in baseline.get(size, {}):
+                continue
+            base = baseline[size][name]
+            allowed_ms = base["time_ms"] * (1 + tolerance) + slack_ms
+            allowed_mb = base["peak_mb"] * (1 + tolerance) + slack_mb
+            status = []
+            if result["time_ms"] > allowed_ms: status.append("TIME REGRESSION")
+            if result["peak_mb"] > allowed_mb: status.append("MEMORY REGRESSION")
+            failed = failed or bool(status)
+            print(f"{size:>7} {name:<30} "
+                  f"{base['time_ms']:9.1f} -> {result['time_ms']:9.1f} ms "
+                  f"{base['peak_mb']:8.2f} -> {result['peak_mb']:8.2f} MB  "
+                  f"{', '.join(status) or 'ok'}")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Citerius scaling benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Numbers of papers in the synthetic libraries')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs of every operation')
+    parser.add_argument('--only', type=str, nargs='+', default=None,
+                        choices=list(OPERATIONS), metavar='OPERATION',
+                        help='Run only these operations')
+    parser.add_argument('--save', type=str, default=None,
+                        help='Save the results to this json file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Compare the results with this json file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative regression compared to baseline')
+    parser.add_argument('--slack-ms', type=float, default=10.0,
+                        help='Allowed absolute slowdown compared to baseline')
+    parser.add_argument('--slack-mb', type=float, default=1.0,
+                        help='Allowed absolute memory growth compared to baseline')
+    args = parser.parse_args()
+
+    operations = args.only or list(OPERATIONS)
+    results = {}
+    print(f"{'papers':>7} {'operation':<30} {'time':>13} {'peak memory':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_papers in args.sizes:
+            results[str(n_papers)] = benchmark_size(n_papers, operations,
+                                                    args.repeat, tmp_dir)
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparison with {args.baseline}:")
+        failed = compare(results, baseline, args.tolerance,
+                         args.slack_ms, args.slack_mb)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=4)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
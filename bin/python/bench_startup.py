@@ -0,0 +1,138 @@
+"""
+Import-time and startup benchmark of Citerius.
+
+Runs every scenario in a fresh python process against a small generated
+library (see synthetic_library.py), reports the median wall time, and
+checks that light code paths don't import the heavy dependencies. With
+--baseline, the timings are compared against a previously saved run
+(--save), and the script exits with non-zero status if any scenario got
+slower than the tolerance allows.
+
+Usage:
+    python bench_startup.py [--repeat N] [--save FILE] [--baseline FILE]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+from synthetic_library import create_library, make_papers
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Size of the test library (see synthetic_library.py)
+N_PAPERS = 200
+
+# Modules that should never be imported by the light scenarios
+HEAVY_MODULES = [ "pandas", "numpy", "git", "arxiv", "pybibget", "pybtex",
+                  "httpx", "requests", "asyncio", "rich" ]
+
+# Scenario name -> (python code, whether heavy modules are forbidden).
+# {config} is replaced by the path to the config file of the test library,
+# {label} by the label of a paper in the middle of it
+SCENARIOS = {
+    "interpreter": ("pass", True),
+    "import cli": ("import cli", True),
+    "import config": ("import config", True),
+    "label lookup": ("import config\n"
+                     "c = config.CiteriusConfig({config!r})\n"
+                     "assert c.get_paper_info({label!r}) is not None\n"
+                     "c.close()", True),
+    "fzf lines (cached)": ("import config\n"
+                           "c = config.CiteriusConfig({config!r})\n"
+                           "assert c.fzf_cache_is_valid()\n"
+                           "open(c.fzf_cache_file, 'rb').read()\n"
+                           "c.close()", True),
+    "cli --help": ("import sys\n"
+                   "sys.argv = ['cli.py', '--help']\n"
+                   "import runpy\n"
+                   "try: runpy.run_path('cli.py', run_name='__main__')\n"
+                   "except SystemExit: pass", True),
+    "import paper_downloader": ("import paper_downloader", False),
+}
+
+# Code that is run once before the scenarios (builds the caches)
+PREPARE = ("import config\n"
+           "c = config.CiteriusConfig({config!r})\n"
+           "c.build_fzf_lines()\n"
+           "c.close()")
+
+MODULE_CHECK = ("\nimport sys, json\n"
+                "print(json.dumps([ m for m in {heavy!r} if m in sys.modules ]))")
+
+def run_scenario(code, forbid_heavy, repeat):
+    """
+    Runs the code in fresh processes, returns median time in ms and the
+    list of heavy modules that were imported (if they are forbidden)
+    """
+    if forbid_heavy:
+        code += MODULE_CHECK.format(heavy=HEAVY_MODULES)
+    times = []
+    output = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True)
+        times.append((time.perf_counter() - start) * 1000)
+        if result.returncode != 0:
+            raise RuntimeError(f"Scenario failed:\n{result.stderr}")
+        output = result.stdout
+    imported = []
+    if forbid_heavy:
+        imported = json.loads(output.strip().splitlines()[-1])
+    return statistics.median(times), imported
+
+def main():
+    parser = argparse.ArgumentParser(description="Citerius startup benchmark")
+    parser.add_argument('--repeat', type=int, default=7,
+                        help='Number of runs of every scenario')
+    parser.add_argument('--save', type=str, default=None,
+                        help='Save the timings to this json file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Compare the timings with this json file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative slowdown compared to baseline')
+    parser.add_argument('--slack-ms', type=float, default=5.0,
+                        help='Allowed absolute slowdown compared to baseline')
+    args = parser.parse_args()
+
+    failed = False
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_file = create_library(tmp_dir, n_papers=N_PAPERS)
+        label = make_papers(N_PAPERS)[N_PAPERS // 2]["label"]
+        subprocess.run([sys.executable, "-c", PREPARE.format(config=config_file)],
+                       cwd=SCRIPT_DIR, check=True)
+        for name, (code, forbid_heavy) in SCENARIOS.items():
+            median, imported = run_scenario(code.format(config=config_file, label=label),
+                                            forbid_heavy, args.repeat)
+            timings[name] = median
+            line = f"{name:<26} {median:8.1f} ms"
+            if imported:
+                line += f"  HEAVY IMPORTS: {', '.join(imported)}"
+                failed = True
+            print(line)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparison with {args.baseline}:")
+        for name, median in timings.items():
+            if name not in baseline:
+                continue
+            allowed = baseline[name] * (1 + args.tolerance) + args.slack_ms
+            status = "ok" if median <= allowed else "REGRESSION"
+            if median > allowed:
+                failed = True
+            print(f"{name:<26} {baseline[name]:8.1f} -> {median:8.1f} ms  {status}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(timings, f, indent=4)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import os
+import re
+import mmap
+import sqlite3
+import hashlib
+import threading
+from utils import CiteriusUtils
+
+# Match "@article{<label>," and a line with only "}"
+START_PATTERN = re.compile(rb'^@[A-Za-z]+\{\s*([^,\s]+)\s*,')
+END_PATTERN = re.compile(rb'^\s*}\s*$')
+
+class BibtexIndex():
+    def __init__(self, bibtex_file, index_file):
+        """
+        Sidecar index of bibliography.bib, which maps every label to the byte
+        offset and length of its entry, so that a single entry can be read
+        without reading the rest of the file.
+        The index is rebuilt whenever the bibtex file was changed by something
+        other than this class (unless its git blob hash is still the same).
+        Args:
+            bibtex_file (str): path to bibliography.bib
+            index_file (str): path to sqlite file of the index
+        """
+        self.bibtex_file = bibtex_file
+        self.index_file = index_file
+        self.lock = threading.RLock()
+        self.cutils = CiteriusUtils()
+
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        self.connection = sqlite3.connect(self.index_file, timeout=30,
+                                          check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                label TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.connection.commit()
+
+    # Keeping the index in sync with the bibtex file
+
+    def signature(self):
+        return self.cutils.file_signature(self.bibtex_file)
+
+    def get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?",
+                                      (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                (key, value))
+
+    def sync(self):
+        """
+        Rebuilds the index if the bibtex file has changed since the last
+        update. If only its modification time has changed (e.g. it was
+        checked out by git), its hash is compared instead.
+        """
+        with self.lock:
+            signature = self.signature()
+            if self.get_meta("signature") == signature:
+                return
+            blob_hash = self.get_meta("blob_hash")
+            if (blob_hash is not None and 
+                blob_hash == self.cutils.git_blob_hash(self.bibtex_file)):
+                self.set_meta("signature", signature)
+                self.connection.commit()
+                return
+            self.rebuild()
+
+    def scan_entries(self, lines, offset=0):
+        """
+        Finds entries in a sequence of lines (bytes).
+        Args:
+            lines (iterable of bytes): lines of bibtex file (with line endings)
+            offset (int): byte offset of the first line
+        Yields:
+            (label, offset, length) for every entry, and (None, line)
+            for every line, in the order of the lines
+        """
+        entry_label = None
+        entry_offset = 0
+        for line in lines:
+            yield None, line
+            match = START_PATTERN.match(line)
+            if match and entry_label is None:
+                entry_label = match.group(1).decode()
+                entry_offset = offset
+            offset += len(line)
+            if entry_label is not None and END_PATTERN.search(line):
+                yield entry_label, entry_offset, offset - entry_offset
+                entry_label = None
+
+    def rebuild(self):
+        """
+        Rebuilds the whole index in one streaming pass over the bibtex file
+        """
+        with self.lock:
+            entries = []
+            # Git blob hash is computed in the same pass
+            blob_hash = hashlib.sha1(f"blob {os.path.getsize(self.bibtex_file)}\0".encode())
+            with open(self.bibtex_file, "rb") as f:
+                for item in self.scan_entries(f):
+                    if item[0] is None:
+                        blob_hash.update(item[1])
+                    else:
+                        entries.append(item)
+            self.connection.execute("DELETE FROM entries")
+            # The first entry with a given label wins, like in regex lookups
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO entries VALUES (?, ?, ?)", entries)
+            self.set_meta("signature", self.signature())
+            self.set_meta("blob_hash", blob_hash.hexdigest())
+            self.connection.commit()
+
+    def record_update(self):
+        """
+        Stores the signature of the bibtex file after it was changed
+        by this class (its hash isn't known without reading the whole file)
+        """
+        self.set_meta("signature", self.signature())
+        self.connection.execute("DELETE FROM meta WHERE key = 'blob_hash'")
+        self.connection.commit()
+
+    # Changes of the bibtex file
+
+    def append(self, bibtex_str):
+        """
+        Appends bibtex entries to the bibtex file and adds them to the index
+        """
+        with self.lock:
+            self.sync()
+            data = bibtex_str.encode()
+            with open(self.bibtex_file, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            entries = [ item for item in
+                        self.scan_entries(data.splitlines(keepends=True), offset)
+                        if item[0] is not None ]
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO entries VALUES (?, ?, ?)", entries)
+            self.record_update()
+
+    def remove(self, labels):
+        """
+        Removes all the entries with given labels from the bibtex file in a
+        single pass, and records the new offsets of the remaining entries
+        Args:
+            labels (set of str): labels of the entries to remove
+        """
+        with self.lock:
+            temp_filename = f"{self.bibtex_file}.tmp"
+            entries = []
+            with open(self.bibtex_file, "rb") as infile, \
+                 open(temp_filename, "wb") as outfile:
+                for item in self.scan_entries(self.kept_lines(infile, labels)):
+                    if item[0] is None:
+                        outfile.write(item[1])
+                    else:
+                        entries.append(item)
+            os.replace(temp_filename, self.bibtex_file)
+
+            self.connection.execute("DELETE FROM entries")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO entries VALUES (?, ?, ?)", entries)
+            self.record_update()
+
+    def kept_lines(self, lines, labels):
+        """
+        Yields the lines that don't belong to the entries with given labels
+        """
+        in_block = False
+        for line in lines:
+            match = START_PATTERN.match(line)
+            if match and match.group(1).decode() in labels:
+                in_block = True
+            if not in_block:
+                yield line
+            if in_block and END_PATTERN.search(line):
+                in_block = False
+
+    # Lookups
+
+    def get_location(self, label):
+        """
+        Returns (offset, length) of the entry with given label,
+        or None if there is no such entry
+        """
+        with self.lock:
+            self.sync()
+            return self.connection.execute(
+                "SELECT offset, length FROM entries WHERE label = ?",
+                (label,)).fetchone()
+
+    def get_entry(self, label):
+        """
+        Returns bibtex entry with given label (str), or None if there is
+        no such entry. Only the entry itself is read from the file.
+        """
+        location = self.get_location(label)
+        if location is None:
+            return None
+        offset, length = location
+        with open(self.bibtex_file, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                entry = data[offset:offset+length]
+        return entry.decode()
+
+    def labels(self):
+        """
+        Returns list of all the labels in the bibtex file
+        """
+        with self.lock:
+            self.sync()
+            rows = self.connection.execute(
+                "SELECT label FROM entries ORDER BY offset").fetchall()
+        return [ row[0] for row in rows ]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,152 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from pathlib import Path
+
+class CiteriusCache():
+    def __init__(self, cache_file, ttl_days=30, max_size_mb=64, refresh=False):
+        """
+        Persistent key-value cache, stored in a sqlite file.
+        Entries expire after ttl_days, and when the total size of the stored
+        values exceeds max_size_mb, the least recently used entries are evicted.
+        Args:
+            cache_file (str): path to sqlite file of the cache
+            ttl_days (float): lifetime of an entry in days
+                (None or <= 0 for entries that never expire)
+            max_size_mb (float): maximal total size of the stored values in MB
+            refresh (bool): if True, lookups ignore stored entries
+                (new values are still stored), i.e. everything is refetched
+        """
+        self.cache_file = cache_file
+        self.ttl = ttl_days * 86400 if ttl_days and ttl_days > 0 else None
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        """
+        Connection to the sqlite file (opened on first use)
+        """
+        if self._connection is None:
+            self._connection = self.connect()
+        return self._connection
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        connection = sqlite3.connect(self.cache_file, timeout=30,
+                                     check_same_thread=False)
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed);
+        """)
+        connection.commit()
+        return connection
+
+    def get(self, key):
+        """
+        Returns value stored with the key, or None if there is no such
+        entry, it has expired, or the cache is in refresh mode
+        """
+        if self.refresh:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            now = time.time()
+            if self.ttl is not None and now - created > self.ttl:
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.connection.commit()
+                return None
+            self.connection.execute("UPDATE entries SET accessed = ? WHERE key = ?",
+                                    (now, key))
+            self.connection.commit()
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        """
+        Stores the value with the key and evicts the least recently used
+        entries if the cache has grown beyond its size
+        """
+        try:
+            blob = pickle.dumps(value)
+        except Exception as e:
+            print(f"Couldn't cache {key}: {e}")
+            return
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now))
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones until
+        the cache fits into its size (has to be called with the lock held)
+        """
+        if self.ttl is not None:
+            self.connection.execute("DELETE FROM entries WHERE created < ?",
+                                    (time.time() - self.ttl,))
+        total_size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        rows = self.connection.execute(
+            "SELECT key, size FROM entries ORDER BY accessed").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total_size <= self.max_size:
+                break
+            evicted.append((key,))
+            total_size -= size
+        self.connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+    def clear(self):
+        """
+        Removes all the entries from the cache
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM entries")
+            self.connection.commit()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+def default_cache_dir():
+    """
+    Returns default directory for Citerius caches
+    ($XDG_CACHE_HOME/citerius, or ~/.cache/citerius)
+    """
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME", "")
+    if xdg_cache_home == "":
+        xdg_cache_home = os.path.join(Path.home(), ".cache")
+    return os.path.join(xdg_cache_home, "citerius")
+
+def library_state_dir(parent_dir, cache_dir=None):
+    """
+    Returns directory for the data derived from the library in parent_dir 
+    (indices etc.), inside cache_dir (default_cache_dir() if None)
+    """
+    import hashlib
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    library_hash = hashlib.sha256(
+            os.path.realpath(parent_dir).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, "libraries", library_hash)
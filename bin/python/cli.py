@@ -1,24 +1,32 @@
 import argparse, os
-from paper_downloader import PaperDownloader, BulkDownloader
-from config import CiteriusConfig, CiteriusUtils
+import profiling
+
+# Modules of Citerius are imported only by the actions that need them, 
+# so that light actions (--fzf, --remove) start fast
 
 class CiteriusParser():
     def __init__(self):
         """Create a new instance"""
+        self.fzf_labels = [] # Labels chosen with fzf multi-select (removal)
         self.parse_args()
         self.avoid_multiple_definitions()
+        if self.args.profile:
+            profiling.enable(self.args.profile)
 
-        # Get fuzzy-finding out of the way
-        if self.args.fzf:
-            self.get_fzf_label()
+        with profiling.span("cli.run"):
+            # Get fuzzy-finding out of the way
+            if self.args.fzf:
+                self.get_fzf_label()
 
-        # Do whatever action user asked for
-        if self.args.download: self.download()
-        elif self.args.remove: self.remove()
-        elif self.args.fzf: 
-            print(self.args.label)
-        else:
-            print(f"No action or --fzf was specified")
+            # Do whatever action user asked for
+            if self.args.download: self.download()
+            elif self.args.remove: self.remove()
+            elif self.args.bibtex: self.print_bibtex()
+            elif self.args.search: self.search()
+            elif self.args.fzf: 
+                print(self.args.label)
+            else:
+                print(f"No action or --fzf was specified")
 
     def parse_args(self):
         """Parse all the CLI arguments"""
@@ -30,12 +38,33 @@ class CiteriusParser():
         parser.add_argument('--config', help='Path to Citerius config file. "+\
                 "Defaults to $HOME/.config/citerius/config.json', 
                 type=str, default=None)
+        parser.add_argument('--workers', help='Number of papers downloaded ' + \
+                'simultaneously in bulk downloads (--file, --all, default 1), ' + \
+                'or of processes extracting text for --search (default: ' + \
+                'number of cpus)', type=int, default=None)
+        parser.add_argument('--refresh', help='Ignore cached arxiv/bibget ' + \
+                'metadata and fetch it again', action='store_true')
+        parser.add_argument('--dry-run', help='Only print what would be ' + \
+                'downloaded (with --download --all)', action='store_true')
+        parser.add_argument('--profile', help='Write timings of the phases ' + \
+                'of the action as json lines to PROFILE (stderr if no file ' + \
+                'is given) and print their summary in the end. Can also be ' + \
+                f'enabled with ${profiling.PROFILE_ENV}', nargs='?', const='-', 
+                default=None, metavar='PROFILE')
         
         action = parser.add_argument_group('action')
-        action.add_argument('--remove', help='Remove target. Only works with "+\
-                "fzf or label targets', action='store_true')
+        action.add_argument('--remove', help='Remove target: fzf ' + \
+                '(multi-select with Tab), label, arxiv, link, pdf (papers ' + \
+                'with the same pdf), file (one label per line), auto or all',
+                action='store_true')
         action.add_argument('--download', help='Download/add target',
                 action='store_true')
+        action.add_argument('--search', type=str, help='Search the text ' + \
+                'of the papers for the words of SEARCH (no target needed)', 
+                default=False)
+        action.add_argument('--bibtex', help='Print bibtex entry of the ' + \
+                'target. Only works with fzf or label targets', 
+                action='store_true')
         
         target = parser.add_argument_group('target')
         target.add_argument('--auto', type=str, help='The program " + \
@@ -66,7 +95,7 @@ class CiteriusParser():
         targets_err = "Several targets detected. Please, use only one target call"
         self.find_double_definitions_in_list(targets, targets_err)
 
-        actions = [ args.remove, args.download ]
+        actions = [ args.remove, args.download, args.bibtex, args.search ]
         actions_err = "Several actions detected. Please, use only one action call"
         self.find_double_definitions_in_list(actions, actions_err)
 
@@ -90,6 +119,7 @@ class CiteriusParser():
                     raise ValueError(error_string)
 
     def download(self):
+        from paper_downloader import PaperDownloader, BulkDownloader
         bulk_download_flag = False
         if self.args.label:
             raise NotImplementedError
@@ -115,61 +145,150 @@ class CiteriusParser():
                 bulk_download_flag = True
 
         if bulk_download_flag:
-            bulk_download = BulkDownloader(self.args.config)
+            bulk_download = BulkDownloader(self.args.config, 
+                                           workers=self.args.workers or 1,
+                                           refresh=self.args.refresh)
             bulk_download.download_from_file(arxiv_id)
-            bulk_download.citerius.repo.close()
+            bulk_download.session.close()
         elif self.args.all:
-            bulk_download = BulkDownloader(self.args.config)
-            bulk_download.download_from_citerius()
-            bulk_download.citerius.repo.close()
+            bulk_download = BulkDownloader(self.args.config, 
+                                           workers=self.args.workers or 1,
+                                           refresh=self.args.refresh)
+            bulk_download.download_from_citerius(dry_run=self.args.dry_run)
+            bulk_download.session.close()
         else:
-            paper_download = PaperDownloader(self.args.config, arxiv_id)
+            paper_download = PaperDownloader(self.args.config, arxiv_id, 
+                                             refresh=self.args.refresh)
             if self.args.no_confirm: 
                 paper_download.download_paper_without_user_input()
             else: paper_download.download_paper_with_user_input()
-            paper_download.citerius.repo.close()
+            paper_download.citerius.close()
 
     def remove(self):
+        from config import CiteriusConfig
         citerius = CiteriusConfig(self.args.config)
 
-        # Get label of the paper
-        if self.args.label:
-            label = self.args.label
-            id_string = f"label {label}"
-        elif self.args.auto:
-            raise NotImplementedError
-        elif self.args.arxiv:
-            raise NotImplementedError
-        elif self.args.link:
-            raise NotImplementedError
-        elif self.args.pdf:
-            raise NotImplementedError
-        elif self.args.file:
-            raise NotImplementedError
+        # Get labels of the papers
+        label, arxiv_id, link = self.args.label, self.args.arxiv, self.args.link
+        pdf_path, file_path = self.args.pdf, self.args.file
+        if self.args.auto:
+            # Same kinds of targets as the download accepts
+            target = self.args.auto
+            if citerius.cutils.is_arxiv_id(target): arxiv_id = target
+            elif target.lower().endswith(".pdf") and os.path.isfile(target): pdf_path = target
+            elif os.path.isfile(target): file_path = target
+            elif "://" in target: link = target
+            else: label = target
+
+        if self.fzf_labels:
+            labels = self.fzf_labels
+        elif label:
+            labels = [ label ]
+        elif arxiv_id:
+            labels = citerius.index.find_by_arxiv(arxiv_id)
+            if len(labels) == 0:
+                raise ValueError(f"No paper with arxiv number {arxiv_id} found")
+        elif link:
+            labels = citerius.index.find_by_link(link)
+            if len(labels) == 0:
+                raise ValueError(f"No paper downloaded from {link} found")
+        elif pdf_path:
+            labels = self.find_labels_by_pdf(citerius, pdf_path)
+            if len(labels) == 0:
+                raise ValueError(f"No paper with the pdf {pdf_path} found")
+        elif file_path:
+            labels = self.read_labels_from_file(file_path)
         elif self.args.all:
-            raise NotImplementedError
+            citerius.index.sync()
+            labels = citerius.index.labels()
+            if len(labels) == 0:
+                raise ValueError("There are no papers in the library")
         else:
             raise ValueError(f"Target for removal not specified")
 
+        if len(labels) == 1:
+            id_string = f"label {labels[0]}"
+        elif self.args.all:
+            id_string = "all the labels of the library"
+        else:
+            id_string = f"labels {', '.join(labels)}"
+
         # Prompt the user if the paper really needs to be deleted
         if self.args.no_confirm:
             answer = 'y'
         else:
-            answer = input(f"You are about to remove paper with {id_string}. "+\
-                            "Are you sure? (y/N): ")
+            answer = input(f"You are about to remove {len(labels)} paper(s) " + \
+                           f"with {id_string}. Are you sure? (y/N): ")
 
-        # Delete the paper
+        # Delete the papers
         if answer.lower() == 'y':
-            citerius.remove_paper(label)
-            print(f"The paper with id '{id_string}' was successfully removed.")
-            citerius.repo.close()
+            removed_labels = citerius.remove_papers(labels)
+            if removed_labels:
+                print(f"{len(removed_labels)} paper(s) were successfully removed.")
         else:
-            print(f"You answered '{answer}'. The paper will not be removed.")
+            print(f"You answered '{answer}'. The papers will not be removed.")
+        citerius.close()
+
+    def print_bibtex(self):
+        from config import CiteriusConfig
+        citerius = CiteriusConfig(self.args.config)
+        if not self.args.label:
+            raise ValueError(f"Label of the paper not specified")
+        entry = citerius.get_bibtex_entry(self.args.label)
+        citerius.close()
+        if entry is None:
+            raise ValueError(f"No bibtex entry with label {self.args.label} found")
+        print(entry, end="")
 
+    def search(self):
+        from config import CiteriusConfig
+        citerius = CiteriusConfig(self.args.config)
+        results = citerius.search(self.args.search, self.args.workers)
+        citerius.close()
+        if len(results) == 0:
+            print(f"Nothing found for '{self.args.search}'")
+        for label, page, snippet in results:
+            snippet = " ".join(snippet.split())
+            print(f"{label} (p. {page}): {snippet}")
+
+    def read_labels_from_file(self, file_path):
+        """
+        Reads labels from file, one label per line (empty lines are skipped)
+        """
+        with open(file_path, 'r') as f:
+            labels = [ line.strip() for line in f if line.strip() != "" ]
+        return labels
+
+    def find_labels_by_pdf(self, citerius, pdf_path):
+        """
+        Returns labels of the papers whose pdf is the given file, or has
+        the same content (e.g. the pdf that was added, or another copy of it)
+        """
+        from pdf_store import file_sha256
+        size = os.path.getsize(pdf_path)
+        sha256 = None
+        labels = []
+        for label in citerius.index.labels():
+            paper_pdf = citerius.pdf_path(label)
+            if not os.path.exists(paper_pdf) or os.path.getsize(paper_pdf) != size:
+                continue
+            if os.path.samefile(paper_pdf, pdf_path):
+                labels.append(label)
+                continue
+            sha256 = sha256 or file_sha256(pdf_path)
+            if file_sha256(paper_pdf) == sha256:
+                labels.append(label)
+        return labels
 
     def get_fzf_label(self):
+        from config import CiteriusConfig
         citerius = CiteriusConfig(self.args.config)
-        self.args.label = citerius.fuzzy_find_label()
+        if self.args.remove:
+            # Several papers can be chosen for removal
+            self.fzf_labels = citerius.fuzzy_find_labels(multi=True)
+        else:
+            self.args.label = citerius.fuzzy_find_label()
+        citerius.close()
 
 if __name__ == "__main__":
     parser = CiteriusParser()
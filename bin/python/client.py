@@ -0,0 +1,247 @@
+"""
+Thin client of the Citerius daemon (see daemon.py), for the shell wrappers
+and the Vim plugin. It only uses the standard library and doesn't import
+the rest of Citerius, so a lookup costs python startup plus a round trip
+over the Unix socket. The daemon is started in the background if it's not
+running yet, and exits after 30 minutes without requests.
+
+Usage:
+    python client.py [--config FILE] COMMAND [ARGS...]
+
+Commands:
+    ping                         status of the daemon
+    socket                       path of the socket (the daemon is started)
+    request OP [JSON_ARGS]       raw request, prints json result
+    fzf [--multi]                fuzzy find paper label(s)
+    info LABEL                   csv fields of the paper (json)
+    pdf LABEL                    path to the pdf of the paper
+    preview LABEL [--page N | --figure N] [--size SIZE] [--kitty]
+                                 path of png thumbnail of the page (or shown
+                                 with the kitty graphics protocol)
+    bibtex LABEL                 bibtex entry of the paper
+    labels                       labels of all the papers
+    label-cache                  path of the label cache (label, author, year, title)
+    items LABEL ITEMS            equations/figures of the paper, e.g. "e12 f5"
+    search QUERY...              full-text search in the pdfs
+    download ARXIV_ID [--src] [--label LABEL]
+    remove LABEL...
+    stop                         stop the daemon
+"""
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import tempfile
+import subprocess
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SOCKET_ENV = "CITERIUS_SOCKET"
+# Seconds to wait for a freshly started daemon to listen
+START_TIMEOUT = 30
+# Seconds without requests after which an autostarted daemon exits
+AUTOSTART_IDLE_TIMEOUT = 30 * 60
+
+class DaemonError(RuntimeError):
+    pass
+
+def default_config_file():
+    return os.path.join(os.path.expanduser("~"), ".config/citerius/config.json")
+
+def socket_path(config_file=None):
+    """
+    Returns path of the socket of the daemon serving given config file
+    ($CITERIUS_SOCKET if it's set). Every config file gets its own daemon.
+    """
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    config_file = os.path.realpath(config_file or default_config_file())
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    config_hash = hashlib.sha256(config_file.encode()).hexdigest()[:12]
+    return os.path.join(runtime_dir, f"citerius-{os.getuid()}-{config_hash}.sock")
+
+class CiteriusClient():
+    def __init__(self, config_file=None, autostart=True):
+        """
+        Connection to the daemon of the library
+        Args:
+            config_file (str): path to json config file
+                (if None, then the default value is $HOME/.config/citerius/config.json)
+            autostart (bool): start the daemon if it's not running
+        """
+        self.config_file = config_file
+        self.socket_path = socket_path(config_file)
+        self.autostart = autostart
+        self.connection = None
+        self.stream = None
+
+    def connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.socket_path)
+        except OSError:
+            connection.close()
+            raise
+        self.connection = connection
+        self.stream = connection.makefile("rwb")
+
+    def ensure_connected(self):
+        if self.connection is not None:
+            return
+        try:
+            self.connect()
+            return
+        except OSError:
+            if not self.autostart:
+                raise DaemonError(f"Citerius daemon is not running ({self.socket_path})")
+        self.start_daemon()
+        deadline = time.monotonic() + START_TIMEOUT
+        while True:
+            try:
+                self.connect()
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise DaemonError("Citerius daemon didn't start, see " + \
+                                      self.log_file)
+                time.sleep(0.05)
+
+    @property
+    def log_file(self):
+        return self.socket_path[:-len(".sock")] + ".log"
+
+    def start_daemon(self):
+        """
+        Starts the daemon in the background, detached from this process
+        """
+        command = [ sys.executable, os.path.join(SCRIPT_DIR, "daemon.py"),
+                    "--socket", self.socket_path,
+                    "--idle-timeout", str(AUTOSTART_IDLE_TIMEOUT) ]
+        if self.config_file is not None:
+            command += [ "--config", self.config_file ]
+        with open(self.log_file, "ab") as log:
+            subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log,
+                             stderr=log, start_new_session=True)
+
+    def request(self, op, **args):
+        """
+        Sends a request to the daemon and returns its result
+        Raises:
+            DaemonError: if the daemon couldn't handle the request
+        """
+        self.ensure_connected()
+        self.stream.write((json.dumps({ "op": op, "args": args }) + "\n").encode())
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            self.close()
+            raise DaemonError("Citerius daemon closed the connection")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise DaemonError(response["error"])
+        return response["result"]
+
+    def close(self):
+        if self.connection is not None:
+            self.stream.close()
+            self.connection.close()
+            self.connection = None
+            self.stream = None
+
+    def fuzzy_find_labels(self, multi=False):
+        """
+        Runs fzf over the cached lines of the library (kept up to date by
+        the daemon), returns the chosen labels
+        """
+        lines_file = self.request("fzf_lines")
+        fzf_command = [ "fzf", "--delimiter", "\t", "--with-nth", "3.." ]
+        if multi:
+            fzf_command.append("--multi")
+        with open(lines_file, "rb") as f:
+            fzf = subprocess.run(fzf_command, stdin=f, stdout=subprocess.PIPE)
+        return [ line.split("\t")[1] for line in fzf.stdout.decode().splitlines() ]
+
+def main(argv):
+    config_file = None
+    if len(argv) >= 2 and argv[0] == "--config":
+        config_file, argv = argv[1], argv[2:]
+    if len(argv) == 0 or argv[0] in ("-h", "--help"):
+        print(__doc__.strip())
+        return 0
+    command, args = argv[0], argv[1:]
+
+    client = CiteriusClient(config_file, autostart=(command != "stop"))
+    try:
+        if command == "ping":
+            print(json.dumps(client.request("ping")))
+        elif command == "socket":
+            client.ensure_connected()
+            print(client.socket_path)
+        elif command == "request":
+            request_args = json.loads(args[1]) if len(args) > 1 else {}
+            print(json.dumps(client.request(args[0], **request_args)))
+        elif command == "fzf":
+            labels = client.fuzzy_find_labels(multi="--multi" in args)
+            if len(labels) == 0:
+                return 1
+            print("\n".join(labels))
+        elif command == "info":
+            print(json.dumps(client.request("info", label=args[0])))
+        elif command == "pdf":
+            print(client.request("pdf", label=args[0]))
+        elif command == "preview":
+            figure = int(args[args.index("--figure") + 1]) if "--figure" in args else None
+            path = client.request("preview", label=args[0],
+                                  page=int(args[args.index("--page") + 1]) if "--page" in args else 1,
+                                  figure=figure,
+                                  size=args[args.index("--size") + 1] if "--size" in args else "medium")
+            if "--kitty" in args:
+                from previews import kitty_image
+                sys.stdout.write(kitty_image(path) + "\n")
+            else:
+                print(path)
+        elif command == "bibtex":
+            print(client.request("bibtex", label=args[0]), end="")
+        elif command == "labels":
+            labels = client.request("labels")
+            if labels:
+                print("\n".join(labels))
+        elif command == "label-cache":
+            print(client.request("label_cache"))
+        elif command == "items":
+            for text in client.request("items", label=args[0], items=" ".join(args[1:])):
+                print(text)
+        elif command == "search":
+            results = client.request("search", query=" ".join(args))
+            if len(results) == 0:
+                print(f"Nothing found for '{' '.join(args)}'")
+            for label, page, snippet in results:
+                print(f"{label} (p. {page}): {' '.join(snippet.split())}")
+        elif command == "download":
+            label = args[args.index("--label") + 1] if "--label" in args else ""
+            print(client.request("download", target=args[0], label=label,
+                                 src='y' if "--src" in args else 'n'))
+        elif command == "remove":
+            removed = client.request("remove", labels=args)
+            print(f"{len(removed)} paper(s) were successfully removed.")
+        elif command == "stop":
+            try:
+                client.request("shutdown")
+            except DaemonError:
+                pass # Not running
+        else:
+            print(f"Unknown command: {command}", file=sys.stderr)
+            return 2
+    except (DaemonError, FileNotFoundError) as e:
+        print(f"citerius: {e}", file=sys.stderr)
+        return 1
+    except IndexError:
+        print(f"citerius: missing argument of {command}", file=sys.stderr)
+        return 2
+    finally:
+        client.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
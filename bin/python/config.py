@@ -1,29 +1,45 @@
-import pandas as pd
-from pyfzf import FzfPrompt
 from pathlib import Path
 from utils import CiteriusUtils
-from git import Repo, Actor
+from cache import CiteriusCache, default_cache_dir, library_state_dir
+from paper_index import CiteriusIndex
+from bib_index import BibtexIndex
+from profiling import span
 import shutil
+import subprocess
 import os
 import sys
 import re
 import json
 
 class CiteriusConfig():
-    def __init__(self, config_file=None):
+    def __init__(self, config_file=None, refresh=False):
         """
         Citerius config class. 
         Args:
             config_file (str): path to json config file 
                 (if None, then the default value is $HOME/user/.config/citerius/config.json)
+            refresh (bool): ignore cached arxiv/bibget metadata and refetch it
         """
         if config_file==None:
             self.config_file = os.path.join(Path.home(), ".config/citerius/config.json")
         else:
             self.config_file = config_file
-        self.extract_data_from_config_file()
-        self.cutils = CiteriusUtils()
+        self.refresh = refresh
+        with span("config.parse"):
+            self.extract_data_from_config_file()
+        with span("config.open_cache"):
+            self.cache = CiteriusCache(os.path.join(self.cache_dir, "metadata.sqlite"),
+                                       self.cache_ttl_days, self.cache_max_mb, 
+                                       refresh)
+        self.cutils = CiteriusUtils(self.cache)
         self.df_loaded = False
+        self._index = None
+        self._bib_index = None
+        self._search_index = None
+        self._previews = None
+        self._pdf_store = None
+        self._repo = None
+        self.session = None # Set by CiteriusSession that owns this config
 
     def extract_data_from_config_file(self):
         """
@@ -35,89 +51,489 @@ class CiteriusConfig():
         config = json.loads(json_str)
 
         self.parent_dir = config["references_dir"]
-        author_name = config["author_name"]
-        author_email = config["author_email"]
+        self.author_name = config["author_name"]
+        self.author_email = config["author_email"]
 
         self.csv_file = os.path.join(self.parent_dir, 'papers.csv')
         self.bibtex_file = os.path.join(self.parent_dir, 'bibliography.bib')
-        self.repo = Repo(self.parent_dir)
-        self.author = Actor(author_name, author_email)
+
+        # Optional cache settings
+        self.cache_dir = os.path.expanduser(config.get("cache_dir", default_cache_dir()))
+        self.cache_ttl_days = config.get("cache_ttl_days", 30)
+        self.cache_max_mb = config.get("cache_max_mb", 64)
+
+        # Optional limit of the size of extracted paper sources (None for no limit)
+        self.max_source_mb = config.get("max_source_mb", None)
+
+        # Optional budget of the page thumbnails (see previews.py)
+        self.preview_cache_mb = config.get("preview_cache_mb", 256)
+
+        # Store every pdf once, with the papers' pdfs linked to it (see pdf_store.py)
+        self.dedup_pdfs = config.get("dedup_pdfs", True)
+
+        # Directory for the data derived from this library (indices etc.)
+        self.state_dir = library_state_dir(self.parent_dir, self.cache_dir)
+
+    @property
+    def repo(self):
+        """
+        Git repository of the library (opened on first use, since most 
+        of the read-only operations don't need it)
+        """
+        if self._repo is None:
+            with span("git.open_repo"):
+                from git import Repo
+                self._repo = Repo(self.parent_dir)
+        return self._repo
+
+    @property
+    def author(self):
+        from git import Actor
+        return Actor(self.author_name, self.author_email)
+
+    def close(self):
+        """
+        Closes everything that was opened by this class
+        """
+        if self._repo is not None:
+            self._repo.close()
+            self._repo = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        if self._bib_index is not None:
+            self._bib_index.close()
+            self._bib_index = None
+        if self._search_index is not None:
+            self._search_index.close()
+            self._search_index = None
+        if self._previews is not None:
+            self._previews.close()
+            self._previews = None
+        self.cache.close()
+        self.cutils.close()
+
+    @property
+    def index(self):
+        """
+        Sqlite index of papers.csv (opened on first use)
+        """
+        if self._index is None:
+            self._index = CiteriusIndex(self.csv_file, 
+                                        os.path.join(self.state_dir, "papers.sqlite"))
+        return self._index
+
+    @property
+    def bib_index(self):
+        """
+        Byte-offset index of bibliography.bib (opened on first use)
+        """
+        if self._bib_index is None:
+            self._bib_index = BibtexIndex(self.bibtex_file, 
+                                          os.path.join(self.state_dir, "bibliography.sqlite"))
+        return self._bib_index
+
+    def get_bibtex_entry(self, label):
+        """
+        Returns bibtex entry of the paper with given label,
+        or None if there is no such entry
+        """
+        return self.bib_index.get_entry(label)
+
+    @property
+    def journal(self):
+        """
+        Changes of the library, derived from its git history
+        """
+        from journal import CiteriusJournal
+        return CiteriusJournal(self.parent_dir, self.state_dir)
+
+    @property
+    def search_index_file(self):
+        return os.path.join(self.state_dir, "search.sqlite")
+
+    @property
+    def search_index(self):
+        """
+        Full-text index of the pdfs (opened on first use)
+        """
+        if self._search_index is None:
+            from search_index import SearchIndex
+            self._search_index = SearchIndex(self.parent_dir, self.search_index_file)
+        return self._search_index
+
+    def search(self, query, workers=None, limit=20):
+        """
+        Finds papers whose text matches the query. The papers that were 
+        changed since the last search are indexed first.
+        Returns:
+            list of (label, page, snippet), the best matches first
+        """
+        with span("search.catch_up"):
+            self.catch_up_search_index(workers)
+        with span("search.query"):
+            return self.search_index.search(query, limit)
+
+    def catch_up_search_index(self, workers=None):
+        """
+        Updates the full-text index with the papers that changed since
+        the last commit it has seen. Everything is checked if the changes 
+        can't be found from git history.
+        """
+        head = self.journal.head()
+        changes = self.journal.changes_since(self.search_index.get_meta("head"))
+        if changes is None:
+            self.index.sync()
+            self.search_index.update(self.index.labels(), workers)
+        else:
+            self.search_index.remove(list(changes.removed))
+            self.search_index.update(list(changes.changed()), workers, prune=False)
+        if head is not None:
+            self.search_index.set_meta("head", head)
+
+    def update_search_index(self, labels):
+        """
+        Indexes the text of the papers that were just added, if the 
+        full-text index is used (i.e. the search was run before)
+        """
+        if not os.path.exists(self.search_index_file):
+            return
+        try:
+            with span("search.update", papers=len(labels)):
+                self.search_index.update(labels, prune=False)
+        except FileNotFoundError as e:
+            print(f"Papers weren't added to the search index: {e}")
+
+    def pdf_path(self, label):
+        return os.path.join(self.parent_dir, label, f"{label}.pdf")
+
+    @property
+    def previews(self):
+        """
+        Cache of page thumbnails of the papers
+        """
+        if self._previews is None:
+            from previews import PreviewCache
+            self._previews = PreviewCache(self.cache_dir, self.preview_cache_mb)
+        return self._previews
+
+    def prewarm_previews(self, labels):
+        """
+        Renders thumbnails of the papers that were just added in a detached
+        process (if pdftoppm is installed)
+        """
+        from previews import prewarm
+        labels = [ label for label in labels if os.path.exists(self.pdf_path(label)) ]
+        prewarm(self.config_file, labels)
+
+    @property
+    def pdf_store(self):
+        if self._pdf_store is None:
+            from pdf_store import PdfStore
+            self._pdf_store = PdfStore(self.parent_dir)
+        return self._pdf_store
+
+    def store_pdf(self, path):
+        """
+        Stores the pdf of a paper that was just added in the object store,
+        so that the same pdf is kept on disk once
+        """
+        if not self.dedup_pdfs or not os.path.exists(path):
+            return
+        try:
+            with span("pdf_store.add"):
+                self.pdf_store.add(path)
+        except OSError as e:
+            print(f"The pdf wasn't deduplicated: {e}")
+
+    def get_tex_index(self, label):
+        """
+        Returns index of equations and figures in the source of the paper
+        with given label (it is built on first lookup)
+        """
+        from tex_index import TexIndex
+        return TexIndex(self.parent_dir, label, self.tex_index_file(label))
+
+    def tex_index_file(self, label):
+        return os.path.join(self.state_dir, "tex", f"{label}.json")
+
+    def get_paper_info(self, label):
+        """
+        Returns dictionary csv column -> value for the paper with given label,
+        or None if there is no such paper
+        """
+        self.index.sync()
+        return self.index.get(label)
 
     def load_df(self):
         """
         Loads dataframe of all the papers. 
         Required to do anything with it.
         """
-        self.df = pd.read_csv(self.csv_file)
-        self.df_columns = self.df.columns.tolist()
+        with span("pandas.read_csv") as record:
+            import pandas as pd
+            self.df = pd.read_csv(self.csv_file)
+            record["rows"] = len(self.df)
+        self.df_columns = self.get_fzf_columns(self.df.columns.tolist())
+        self.df_loaded = True
 
+    def get_fzf_columns(self, columns):
+        """
+        Returns the columns that are shown in fzf
+        """
         # Remove columns that provide no useful info for fzf
         irrelevant_columns = [ "Download_pdf", "Download_link", "Download_src" ]
-        for col in irrelevant_columns:
-            self.df_columns.remove(col)
-
-        self.df_loaded = True
+        return [ col for col in columns if col not in irrelevant_columns ]
 
     def fuzzy_find_label(self): 
         """
         Performs fuzzy find over the database of all the papers,
         and returns the label of the requested paper
         """
-        if not self.df_loaded:
-            self.load_df()
-        list_of_lines = []
-        concat_str = ", "
-        for i in range(len(self.df)):
-            line = ""
-            for column in self.df_columns:
-                line = line + concat_str + str(self.df[column][i])
-            line = line[len(concat_str):] # remove leading ', ' string
-            list_of_lines.append(line)
-
-        fzf = FzfPrompt()
-        chosen_line = fzf.prompt(list_of_lines)
-        if len(chosen_line) == 0:
+        return self.fuzzy_find_labels()[0]
+
+    def fuzzy_find_labels(self, multi=False): 
+        """
+        Performs fuzzy find over the database of all the papers,
+        and returns the list of labels of the requested papers 
+        (several papers can be selected with Tab if multi is True).
+        Every line passed to fzf is "<row id>\t<label>\t<paper info>", 
+        and only paper info is shown, so the label is read from the 
+        chosen line directly.
+        """
+        fzf_path = shutil.which("fzf")
+        if fzf_path is None:
+            raise FileNotFoundError("fzf executable was not found in PATH")
+        fzf_command = [ fzf_path, "--delimiter", "\t", "--with-nth", "3.." ]
+        if multi:
+            fzf_command.append("--multi")
+
+        if self.fzf_cache_is_valid():
+            # Cached lines are passed to fzf directly, without python/pandas
+            with open(self.fzf_cache_file, "rb") as cache_file:
+                fzf = subprocess.run(fzf_command, stdin=cache_file, 
+                                     stdout=subprocess.PIPE)
+            chosen_lines = fzf.stdout
+        else:
+            fzf = subprocess.Popen(fzf_command, stdin=subprocess.PIPE, 
+                                   stdout=subprocess.PIPE)
+            self.build_fzf_lines(fzf.stdin)
+            chosen_lines = fzf.stdout.read()
+            fzf.wait()
+
+        chosen_lines = chosen_lines.decode().splitlines()
+        if len(chosen_lines) == 0:
             print("Fuzzy find failed - no papers found.")
             exit(0)
-        line_idx = list_of_lines.index(chosen_line[0])
+        labels = [ line.split("\t")[1] for line in chosen_lines ]
+        return labels
+
+    # Cache of the lines for fzf
+
+    @property
+    def fzf_cache_file(self):
+        return os.path.join(self.state_dir, "fzf_lines.txt")
+
+    @property
+    def fzf_signature_file(self):
+        return os.path.join(self.state_dir, "fzf_lines.json")
+
+    def fzf_cache_is_valid(self):
+        """
+        Checks whether cached fzf lines correspond to the current papers.csv.
+        The cache is valid if the csv has the same mtime and size, or the same
+        git blob hash (e.g. if it was rewritten by git with the same content)
+        """
+        if not (os.path.exists(self.fzf_cache_file) and 
+                os.path.exists(self.fzf_signature_file)):
+            return False
+        with open(self.fzf_signature_file) as f:
+            cached_signature = json.load(f)
+        signature = self.cutils.file_signature(self.csv_file)
+        if cached_signature.get("signature") == signature:
+            return True
+        blob_hash = self.cutils.git_blob_hash(self.csv_file)
+        if cached_signature.get("blob_hash") != blob_hash:
+            return False
+        self.save_fzf_signature(signature, blob_hash)
+        return True
+
+    def save_fzf_signature(self, signature, blob_hash):
+        with open(self.fzf_signature_file, "w") as f:
+            json.dump({ "signature": signature, "blob_hash": blob_hash }, f)
+
+    def build_fzf_lines(self, stream=None, chunk_size=2000):
+        """
+        Builds lines for fzf from papers.csv, chunk by chunk, and saves them 
+        into the cache. Every chunk is also written to the stream as soon as 
+        it's ready, so that fzf can show the first papers before the whole 
+        list is built.
+        Args:
+            stream (binary file): stream to write the lines to (e.g. fzf stdin). 
+                It is closed in the end
+            chunk_size (int): number of csv rows processed at once
+        """
+        import pandas as pd
+        os.makedirs(self.state_dir, exist_ok=True)
+        signature = self.cutils.file_signature(self.csv_file)
+        blob_hash = self.cutils.git_blob_hash(self.csv_file)
+
+        concat_str = ", "
+        tmp_cache_file = self.fzf_cache_file + ".tmp"
+        with open(tmp_cache_file, "wb") as cache_file:
+            for chunk in pd.read_csv(self.csv_file, chunksize=chunk_size):
+                columns = self.get_fzf_columns(chunk.columns.tolist())
+                # Missing values are shown as 'nan', like str() does
+                chunk = chunk.astype(object).fillna("nan").astype(str)
+                # Whole columns are concatenated at once
+                lines = chunk[columns[0]]
+                for column in columns[1:]:
+                    lines = lines + concat_str + chunk[column]
+                lines = (chunk.index.astype(str) + "\t" + 
+                         chunk["Label"] + "\t" + lines)
+                data = ("\n".join(lines) + "\n").encode()
+
+                cache_file.write(data)
+                if stream is not None:
+                    try:
+                        stream.write(data)
+                        stream.flush()
+                    except BrokenPipeError: # fzf has already exited
+                        stream = None
+        os.replace(tmp_cache_file, self.fzf_cache_file)
+        self.save_fzf_signature(signature, blob_hash)
 
-        label = self.df['Label'][line_idx]
-        return label
+        if stream is not None:
+            try:
+                stream.close()
+            except BrokenPipeError:
+                pass
+
+    # Compact cache of the labels, read by the editors for completion
+
+    @property
+    def label_cache_file(self):
+        return os.path.join(self.state_dir, "labels.tsv")
+
+    def label_cache_signature_line(self):
+        return f"#signature\t{self.cutils.file_signature(self.csv_file)}\n"
+
+    def label_cache_is_valid(self):
+        """
+        Checks whether the label cache was built from the current papers.csv
+        """
+        try:
+            with open(self.label_cache_file) as f:
+                return f.readline() == self.label_cache_signature_line()
+        except FileNotFoundError:
+            return False
+
+    def write_label_cache(self):
+        """
+        Writes the label cache: line "#signature<TAB><papers.csv signature>", 
+        followed by "label<TAB>short author<TAB>year<TAB>title" for every paper
+        """
+        signature_line = self.label_cache_signature_line()
+        self.index.sync()
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_file = self.label_cache_file + ".tmp"
+        # Tabs and newlines in the values would break the lines
+        clean = re.compile(r'[\t\r\n]').sub
+        short_author = self.cutils.short_author
+        with open(tmp_file, "w") as f:
+            f.write(signature_line)
+            f.writelines(f"{clean(' ', label)}\t{short_author(author)}\t"
+                         f"{clean(' ', year)}\t{clean(' ', title)}\n"
+                         for label, author, year, title in self.index.citation_rows())
+        os.replace(tmp_file, self.label_cache_file)
 
     def remove_paper(self, label: str):
         """
         Removes mentions of paper of provided label from csv, bib files, 
         as well as its directory
         """
-        labels_column = self.df.Label.tolist()
-        label_idx = labels_column.index(label)
-        
-        # Remove csv entry
-        self.cutils.remove_ith_line(self.csv_file, label_idx + 1)
-
-        # Remove bibtex entry
-        escaped_label = re.escape(label)
-        start_pattern = re.compile(r'^@[a-z]+\{%s\s*,' % escaped_label)  # Match "@article{<label>,"
-        end_pattern = re.compile(r'^\s*}\s*$\s*$')  # Match a line with only "}"
-        self.cutils.remove_multiline_block(self.bibtex_file, start_pattern, end_pattern)
+        self.index.sync()
+        if self.index.get(label) is None:
+            raise ValueError(f"No label {label} found in the dataframe!")
+        self.remove_papers([label])
+
+    def remove_papers(self, labels):
+        """
+        Removes mentions of papers of provided labels from csv, bib files, 
+        as well as their directories. Each file is rewritten only once, 
+        and all the changes are committed together.
+        Args:
+            labels (list of str): labels of papers to remove
+        Returns:
+            list of str: labels that were removed
+        """
+        self.index.sync()
+        labels = list(dict.fromkeys(labels)) # Remove duplicates, keep order
+        missing_labels = [ label for label in labels if self.index.get(label) is None ]
+        if missing_labels:
+            print(f"No papers with labels {', '.join(missing_labels)} found, skipping them")
+        labels = [ label for label in labels if label not in missing_labels ]
+        if len(labels) == 0:
+            return labels
+        labels_set = set(labels)
+
+        # Remove csv and bibtex entries
+        removed_rows = self.cutils.remove_csv_rows(self.csv_file, labels_set)
+        self.index.remove_rows(removed_rows)
+        self.bib_index.remove(labels_set)
         
-        # Remove directory with paper pdf and its src if needed
-        paper_dir = os.path.join(self.parent_dir, label)
-        try:
-            shutil.rmtree(paper_dir)
-        except:
-            print("Directory with the paper's pdf doesn't exist")
-        finally:
-            commit_message = f"Removed paper with label {label}"
-            self.git_update_files(commit_message)
+        # Remove directories with paper pdf and its src if needed
+        for label in labels:
+            paper_dir = os.path.join(self.parent_dir, label)
+            try:
+                shutil.rmtree(paper_dir)
+            except FileNotFoundError:
+                print(f"Directory with the pdf of paper {label} doesn't exist")
+            if os.path.exists(self.tex_index_file(label)):
+                os.remove(self.tex_index_file(label))
+        if os.path.exists(self.search_index_file):
+            self.search_index.remove(labels)
+
+        if len(labels) == 1:
+            commit_message = f"Removed paper with label {labels[0]}"
+        else:
+            commit_message = f"Removed papers with labels: {', '.join(labels)}"
+        self.git_update_files(commit_message)
+        return labels
+
+    def git_update_files(self, commit_message: str, paths=()):
+        """
+        Updates all necessary files and commits with a provided message.
+        If this config belongs to a session, the changes are only recorded, 
+        and committed later by the session's flush.
+        Args:
+            commit_message (str): commit message
+            paths (list of str): files to add in addition to csv and bib files
+        """
+        if self.session is not None:
+            self.session.stage(commit_message, paths)
+        else:
+            self.commit_files(commit_message, paths)
+
+    def stage_files(self, paths):
+        """
+        Stages files to be committed together with the next change
+        """
+        if self.session is not None:
+            self.session.stage(None, paths)
+        else:
+            self.repo.index.add(list(paths))
 
-    def git_update_files(self, commit_message: str):
+    def commit_files(self, commit_message: str, paths=()):
         """
-        Updates all necessary files and commits with a provided message
+        Stages csv, bib and provided files, and commits them right away
         """
         index = self.repo.index
-        index.add([self.csv_file, self.bibtex_file])
-        index.commit(commit_message, author=self.author, committer=self.author)
+        with span("git.commit", files=len(paths) + 2):
+            index.add([self.csv_file, self.bibtex_file] + list(paths))
+            index.commit(commit_message, author=self.author, committer=self.author)
+        # Editors complete the labels from the cache, so it follows every commit
+        self.write_label_cache()
 
 if __name__ == "__main__":
     #ref_dir = sys.argv[1]
@@ -125,5 +541,5 @@ if __name__ == "__main__":
     citerius = CiteriusConfig(config_file)
     label = citerius.fuzzy_find_label()
     print(label)
-    citerius.repo.close()
+    citerius.close()
     #citerius.remove_paper(label)
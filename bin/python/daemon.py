@@ -0,0 +1,272 @@
+"""
+Resident Citerius daemon. It keeps one session of the library open (config,
+indices, git repo handle, arxiv/bibget clients and metadata cache) and
+serves requests of client.py over a Unix socket, so that interactive
+lookups don't pay for starting python with pandas, arxiv and git again.
+
+Protocol: every request is a json line {"op": ..., "args": {...}}, answered
+with a json line {"ok": true, "result": ...} or {"ok": false, "error": ...}.
+A connection can send any number of requests. Lookups of different
+connections run concurrently; the requests that change the library
+(download, remove) run one at a time, so a download doesn't hold up the
+lookups.
+
+Usage:
+    python daemon.py [--config FILE] [--socket PATH] [--idle-timeout SECONDS]
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import socketserver
+from client import socket_path
+
+class CiteriusDaemon():
+    def __init__(self, config_file=None, idle_timeout=None):
+        """
+        State of the daemon, shared by all the connections
+        Args:
+            config_file (str): path to json config file
+                (if None, then the default value is $HOME/.config/citerius/config.json)
+            idle_timeout (float): seconds without requests after which the
+                daemon exits (None to run until stopped)
+        """
+        from session import CiteriusSession
+        self.config_file = config_file
+        self.session = CiteriusSession(config_file)
+        self.citerius = self.session.citerius
+        self.idle_timeout = idle_timeout
+        # Serializes the requests that change the library
+        self.write_lock = threading.Lock()
+        self.active_lock = threading.Lock()
+        self.active_requests = 0
+        self.start_time = time.time()
+        self.last_request = time.monotonic()
+        self.server = None
+
+    def warm_up(self):
+        """
+        Opens everything the lookups need, so that the first request is
+        as fast as the rest
+        """
+        self.citerius.index.sync()
+        self.citerius.bib_index.sync()
+        self.fzf_lines()
+        self.citerius.repo
+
+    def handle(self, request):
+        """
+        Returns response to the request (dictionary)
+        """
+        with self.active_lock:
+            self.active_requests += 1
+            self.last_request = time.monotonic()
+        try:
+            handler = getattr(self, f"op_{request['op']}", None)
+            if handler is None:
+                raise ValueError(f"Unknown request: {request['op']}")
+            return { "ok": True, "result": handler(**request.get("args", {})) }
+        except (Exception, SystemExit) as e:
+            # PaperDownloader exits on some errors
+            return { "ok": False, "error": str(e) or type(e).__name__ }
+        finally:
+            with self.active_lock:
+                self.active_requests -= 1
+                self.last_request = time.monotonic()
+
+    def fzf_lines(self):
+        if not self.citerius.fzf_cache_is_valid():
+            # Session lock keeps two lookups (or a commit) from writing
+            # the derived files at once
+            with self.session.lock:
+                if not self.citerius.fzf_cache_is_valid():
+                    self.citerius.build_fzf_lines()
+        return self.citerius.fzf_cache_file
+
+    def get_paper_info(self, label):
+        info = self.citerius.get_paper_info(label)
+        if info is None:
+            raise ValueError(f"No paper with label {label} found")
+        return info
+
+    # Requests
+
+    def op_ping(self):
+        return { "pid": os.getpid(), "library": self.citerius.parent_dir,
+                 "uptime": time.time() - self.start_time }
+
+    def op_fzf_lines(self):
+        return self.fzf_lines()
+
+    def op_info(self, label):
+        return self.get_paper_info(label)
+
+    def op_pdf(self, label):
+        self.get_paper_info(label)
+        path = self.citerius.pdf_path(label)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Pdf of the paper {label} is not downloaded")
+        return path
+
+    def op_preview(self, label, page=1, figure=None, size="medium"):
+        """
+        Returns path of png thumbnail of the page (or of the page with the
+        caption of the figure) of the paper
+        """
+        path = self.op_pdf(label)
+        with self.session.lock:
+            previews = self.citerius.previews
+        return previews.get(path, page, figure, size)
+
+    def op_bibtex(self, label):
+        entry = self.citerius.get_bibtex_entry(label)
+        if entry is None:
+            raise ValueError(f"No bibtex entry with label {label} found")
+        return entry
+
+    def op_label_cache(self):
+        if not self.citerius.label_cache_is_valid():
+            with self.session.lock:
+                if not self.citerius.label_cache_is_valid():
+                    self.citerius.write_label_cache()
+        return self.citerius.label_cache_file
+
+    def op_labels(self):
+        self.citerius.index.sync()
+        return self.citerius.index.labels()
+
+    def op_items(self, label, items):
+        return self.citerius.get_tex_index(label).find_items(items)
+
+    def op_search(self, query, limit=20):
+        with self.session.lock:
+            self.citerius.search_index # Opened once
+        return self.citerius.search(query, limit=limit)
+
+    def op_download(self, target, pdf='y', src='n', label=""):
+        """
+        Downloads new arxiv paper (papers from links and pdfs need the
+        bibliography info from the editor, so they are added with cli.py)
+        """
+        from paper_downloader import PaperDownloader
+        if not self.citerius.cutils.is_arxiv_id(target):
+            raise ValueError("Only arxiv papers can be downloaded through " + \
+                             "the daemon, use cli.py --download for the rest")
+        with self.write_lock:
+            paper_download = PaperDownloader(self.config_file, target,
+                                             session=self.session)
+            try:
+                paper_download.download_paper_without_user_input(pdf, src, label)
+            finally:
+                self.session.flush()
+            self.citerius.update_search_index([paper_download.label])
+        self.citerius.prewarm_previews([paper_download.label])
+        return paper_download.label
+
+    def op_remove(self, labels):
+        with self.write_lock:
+            try:
+                return self.citerius.remove_papers(labels)
+            finally:
+                self.session.flush()
+
+    def op_shutdown(self):
+        # The server can't be stopped from its own handler thread
+        threading.Thread(target=self.server.shutdown).start()
+        return True
+
+    def watch_idle(self):
+        """
+        Stops the server once it was idle for longer than idle_timeout
+        """
+        while True:
+            time.sleep(min(self.idle_timeout, 60))
+            with self.active_lock:
+                # A long download doesn't count as idle time
+                idle = self.active_requests == 0 and \
+                    time.monotonic() - self.last_request > self.idle_timeout
+            if idle:
+                self.server.shutdown()
+                return
+
+    def close(self):
+        self.session.flush()
+        self.session.close()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = { "ok": False, "error": f"Invalid request: {e}" }
+            else:
+                response = self.server.daemon.handle(request)
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+def is_listening(path):
+    """
+    Checks whether some process serves the socket
+    """
+    import socket
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        connection.close()
+
+def serve(config_file=None, path=None, idle_timeout=None):
+    """
+    Runs the daemon until it's stopped (or idle for idle_timeout seconds)
+    """
+    path = path or socket_path(config_file)
+    if os.path.exists(path):
+        if is_listening(path):
+            print(f"Citerius daemon is already running at {path}")
+            return
+        os.remove(path) # Left by a daemon that didn't exit cleanly
+
+    daemon = CiteriusDaemon(config_file, idle_timeout)
+    daemon.warm_up()
+    old_umask = os.umask(0o077) # Only the user can connect
+    try:
+        server = DaemonServer(path, RequestHandler)
+    finally:
+        os.umask(old_umask)
+    server.daemon = daemon
+    daemon.server = server
+    if idle_timeout:
+        threading.Thread(target=daemon.watch_idle, daemon=True).start()
+    print(f"Citerius daemon (pid {os.getpid()}) is serving " + \
+          f"{daemon.citerius.parent_dir} at {path}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+        daemon.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Citerius daemon")
+    parser.add_argument('--config', type=str, default=None,
+                        help='Path to Citerius config file')
+    parser.add_argument('--socket', type=str, default=None,
+                        help='Path to the socket (default is derived from the config path)')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='Exit after this many seconds without requests')
+    args = parser.parse_args()
+    serve(args.config, args.socket, args.idle_timeout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+In-process fuzzy filter for the paper list (used by the TUI instead of fzf).
+
+The query is split into space-separated terms, and a line matches when
+every term is a subsequence of it. Lines are lowercased once, when the
+filter is built. Matches are ranked fzf-like: contiguous matches first,
+then matches at the start of a word, then the ones with fewer gaps.
+Since a line that matches a query also matches all the prefixes of the
+query, the results of the previous query are filtered again when the
+query only grows, instead of the whole list.
+"""
+import re
+
+# Score of every matched character
+MATCH_SCORE = 16
+# Extra score of every character of a contiguous match
+CONTIGUOUS_BONUS = 8
+# Extra score of a match that starts at the beginning of a word
+BOUNDARY_BONUS = 12
+# Penalty of every skipped character inside a non-contiguous match
+GAP_PENALTY = 1
+
+class FuzzyTerm():
+    def __init__(self, term):
+        """
+        One (lowercase) term of the query. The leftmost subsequence match
+        is found by a regex like "[^a]*+(a[^b]*+b[^c]*+c)", which only
+        tries the start of the line and never backtracks, so it runs in
+        linear time in C
+        """
+        self.term = term
+        self.length = len(term)
+        chars = [ re.escape(char) for char in term ]
+        self.match = re.compile(f"[^{chars[0]}]*+({chars[0]}" + "".join(
+            f"[^{char}]*+{char}" for char in chars[1:]) + ")", re.S).match
+        self.contiguous_score = (MATCH_SCORE + CONTIGUOUS_BONUS) * self.length
+
+    def score(self, line):
+        """
+        Returns score of the term in the line,
+        or None if the term isn't a subsequence of the line
+        """
+        match = self.match(line)
+        if match is None:
+            return None
+        start, end = match.span(1)
+        if end - start == self.length:
+            score = self.contiguous_score
+        else:
+            # A contiguous match can only start after the leftmost one
+            position = line.find(self.term, end - self.length)
+            if position >= 0:
+                start = position
+                score = self.contiguous_score
+            else:
+                gaps = end - start - self.length
+                score = MATCH_SCORE * self.length - GAP_PENALTY * gaps
+        if start == 0 or not line[start - 1].isalnum():
+            score += BOUNDARY_BONUS
+        return score
+
+def split_query(query):
+    return query.lower().split()
+
+class FuzzyFilter():
+    def __init__(self, lines):
+        """
+        Incremental fuzzy filter over fixed list of lines
+        Args:
+            lines (list of str): lines to filter (e.g. "label author year title")
+        """
+        self.haystacks = [ line.lower() for line in lines ]
+        # (terms, matching indices) of the current query and of its
+        # prefixes, so that backspace doesn't filter again either
+        self.history = []
+
+    def __len__(self):
+        return len(self.haystacks)
+
+    def candidates(self, terms):
+        """
+        Returns indices of the lines that can match the terms: the results
+        of the longest previous query that the terms extend
+        """
+        while self.history:
+            previous_terms, results = self.history[-1]
+            if extends(terms, previous_terms):
+                return results
+            self.history.pop()
+        return range(len(self.haystacks))
+
+    def filter(self, query):
+        """
+        Returns indices of the lines matching the query, best first
+        (lines with the same score keep their order)
+        """
+        terms = split_query(query)
+        if len(terms) == 0:
+            self.history = []
+            return range(len(self.haystacks))
+        candidates = self.candidates(terms)
+        if self.history and self.history[-1][0] == terms:
+            return self.history[-1][1] # E.g. after backspace
+
+        haystacks = self.haystacks
+        # Sort keys are ints (faster to sort than tuples): best score first,
+        # then the order of the lines
+        n = len(haystacks)
+        scored = []
+        append = scored.append
+        if len(terms) == 1:
+            score = FuzzyTerm(terms[0]).score
+            for i in candidates:
+                s = score(haystacks[i])
+                if s is not None:
+                    append(i - s * n)
+        else:
+            scores = [ FuzzyTerm(term).score for term in terms ]
+            for i in candidates:
+                line = haystacks[i]
+                total = 0
+                for score in scores:
+                    s = score(line)
+                    if s is None:
+                        break
+                    total += s
+                else:
+                    append(i - total * n)
+        scored.sort()
+        results = [ key % n for key in scored ]
+        self.history.append((terms, results))
+        return results
+
+def extends(terms, previous_terms):
+    """
+    Checks whether every line matching terms also matches previous_terms,
+    i.e. the query only grew (longer last term or new terms)
+    """
+    if len(previous_terms) == 0 or len(terms) < len(previous_terms):
+        return False
+    n = len(previous_terms)
+    return terms[:n-1] == previous_terms[:n-1] and \
+        terms[n-1].startswith(previous_terms[n-1])
@@ -0,0 +1,265 @@
+"""
+Background jobs of the TUI (downloads, removals, sync). Jobs run on a
+pool of worker threads, so the key loop never waits for them, and report
+their progress (downloaded bytes of every file, current step) to their
+Job object. The runner can be put into a rich layout as is: it renders
+a panel with progress bar and transfer rate of every job.
+"""
+import sys
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds of transfer history the rate is computed from
+RATE_WINDOW = 3.0
+
+class Job():
+    def __init__(self, title, function, args):
+        """
+        Single background job
+        Args:
+            title (str): shown in the jobs panel
+            function (function): called as function(job, *args) by a worker
+            args (tuple): its arguments
+        """
+        self.title = title
+        self.function = function
+        self.args = args
+        self.state = "queued" # -> running -> done/failed
+        self.message = ""
+        self.error = None
+        self.result = None
+        self.start_time = None
+        self.end_time = None
+        self.lock = threading.Lock()
+        self.files = {} # name -> [downloaded_bytes, total_bytes]
+        self.samples = deque() # (time, downloaded bytes of all files)
+
+    def file_progress(self, name):
+        """
+        Returns progress function of the download of one file,
+        called as progress(downloaded_bytes, total_bytes)
+        (see transfer.download_file)
+        """
+        def progress(downloaded, total):
+            now = time.monotonic()
+            with self.lock:
+                self.files[name] = [downloaded, total]
+                self.samples.append((now, self.downloaded_bytes()))
+                while len(self.samples) > 2 and now - self.samples[1][0] > RATE_WINDOW:
+                    self.samples.popleft()
+        return progress
+
+    def set_message(self, message):
+        self.message = message
+
+    def downloaded_bytes(self):
+        return sum(downloaded for downloaded, _ in self.files.values())
+
+    def progress(self):
+        """
+        Returns (downloaded_bytes, total_bytes or None if some size is unknown)
+        """
+        with self.lock:
+            downloaded = self.downloaded_bytes()
+            if any(total is None for _, total in self.files.values()):
+                return downloaded, None
+            return downloaded, sum(total for _, total in self.files.values())
+
+    def rate(self):
+        """
+        Returns download rate in bytes per second over the last few seconds
+        """
+        with self.lock:
+            if self.state != "running" or len(self.samples) < 2:
+                return 0.0
+            (start, start_bytes), (end, end_bytes) = self.samples[0], self.samples[-1]
+        if end - start <= 0:
+            return 0.0
+        return (end_bytes - start_bytes) / (end - start)
+
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.monotonic()) - self.start_time
+
+    def is_active(self):
+        return self.state in ("queued", "running")
+
+class JobOutput():
+    def __init__(self, runner, stream):
+        """
+        Stand-in for sys.stdout while the TUI is shown. The lines printed
+        by a job become its message, the rest become the last message of
+        the runner, so that nothing is written over the screen
+        """
+        self.runner = runner
+        self.stream = stream
+
+    def write(self, text):
+        line = text.strip().splitlines()[-1] if text.strip() else ""
+        if line:
+            job = getattr(self.runner.local, "job", None)
+            if job is not None:
+                job.set_message(line)
+            else:
+                self.runner.message = line
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        return self.stream.fileno()
+
+class JobRunner():
+    def __init__(self, workers=3, max_finished=5):
+        """
+        Pool of worker threads running the jobs in the order of submission
+        Args:
+            workers (int): number of jobs that run at once
+            max_finished (int): number of finished jobs that are still shown
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="citerius-job")
+        self.max_finished = max_finished
+        self.jobs = []
+        self.message = ""
+        self.local = threading.local() # Job of the current worker thread
+        self.changed = threading.Condition()
+        self.version = 0 # Incremented when a job starts or ends
+
+    def submit(self, title, function, *args):
+        """
+        Queues function(job, *args) to run in the background
+        Returns:
+            Job: the queued job
+        """
+        job = Job(title, function, args)
+        with self.changed:
+            # Old finished jobs make room for the new one
+            finished = [ j for j in self.jobs if not j.is_active() ]
+            for old_job in finished[:max(0, len(finished) - self.max_finished + 1)]:
+                self.jobs.remove(old_job)
+            self.jobs.append(job)
+            self.notify()
+        self.executor.submit(self.run, job)
+        return job
+
+    def run(self, job):
+        with self.changed:
+            job.state = "running"
+            job.start_time = time.monotonic()
+            self.notify()
+        self.local.job = job
+        try:
+            job.result = job.function(job, *job.args)
+            state = "done"
+        except (Exception, SystemExit) as e:
+            # PaperDownloader exits on some errors
+            job.error = str(e) or type(e).__name__
+            state = "failed"
+        finally:
+            self.local.job = None
+        with self.changed:
+            job.state = state
+            job.end_time = time.monotonic()
+            self.notify()
+
+    def notify(self):
+        self.version += 1
+        self.changed.notify_all()
+
+    def active_jobs(self):
+        with self.changed:
+            return [ job for job in self.jobs if job.is_active() ]
+
+    def visible_jobs(self):
+        with self.changed:
+            return list(self.jobs)
+
+    def wait_for_update(self, version, timeout=None):
+        """
+        Waits until some job is running or a job started/ended since
+        the given version
+        Returns:
+            int: current version
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version or
+                                  any(job.state == "running" for job in self.jobs),
+                                  timeout)
+            return self.version
+
+    def capture_output(self):
+        """
+        Redirects sys.stdout to the jobs until restore_output
+        """
+        self.stdout = sys.stdout
+        sys.stdout = JobOutput(self, self.stdout)
+
+    def restore_output(self):
+        sys.stdout = self.stdout
+
+    def shutdown(self, wait=True, cancel_queued=False):
+        """
+        Stops the workers once the jobs are done
+        Args:
+            wait (bool): wait for the jobs to finish
+            cancel_queued (bool): drop the jobs that didn't start yet
+        """
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_queued)
+
+    def __rich__(self):
+        from rich.panel import Panel
+        from rich.table import Table
+        from rich.progress_bar import ProgressBar
+        table = Table.grid(padding=(0, 1), expand=True)
+        table.add_column(ratio=2, no_wrap=True, overflow="ellipsis")
+        table.add_column(width=24)
+        table.add_column(width=26, justify="right", no_wrap=True)
+        table.add_column(ratio=3, no_wrap=True, overflow="ellipsis")
+        for job in self.visible_jobs():
+            downloaded, total = job.progress()
+            if job.state == "queued":
+                bar = ProgressBar(total=1, completed=0, width=24)
+                numbers = ""
+                message, style = "Queued", "bright_black"
+            elif job.state == "running":
+                if total:
+                    bar = ProgressBar(total=total, completed=downloaded, width=24)
+                else:
+                    # Unknown size (or nothing downloaded yet)
+                    bar = ProgressBar(total=None, width=24,
+                                      animation_time=time.monotonic())
+                numbers = format_bytes(downloaded)
+                if total:
+                    numbers += f"/{format_bytes(total)}"
+                if downloaded > 0:
+                    numbers += f" {format_bytes(job.rate())}/s"
+                message, style = job.message, "bright_white"
+            else:
+                bar = ProgressBar(total=1, completed=1, width=24,
+                                  complete_style="green" if job.state == "done" else "red",
+                                  finished_style="green" if job.state == "done" else "red")
+                numbers = f"{job.elapsed():.1f} s"
+                if job.state == "done":
+                    message, style = "✓ " + (job.message or "Done"), "green"
+                else:
+                    message, style = "✗ " + job.error, "red"
+            table.add_row(job.title, bar, numbers, message, style=style)
+        title = "[bold]Jobs[/]"
+        if self.message:
+            title += f" [bright_black]{self.message}[/]"
+        return Panel(table, title=title, style="on rgb(20,20,20)", padding=(0, 1))
+
+def format_bytes(n_bytes):
+    for unit in ("B", "kB", "MB"):
+        if n_bytes < 1000:
+            return f"{n_bytes:.0f} {unit}" if unit == "B" else f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1000
+    return f"{n_bytes:.1f} GB"
@@ -0,0 +1,161 @@
+import os
+import re
+import csv
+import subprocess
+
+CSV_FILE = "papers.csv"
+BIBTEX_FILE = "bibliography.bib"
+
+# "@article{<label>," at the start of a bibtex entry, and the hunk header of
+# git diff, which ends with the entry that contains the hunk (with bibtex
+# diff driver, see gitattributes_file below)
+BIBTEX_START_PATTERN = re.compile(r'^@[A-Za-z]+\{\s*([^,\s]+)')
+HUNK_PATTERN = re.compile(r'^@@ [^@]* @@ ?(.*)$')
+
+class LibraryChanges():
+    def __init__(self, head, added=(), removed=(), modified=()):
+        """
+        Labels of the papers that were changed between two commits
+        Args:
+            head (str): commit, up to which the changes are computed
+            added, removed, modified (iterables of str): labels
+        """
+        self.head = head
+        self.added = set(added)
+        self.removed = set(removed)
+        self.modified = set(modified)
+
+    def changed(self):
+        """
+        Returns labels of the papers that exist after the changes,
+        but could differ from their previous state
+        """
+        return self.added | self.modified
+
+    def is_empty(self):
+        return not (self.added or self.removed or self.modified)
+
+    def __repr__(self):
+        return (f"LibraryChanges(head={self.head!r}, added={sorted(self.added)}, "
+                f"removed={sorted(self.removed)}, modified={sorted(self.modified)})")
+
+class CiteriusJournal():
+    def __init__(self, parent_dir, state_dir):
+        """
+        Journal of the changes of the library, derived from git history of
+        papers.csv and bibliography.bib. The derived data (caches, indices)
+        store the last commit they have seen, and catch up with the changes
+        since that commit instead of being rebuilt from the whole files.
+        Args:
+            parent_dir (str): directory of the library (git repository)
+            state_dir (str): directory for the data derived from the library
+        """
+        self.parent_dir = parent_dir
+        self.state_dir = state_dir
+
+    def git(self, *args):
+        result = subprocess.run(["git", "-C", self.parent_dir] + list(args),
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+        return result.stdout
+
+    def head(self):
+        """
+        Returns hash of the current commit (None if there are no commits)
+        """
+        try:
+            return self.git("rev-parse", "--verify", "-q", "HEAD").strip()
+        except RuntimeError:
+            return None
+
+    @property
+    def gitattributes_file(self):
+        """
+        Attributes file that enables the builtin bibtex diff driver for
+        bibliography.bib, so that hunk headers contain the entry they
+        belong to (the repository's own attributes are not changed)
+        """
+        path = os.path.join(self.state_dir, "gitattributes")
+        if not os.path.exists(path):
+            os.makedirs(self.state_dir, exist_ok=True)
+            with open(path, "w") as f:
+                f.write(f"{BIBTEX_FILE} diff=bibtex\n")
+        return path
+
+    def changes_since(self, commit):
+        """
+        Returns changes of the library between commit and HEAD,
+        or None if they can't be computed (no commit given, it's not in
+        the history anymore etc.), in which case everything that is derived
+        from the library has to be rebuilt
+        Args:
+            commit (str): last commit that the caller has seen
+        Returns:
+            LibraryChanges
+        """
+        head = self.head()
+        if commit is None or head is None:
+            return None
+        if commit == head:
+            return LibraryChanges(head)
+        try:
+            diff = self.git("-c", f"core.attributesFile={self.gitattributes_file}",
+                            "diff", "-U0", "--no-color", "--no-ext-diff",
+                            commit, head, "--", CSV_FILE, BIBTEX_FILE)
+        except RuntimeError:
+            return None
+        return self.parse_diff(diff, head)
+
+    def parse_diff(self, diff, head):
+        """
+        Finds the labels of the rows/entries that were added and removed
+        in the diff of papers.csv and bibliography.bib
+        """
+        added, removed, touched = set(), set(), set()
+        label_column = self.csv_label_column()
+        current_file = None
+        hunk_label = None
+        for line in diff.splitlines():
+            if line.startswith("diff --git"):
+                current_file = CSV_FILE if line.endswith(f"b/{CSV_FILE}") else BIBTEX_FILE
+                continue
+            if line.startswith("---") or line.startswith("+++"):
+                continue
+            match = HUNK_PATTERN.match(line)
+            if match:
+                # The entry in hunk header is only the changed one, if the
+                # first changed line isn't a start of another entry
+                header = BIBTEX_START_PATTERN.match(match.group(1))
+                hunk_label = header.group(1) if header else None
+                continue
+            if line[:1] not in ("+", "-"):
+                continue
+            labels = added if line[0] == "+" else removed
+            text = line[1:]
+            if current_file == CSV_FILE:
+                values = next(csv.reader([text]), [])
+                if values == [] or values[0] == "Title":
+                    continue # Header of the csv
+                if len(values) > label_column:
+                    labels.add(values[label_column])
+            else:
+                start = BIBTEX_START_PATTERN.match(text)
+                if start:
+                    labels.add(start.group(1))
+                elif hunk_label is not None:
+                    touched.add(hunk_label)
+                hunk_label = None
+
+        return LibraryChanges(head,
+                              added=added - removed,
+                              removed=removed - added,
+                              modified=((added & removed) | touched) - (added ^ removed))
+
+    def csv_label_column(self):
+        """
+        Returns index of Label column in papers.csv
+        """
+        with open(os.path.join(self.parent_dir, CSV_FILE), newline='') as f:
+            header = next(csv.reader(f), [])
+        return header.index("Label") if "Label" in header else 4
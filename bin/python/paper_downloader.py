@@ -1,13 +1,22 @@
-import pybtex as pbt
 from config import CiteriusConfig
+from session import CiteriusSession
 from pathlib import Path
-from urllib.request import urlretrieve
-from utils import CiteriusUtils
+from transfer import download_file, extract_source, is_valid_pdf
+from profiling import span
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import os
 import re
 import sys
-import arxiv
-import tarfile
+import time
+import shutil
+import threading
+
+# arXiv asks automated clients to use a single connection and to wait
+# 3 seconds between consecutive requests
+ARXIV_HOST = "arxiv.org"
+ARXIV_MIN_INTERVAL = 3.0
 
 class PaperDownloader():
 
@@ -15,6 +24,13 @@ class PaperDownloader():
                  download_id: str, 
                  first_time_download = True, 
                  no_commits = False,
+                 defer_records = False,
+                 citation_str = None,
+                 arxiv_result = None,
+                 refresh = False,
+                 session = None,
+                 paper_info = None,
+                 progress = None,
                  debug = False):
         """
         Class to set up and download the paper from its arxiv id.
@@ -31,20 +47,48 @@ class PaperDownloader():
                 was in the database before
             no_commits (bool): set to true if don't want to commit changes 
                 (in case downloading in bulk, for instance)
+            defer_records (bool): set to true if the csv/bibtex entries should 
+                not be appended by create_dirs. They are then appended later 
+                by the caller with append_bibtex (when record_pending is True)
+            citation_str (str): bibtex citation of the arxiv paper, if it was 
+                already obtained (e.g. with a batched lookup). 
+                If None, it is looked up here
+            arxiv_result (arxiv.Result): arxiv API result of the paper, if it 
+                was already obtained (e.g. with a batched query). 
+                If None, it is queried right before the download
+            refresh (bool): ignore cached arxiv/bibget metadata and refetch it
+            session (CiteriusSession): session to work in. Its config is used 
+                instead of reading config_file, and the commits are left to 
+                the session's flush
+            paper_info (dict): csv column -> value of the paper, if it was
+                already read from the library (only used with
+                first_time_download=False). If None, it is looked up by label
+            progress (function): called as progress(downloaded_bytes, total_bytes)
+                while the pdf is downloaded (total_bytes is None if it's unknown)
             debug (bool): debugging flag
         """
 
-        self.citerius = CiteriusConfig(config_file)
-        self.cutils = CiteriusUtils()
+        self.session = session
+        if session is None:
+            self.citerius = CiteriusConfig(config_file, refresh)
+        else:
+            self.citerius = session.citerius
+        self.cutils = self.citerius.cutils
         self.first_time_download = first_time_download
         self.no_commits = no_commits
+        self.defer_records = defer_records
+        self.record_pending = False
+        self.arxiv_result = arxiv_result
+        self.progress = progress
         self.debug = debug
 
         self.pdf_path = ""
         if self.first_time_download:
             self.arxiv_id, self.download_link = self.cutils.check_if_string_is_arxiv_id(download_id)
             if self.download_link == 'nan' and self.arxiv_id != 'nan' : # Arxiv paper
-                self.citation_str = self.cutils.get_citation_from_arxiv_id(self.arxiv_id)
+                if citation_str is None:
+                    citation_str = self.cutils.get_citation_from_arxiv_id(self.arxiv_id)
+                self.citation_str = citation_str
             else: # Paper with link to download or pdf of the file
                 editor = "vim"
                 self.get_citation_from_tmpfile(editor)
@@ -52,25 +96,25 @@ class PaperDownloader():
             self.get_arxiv_paper_info()
 
         else:
-            self.get_paper_info_from_citerius_df(download_id)
+            self.get_paper_info_from_citerius_df(download_id, paper_info)
 
-    def get_paper_info_from_citerius_df(self, label):
+    def get_paper_info_from_citerius_df(self, label, paper_info=None):
 
         # Obtain database entry, related to paper
-        self.citerius.load_df()
-        df_row = self.citerius.df[self.citerius.df.Label == label]
-        if df_row.empty:
+        if paper_info is None:
+            paper_info = self.citerius.get_paper_info(label)
+        if paper_info is None:
             raise ValueError(f"No label {label} found in the dataframe!")
 
-        self.full_authors     = df_row.Author.iloc[0]
-        self.full_title       = df_row.Title.iloc[0]
-        self.year             = df_row.Year.iloc[0]
-        self.arxiv_id         = str(df_row["ArXiv Number"].iloc[0])
-        self.default_label    = df_row.Label.iloc[0]
-        self.label            = df_row.Label.iloc[0]
-        self.download_ans     = df_row.Download_pdf.iloc[0]
-        self.download_src_ans = df_row.Download_src.iloc[0]
-        self.download_link    = df_row.Download_link.iloc[0]
+        self.full_authors     = paper_info["Author"]
+        self.full_title       = paper_info["Title"]
+        self.year             = paper_info["Year"]
+        self.arxiv_id         = str(paper_info["ArXiv Number"])
+        self.default_label    = paper_info["Label"]
+        self.label            = paper_info["Label"]
+        self.download_ans     = paper_info["Download_pdf"]
+        self.download_src_ans = paper_info["Download_src"]
+        self.download_link    = paper_info["Download_link"]
 
     def replace_label_for_citation(self):
         """
@@ -100,7 +144,9 @@ class PaperDownloader():
             print(self.citation_str)
             print(f"=========================")
             print(f"Initial label: {entry_name}")
-        bibdata = pbt.database.parse_string(self.citation_str, "bibtex").entries[entry_name]
+        with span("pybtex.parse"):
+            import pybtex.database
+            bibdata = pybtex.database.parse_string(self.citation_str, "bibtex").entries[entry_name]
         
         self.full_title = bibdata.fields['title']
         self.year = bibdata.fields['year']
@@ -122,6 +168,20 @@ class PaperDownloader():
         first_word_title_alpha = ''.join(char for char in first_word_title if char.isalpha())
         self.default_label = first_author_lastname + first_word_title_alpha + self.year
 
+    def needs_arxiv_download(self):
+        """
+        Checks whether the paper or its source would be downloaded from arxiv
+        """
+        if (str(self.download_link).lower() != 'nan' or 
+            str(self.arxiv_id).lower() == 'nan'):
+            return False
+        if self.first_time_download:
+            return True
+        self.setup_download_paths()
+        pdf_missing = (self.download_ans == 'y' and 
+                       not is_valid_pdf(self.download_path))
+        return pdf_missing or self.download_src_ans == 'y'
+
     # New paper download functions
 
     def setup_download_paths(self):
@@ -133,25 +193,28 @@ class PaperDownloader():
         self.download_path = os.path.join(self.download_dir, self.download_name)
 
         self.download_src_dir = os.path.join(self.download_dir, "src")
-        self.download_src_name = self.label + '.tar.gz'
-        self.download_src_path = os.path.join(self.download_src_dir, self.download_src_name)
 
     def append_bibtex(self):
         """
         Appends bibtex entry to the bibliography file,
         as well as this paper's string to csv file
         """
+        self.record_pending = False
     
         full_title_nocomma = self.full_title.replace(",","")
+        csv_values = [ full_title_nocomma, self.full_authors, self.arxiv_id, 
+                       self.year, self.label, self.download_ans, 
+                       self.download_src_ans, self.download_link ]
         csv_str = f"\"{full_title_nocomma}\",\"{self.full_authors}\",\"{self.arxiv_id}\",\"{self.year}\",\"{self.label}\",\"{self.download_ans}\",\"{self.download_src_ans}\",\"{self.download_link}\"\n"
     
-        csv_file = open(self.citerius.csv_file, "a")
-        csv_file.write(csv_str)
-        csv_file.close()
-    
-        bib_file = open(self.citerius.bibtex_file, "a")
-        bib_file.write(self.citation_str)
-        bib_file.close()
+        with span("paper.append_records", label=self.label):
+            self.citerius.index.sync()
+            csv_file = open(self.citerius.csv_file, "a")
+            csv_file.write(csv_str)
+            csv_file.close()
+            self.citerius.index.add_row([ str(value) for value in csv_values ])
+        
+            self.citerius.bib_index.append(self.citation_str)
 
     def create_dirs(self):
         """
@@ -160,7 +223,9 @@ class PaperDownloader():
         """
         try:
             os.mkdir(self.download_dir)
-            if self.first_time_download: self.append_bibtex()
+            if self.first_time_download:
+                if self.defer_records: self.record_pending = True
+                else: self.append_bibtex()
         except:
             print(f"There is already a paper with the label {self.label}")
             if self.download_src_ans == 'y':
@@ -320,7 +385,7 @@ class PaperDownloader():
             raise ValueError(f"In order to download from Citerius dataframe, please set up PaperDownloader class with first_time_download=False!")
         self.setup_download_paths()
         self.create_dirs()
-        if Path(self.download_path).exists(): 
+        if is_valid_pdf(self.download_path): 
             self.download_ans = 'n'
         self.download_paper_general()
 
@@ -330,22 +395,28 @@ class PaperDownloader():
         """
         General function to identify the method for paper download and download the paper itself
         """
-        if str(self.download_link).lower() == 'nan' and str(self.arxiv_id).lower() != 'nan':
-            self.download_arxiv_paper()
-        elif str(self.download_link).lower() != 'nan' and str(self.arxiv_id).lower() == 'nan':
-            self.download_paper_from_link()
-        elif (self.download_ans == 'n' and self.download_src_ans == 'n'):
-            if not self.first_time_download:
-                print(f"The paper {self.label} is a part of git repository, thus doesn't require download")
-                return
-            self.add_paper_from_pdf(self.pdf_path)
-        else:
-            print("Unknown situation, exiting...")
-            print(f"arxiv_id: {self.arxiv_id}")
-            print(f"download_link: {self.download_link}")
-            print(f"download_ans: {self.download_ans}")
-            print(f"download_src_ans: {self.download_src_ans}")
-            exit(1)
+        with span("paper.download", label=self.label):
+            if str(self.download_link).lower() == 'nan' and str(self.arxiv_id).lower() != 'nan':
+                self.download_arxiv_paper()
+            elif str(self.download_link).lower() != 'nan' and str(self.arxiv_id).lower() == 'nan':
+                self.download_paper_from_link()
+            elif (self.download_ans == 'n' and self.download_src_ans == 'n'):
+                if not self.first_time_download:
+                    print(f"The paper {self.label} is a part of git repository, thus doesn't require download")
+                    return
+                self.add_paper_from_pdf(self.pdf_path)
+            else:
+                print("Unknown situation, exiting...")
+                print(f"arxiv_id: {self.arxiv_id}")
+                print(f"download_link: {self.download_link}")
+                print(f"download_ans: {self.download_ans}")
+                print(f"download_src_ans: {self.download_src_ans}")
+                exit(1)
+
+        # Bulk downloads index all their papers at once
+        if self.session is None:
+            self.citerius.update_search_index([self.label])
+            self.citerius.prewarm_previews([self.label])
 
         if self.first_time_download and not self.no_commits:
             commit_message = f"Added paper with label {self.label}"
@@ -356,29 +427,44 @@ class PaperDownloader():
         Downloads paper or its source from arxiv
         """
         if (self.download_ans == 'y') or (self.download_src_ans == 'y'):
-            paper = next(arxiv.Client().results(arxiv.Search(id_list=[self.arxiv_id])))
+            if self.arxiv_result is None:
+                results = self.cutils.get_arxiv_results_from_ids([self.arxiv_id])
+                if self.arxiv_id not in results:
+                    raise ValueError(f"Paper {self.arxiv_id} was not found on arxiv")
+                self.arxiv_result = results[self.arxiv_id]
+            paper = self.arxiv_result
         
         if (self.download_ans == 'y'):
             print(f"Will start downloading the paper {self.label}")
-            paper.download_pdf(dirpath=self.download_dir, 
-                               filename=self.download_name)
+            download_file(self.get_arxiv_pdf_url(paper), self.download_path, 
+                          validate=is_valid_pdf, progress=self.progress)
+            self.citerius.store_pdf(self.download_path)
             print("Done!")
         if (self.download_src_ans == 'y'):
             print(f"Will start downloading source ofthe paper {self.label}")
-            paper.download_source(dirpath=self.download_src_dir, 
-                                  filename=self.download_src_name)
-            print("Download done! Uncompressing the .tar file...")
-            file = tarfile.open(self.download_src_path)
-            file.extractall(self.download_src_dir)
-            file.close()
-            os.remove(self.download_src_path)
+            src_url = self.get_arxiv_pdf_url(paper).replace("/pdf/", "/src/")
+            max_bytes = None
+            if self.citerius.max_source_mb is not None:
+                max_bytes = int(self.citerius.max_source_mb * 2**20)
+            # Source is extracted while it's being downloaded
+            extract_source(src_url, self.download_src_dir, 
+                           single_file_name=self.label, max_bytes=max_bytes)
             print("Done!")
 
+    def get_arxiv_pdf_url(self, paper):
+        """
+        Returns url of the pdf of arxiv API result
+        """
+        if paper.pdf_url:
+            return paper.pdf_url
+        return f"https://arxiv.org/pdf/{self.arxiv_id}"
+
     def add_paper_from_pdf(self, pdf_path):
         self.download_ans = 'n'
         self.download_src_ans = 'n'
         os.rename(pdf_path, self.download_path)
-        self.citerius.repo.index.add([self.download_path])
+        self.citerius.store_pdf(self.download_path)
+        self.citerius.stage_files([self.download_path])
 
     def download_paper_from_link(self):
         """
@@ -386,21 +472,113 @@ class PaperDownloader():
         """
         if (self.download_ans == 'y'):
             print(f"Will start downloading the paper {self.label}")
-            urlretrieve(self.download_link, self.download_path)
+            download_file(self.download_link, self.download_path, 
+                          validate=is_valid_pdf, progress=self.progress)
+            self.citerius.store_pdf(self.download_path)
             print("Done!")
 
+class HostRateLimiter():
+    def __init__(self, per_host_limit=2, host_limits=None, min_intervals=None):
+        """
+        Caps the number of simultaneous downloads from every host, and 
+        optionally spaces out consecutive downloads from the same host.
+        Args:
+            per_host_limit (int): default number of simultaneous downloads 
+                from a single host
+            host_limits (dict): host -> number of simultaneous downloads, 
+                overrides per_host_limit for specific hosts
+            min_intervals (dict): host -> minimal number of seconds between 
+                the starts of two downloads from that host
+        """
+        self.per_host_limit = per_host_limit
+        self.host_limits = {ARXIV_HOST: 1}
+        self.min_intervals = {ARXIV_HOST: ARXIV_MIN_INTERVAL}
+        if host_limits: self.host_limits.update(host_limits)
+        if min_intervals: self.min_intervals.update(min_intervals)
+
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.last_start = {}
+
+    def get_semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                limit = self.host_limits.get(host, self.per_host_limit)
+                self.semaphores[host] = threading.Semaphore(limit)
+            return self.semaphores[host]
+
+    @contextmanager
+    def slot(self, host):
+        """
+        Context manager that holds one of the download slots of the host.
+        Downloads with host None (local files) are not limited.
+        """
+        if host is None:
+            yield
+            return
+        semaphore = self.get_semaphore(host)
+        with span("rate_limit.wait", host=host):
+            semaphore.acquire()
+            interval = self.min_intervals.get(host, 0)
+            if interval > 0:
+                # Only slot holders get here, so for single-slot hosts 
+                # (like arxiv) the starts are spaced by at least interval
+                with self.lock:
+                    start = max(time.monotonic(), 
+                                self.last_start.get(host, -interval) + interval)
+                    self.last_start[host] = start
+                delay = start - time.monotonic()
+                if delay > 0: time.sleep(delay)
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def host_for_paper(self, arxiv_id, download_link):
+        """
+        Returns the host the paper will be downloaded from 
+        (None for the papers that are added from local pdf files)
+        """
+        if str(download_link).lower() != 'nan':
+            return urlparse(str(download_link)).netloc.lower() or None
+        elif str(arxiv_id).lower() != 'nan':
+            return ARXIV_HOST
+        return None
+
 class BulkDownloader():
-    def __init__(self, config_file=None, download_mode="new"):
+    def __init__(self, config_file=None, download_mode="new", 
+                 workers=1, per_host_limit=2, refresh=False,
+                 session=None, limiter=None, progress=None):
         """
-        Download a bunch of papers at once
+        Download a bunch of papers at once. All the papers share one session, 
+        which is flushed in the end of every bulk download.
         Args:
             config_file (str): path to json config file 
                 (if None, then the default value is $HOME/user/.config/citerius/config.json)
             download_mode (str): how the papers will be downloaded
-        """
-        self.citerius = CiteriusConfig(config_file)
+            workers (int): number of papers that are downloaded simultaneously
+            per_host_limit (int): number of simultaneous downloads from a 
+                single host (arxiv is always limited to one)
+            refresh (bool): ignore cached arxiv/bibget metadata and refetch it
+            session (CiteriusSession): session to work in (e.g. the one of 
+                the TUI), instead of a new one
+            limiter (HostRateLimiter): limiter shared with other downloads
+                of the process, instead of a new one
+            progress (function): download id -> progress function of its 
+                pdf download (see PaperDownloader)
+        """
+        if session is None:
+            session = CiteriusSession(config_file, refresh)
+        self.session = session
+        self.citerius = self.session.citerius
+        self.cutils = self.citerius.cutils
+        self.refresh = refresh
         self.ref_dir = self.citerius.parent_dir
         self.config_file = config_file
+        self.workers = max(1, int(workers))
+        self.arxiv_results = {}
+        self.limiter = limiter or HostRateLimiter(per_host_limit)
+        self.progress = progress
 
         if download_mode == "new":
             self.download_params = ['y', 'n', "", 'n']
@@ -409,34 +587,236 @@ class BulkDownloader():
         else:
             raise ValueError(f"Unknown value for download_mode: {download_mode}")
 
-    def download_from_list(self, list, first_time_download=True):
+    def download_from_list(self, list, first_time_download=True, 
+                           paper_infos=None):
         """
         Download papers from python list, either with Citerius, or with 
-        general download without user intervention
-        """
+        general download without user intervention.
+        Up to self.workers papers are downloaded at once, but the csv/bibtex 
+        entries are appended in the order of the list, and all the changes 
+        are committed once in the end.
+        Args:
+            list (list of str): arxiv ids/links/pdf paths, or labels if 
+                first_time_download is False
+            first_time_download (bool): whether the papers are new
+            paper_infos (dict): label -> csv column -> value, paper info of 
+                the labels that was already read from the library
+        """
+        if paper_infos is None: paper_infos = {}
+        # Citations of all the new arxiv papers are obtained in one go
+        citations = {}
+        if first_time_download:
+            arxiv_ids = [ download_id for download_id in list 
+                          if self.cutils.is_arxiv_id(download_id) ]
+            if len(arxiv_ids) > 1:
+                try:
+                    citations = self.cutils.get_citations_from_arxiv_ids(arxiv_ids)
+                except Exception as e:
+                    print(f"Batched citation lookup failed ({e}), " + \
+                          "will look up the papers one by one")
+
+        # Papers that need user input (bibliography info for links and pdfs),
+        # only local data or already have their citation are set up here, 
+        # one after another. Remaining arxiv papers require network for their 
+        # setup, so it's done by the workers
+        jobs = []
+        for download_id in list:
+            if (first_time_download and self.cutils.is_arxiv_id(download_id) 
+                and download_id not in citations):
+                paper_download = None
+                host = ARXIV_HOST
+            else:
+                paper_download = PaperDownloader(self.config_file, download_id, 
+                                                 first_time_download, 
+                                                 no_commits=True, 
+                                                 defer_records=True,
+                                                 citation_str=citations.get(download_id),
+                                                 refresh=self.refresh,
+                                                 session=self.session,
+                                                 paper_info=paper_infos.get(download_id),
+                                                 progress=self.get_progress(download_id))
+                host = self.limiter.host_for_paper(paper_download.arxiv_id, 
+                                                   paper_download.download_link)
+            jobs.append((download_id, paper_download, host))
+
+        # Arxiv API results of all the arxiv papers are obtained in one go
+        arxiv_ids = []
+        for download_id, paper_download, _ in jobs:
+            if paper_download is None:
+                arxiv_ids.append(download_id)
+            elif paper_download.needs_arxiv_download():
+                arxiv_ids.append(paper_download.arxiv_id)
+        self.arxiv_results = {}
+        if len(arxiv_ids) > 1:
+            try:
+                self.arxiv_results = self.cutils.get_arxiv_results_from_ids(arxiv_ids)
+            except Exception as e:
+                print(f"Batched arxiv query failed ({e}), " + \
+                      "will query the papers one by one")
+
+        with span("bulk.download", papers=len(jobs), workers=self.workers), \
+             ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [ executor.submit(self.run_download_job, *job, 
+                                        first_time_download) 
+                        for job in jobs ]
+
         concat_string = ", "
         labels_str = ""
-        for download_id in list:
-            paper_download = PaperDownloader(self.config_file, download_id, 
-                                             first_time_download, no_commits=True)
+        failed_ids = []
+        downloaded_labels = []
+        for (download_id, _, _), future in zip(jobs, futures):
+            try:
+                paper_download = future.result()
+            except (Exception, SystemExit) as e:
+                print(f"Failed to download {download_id}: {e}")
+                failed_ids.append(download_id)
+                continue
+            if paper_download.record_pending:
+                paper_download.append_bibtex()
+            downloaded_labels.append(paper_download.label)
             if first_time_download:
-                paper_download.download_paper_without_user_input(*self.download_params)
                 labels_str+= concat_string + paper_download.label
-            else:
-                paper_download.download_paper_from_citerius_df()
 
-        if first_time_download:
+        if first_time_download and labels_str:
             labels_str = labels_str[len(concat_string):]
             commit_message = f"Added papers with labels: {labels_str}"
             self.citerius.git_update_files(commit_message)
-
-    def download_from_citerius(self):
-        """
-        Downloads all papers from Citerius dataframe
-        """
-        self.citerius.load_df()
-        labels_list = self.citerius.df.Label.tolist()
-        self.download_from_list(labels_list, first_time_download=False)
+        with span("bulk.commit"):
+            self.session.flush()
+        self.citerius.update_search_index(downloaded_labels)
+        self.citerius.prewarm_previews(downloaded_labels)
+        if failed_ids:
+            print(f"Failed to download {len(failed_ids)} paper(s): " + \
+                  concat_string.join(failed_ids))
+        return failed_ids
+
+    def get_progress(self, download_id):
+        if self.progress is None:
+            return None
+        return self.progress(download_id)
+
+    def run_download_job(self, download_id, paper_download, host, 
+                         first_time_download):
+        """
+        Downloads a single paper (called by the worker threads). 
+        If the download fails, the directory created for the paper is 
+        removed, so that the paper can be downloaded again later.
+        """
+        with self.limiter.slot(host), span("bulk.job", id=download_id, host=host):
+            if paper_download is None:
+                paper_download = PaperDownloader(self.config_file, download_id, 
+                                                 first_time_download, 
+                                                 no_commits=True, 
+                                                 defer_records=True,
+                                                 refresh=self.refresh,
+                                                 session=self.session,
+                                                 progress=self.get_progress(download_id))
+            if paper_download.arxiv_result is None:
+                paper_download.arxiv_result = self.arxiv_results.get(paper_download.arxiv_id)
+            try:
+                if first_time_download:
+                    paper_download.download_paper_without_user_input(*self.download_params)
+                else:
+                    paper_download.download_paper_from_citerius_df()
+            except BaseException:
+                if paper_download.record_pending:
+                    shutil.rmtree(paper_download.download_dir, ignore_errors=True)
+                raise
+        return paper_download
+
+    def plan_restore(self):
+        """
+        Finds pdfs and sources of the papers in Citerius dataframe that are 
+        missing on disk, using a single read of the library.
+        Returns:
+            list of dicts with keys "label", "info" (paper info with 
+            Download_pdf/Download_src set to what actually has to be 
+            downloaded), "pdf", "src" (bool), "host" and "url" (url of the 
+            pdf if it's known without asking arxiv, otherwise None)
+        """
+        plan = []
+        for info in self.citerius.index.all_rows():
+            label = info["Label"]
+            arxiv_id = str(info["ArXiv Number"])
+            download_link = str(info["Download_link"])
+            host = self.limiter.host_for_paper(arxiv_id, download_link)
+            if host is None:
+                continue # Pdf is a part of git repository
+
+            paper_dir = os.path.join(self.citerius.parent_dir, label)
+            pdf_path = os.path.join(paper_dir, label + '.pdf')
+            src_dir = os.path.join(paper_dir, "src")
+            need_pdf = info["Download_pdf"] == 'y' and not is_valid_pdf(pdf_path)
+            need_src = (info["Download_src"] == 'y' and download_link.lower() == 'nan' 
+                        and not (os.path.isdir(src_dir) and os.listdir(src_dir)))
+            if not need_pdf and not need_src:
+                continue
+
+            planned_info = dict(info)
+            planned_info["Download_pdf"] = 'y' if need_pdf else 'n'
+            planned_info["Download_src"] = 'y' if need_src else 'n'
+            url = download_link if download_link.lower() != 'nan' else None
+            plan.append({ "label": label, "info": planned_info, 
+                          "pdf": need_pdf, "src": need_src, 
+                          "host": host, "url": url })
+        return plan
+
+    def estimate_restore_size(self, plan):
+        """
+        Asks the hosts for sizes of the planned downloads. Arxiv papers are 
+        not asked, since every request to arxiv costs a rate-limited slot.
+        Returns:
+            (known_bytes, number of downloads with unknown size)
+        """
+        def get_size(item):
+            with self.limiter.slot(item["host"]):
+                return self.cutils.get_remote_file_size(item["url"])
+
+        items = [ item for item in plan if item["pdf"] and item["url"] ]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            sizes = list(executor.map(get_size, items))
+        known_bytes = sum(size for size in sizes if size is not None)
+        n_downloads = sum(item["pdf"] + item["src"] for item in plan)
+        n_unknown = n_downloads - sum(size is not None for size in sizes)
+        return known_bytes, n_unknown
+
+    def print_restore_summary(self, plan):
+        """
+        Prints what will be downloaded to restore the library
+        """
+        n_pdfs = sum(item["pdf"] for item in plan)
+        n_srcs = sum(item["src"] for item in plan)
+        print(f"Papers to restore: {len(plan)} " + \
+              f"({n_pdfs} pdf(s), {n_srcs} source(s))")
+        if not plan:
+            return
+        hosts = {}
+        for item in plan:
+            hosts[item["host"]] = hosts.get(item["host"], 0) + item["pdf"] + item["src"]
+        for host, count in sorted(hosts.items(), key=lambda x: -x[1]):
+            print(f"    {host}: {count} file(s)")
+        known_bytes, n_unknown = self.estimate_restore_size(plan)
+        size_str = f"Download size: {known_bytes / 2**20:.1f} MB"
+        if n_unknown:
+            size_str += f" + {n_unknown} file(s) of unknown size"
+        print(size_str)
+
+    def download_from_citerius(self, dry_run=False):
+        """
+        Downloads all the missing papers and sources from Citerius dataframe
+        Args:
+            dry_run (bool): only print what would be downloaded
+        """
+        with span("bulk.plan_restore") as record:
+            plan = self.plan_restore()
+            record["papers"] = len(plan)
+        self.print_restore_summary(plan)
+        if dry_run or not plan:
+            return []
+        paper_infos = dict((item["label"], item["info"]) for item in plan)
+        return self.download_from_list([ item["label"] for item in plan ], 
+                                       first_time_download=False, 
+                                       paper_infos=paper_infos)
 
     def download_from_file(self, file_path):
         """
@@ -0,0 +1,253 @@
+import os
+import csv
+import sqlite3
+import threading
+
+# Columns of papers.csv and the corresponding columns of the index
+CSV_COLUMNS = [
+    ("Title", "title"),
+    ("Author", "author"),
+    ("ArXiv Number", "arxiv"),
+    ("Year", "year"),
+    ("Label", "label"),
+    ("Download_pdf", "download_pdf"),
+    ("Download_src", "download_src"),
+    ("Download_link", "download_link"),
+]
+
+class CiteriusIndex():
+    def __init__(self, csv_file, index_file):
+        """
+        Sqlite index of papers.csv, which allows to look up papers by their
+        label (primary key), arxiv number or year without parsing the csv.
+        The index is rebuilt from the csv whenever the csv was changed
+        by something other than this class (git pull, manual edit etc.),
+        so papers.csv stays the source of truth.
+        Args:
+            csv_file (str): path to papers.csv
+            index_file (str): path to sqlite file of the index
+        """
+        self.csv_file = csv_file
+        self.index_file = index_file
+        self.lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        self.connection = sqlite3.connect(self.index_file, timeout=30,
+                                          check_same_thread=False)
+        columns = ", ".join(f"{column} TEXT" for _, column in CSV_COLUMNS
+                            if column != "label")
+        self.connection.executescript(f"""
+            CREATE TABLE IF NOT EXISTS papers (
+                label TEXT PRIMARY KEY,
+                row INTEGER NOT NULL,
+                {columns}
+            );
+            CREATE INDEX IF NOT EXISTS papers_row ON papers(row);
+            CREATE INDEX IF NOT EXISTS papers_arxiv ON papers(arxiv);
+            CREATE INDEX IF NOT EXISTS papers_year ON papers(year);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.connection.commit()
+        self.sync()
+
+    # Keeping the index in sync with the csv file
+
+    def csv_signature(self):
+        """
+        Returns string that changes whenever papers.csv changes
+        """
+        stat = os.stat(self.csv_file)
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?",
+                                      (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                (key, value))
+
+    def sync(self):
+        """
+        Rebuilds the index if papers.csv has changed since the last update
+        """
+        with self.lock:
+            if self.get_meta("csv_signature") != self.csv_signature():
+                self.rebuild()
+
+    def rebuild(self):
+        """
+        Rebuilds the whole index from papers.csv
+        """
+        with self.lock:
+            with open(self.csv_file, newline='') as f:
+                reader = csv.reader(f)
+                header = next(reader, [])
+                rows = ( (i, self.normalize_row(header, values))
+                         for i, values in enumerate(reader) )
+                self.connection.execute("DELETE FROM papers")
+                self.connection.executemany(
+                    self.insert_statement(),
+                    ( (row[1]["label"], row[0]) +
+                      tuple(row[1][column] for _, column in CSV_COLUMNS
+                            if column != "label")
+                      for row in rows ))
+            self.set_meta("csv_signature", self.csv_signature())
+            self.connection.commit()
+
+    def insert_statement(self):
+        # The first row with a given label wins, like in the csv lookups
+        placeholders = ", ".join("?" * (len(CSV_COLUMNS) + 1))
+        columns = ", ".join(column for _, column in CSV_COLUMNS
+                            if column != "label")
+        return (f"INSERT OR IGNORE INTO papers (label, row, {columns}) "
+                f"VALUES ({placeholders})")
+
+    def normalize_row(self, header, values):
+        """
+        Returns dictionary index column -> value for a csv row.
+        Empty values are stored as 'nan', the same way pandas reads them.
+        """
+        by_name = dict(zip(header, values))
+        row = {}
+        for csv_column, column in CSV_COLUMNS:
+            value = by_name.get(csv_column, "")
+            row[column] = value if value != "" else "nan"
+        return row
+
+    # Updates after Citerius changes the csv file itself
+
+    def add_row(self, values):
+        """
+        Adds a row that was just appended to papers.csv
+        Args:
+            values (list of str): values of the row, in the order of CSV_COLUMNS
+        """
+        with self.lock:
+            row = self.normalize_row([ name for name, _ in CSV_COLUMNS ], values)
+            next_row = self.connection.execute(
+                "SELECT COALESCE(MAX(row) + 1, 0) FROM papers").fetchone()[0]
+            self.connection.execute(
+                self.insert_statement(),
+                (row["label"], next_row) +
+                tuple(row[column] for _, column in CSV_COLUMNS if column != "label"))
+            self.set_meta("csv_signature", self.csv_signature())
+            self.connection.commit()
+
+    def remove_rows(self, rows):
+        """
+        Removes rows that were just removed from papers.csv
+        Args:
+            rows (list of int): numbers of the removed rows (without header)
+        """
+        with self.lock:
+            self.connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS removed_rows (row INTEGER PRIMARY KEY)")
+            self.connection.execute("DELETE FROM removed_rows")
+            self.connection.executemany("INSERT OR IGNORE INTO removed_rows VALUES (?)",
+                                        ( (row,) for row in rows ))
+            self.connection.execute(
+                "DELETE FROM papers WHERE row IN (SELECT row FROM removed_rows)")
+            # Every row moves up by the number of removed rows before it
+            self.connection.execute("""
+                UPDATE papers SET row = row - (
+                    SELECT COUNT(*) FROM removed_rows WHERE removed_rows.row < papers.row)
+            """)
+            self.connection.execute("DELETE FROM removed_rows")
+            self.set_meta("csv_signature", self.csv_signature())
+            self.connection.commit()
+
+    # Lookups
+
+    def get(self, label):
+        """
+        Returns dictionary csv column -> value for the paper with given label,
+        or None if there is no such paper
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT * FROM papers WHERE label = ?", (label,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return self.row_to_dict(cursor.description, row)
+
+    def get_row_number(self, label):
+        """
+        Returns the number of paper's row in papers.csv (without header),
+        or None if there is no such paper
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT row FROM papers WHERE label = ?", (label,)).fetchone()
+        return None if row is None else row[0]
+
+    def labels(self):
+        """
+        Returns list of all the labels, in the order of papers.csv
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT label FROM papers ORDER BY row").fetchall()
+        return [ row[0] for row in rows ]
+
+    def all_rows(self):
+        """
+        Returns list of dictionaries csv column -> value for all the papers,
+        in the order of papers.csv
+        """
+        with self.lock:
+            cursor = self.connection.execute("SELECT * FROM papers ORDER BY row")
+            rows = cursor.fetchall()
+            return [ self.row_to_dict(cursor.description, row) for row in rows ]
+
+    def citation_rows(self):
+        """
+        Returns list of (label, author, year, title) of all the papers,
+        in the order of papers.csv
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT label, author, year, title FROM papers ORDER BY row").fetchall()
+
+    def find_by_arxiv(self, arxiv_id):
+        """
+        Returns list of labels of the papers with given arxiv number
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT label FROM papers WHERE arxiv = ? ORDER BY row",
+                (arxiv_id,)).fetchall()
+        return [ row[0] for row in rows ]
+
+    def find_by_link(self, link):
+        """
+        Returns list of labels of the papers downloaded from given link
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT label FROM papers WHERE download_link = ? ORDER BY row",
+                (link,)).fetchall()
+        return [ row[0] for row in rows ]
+
+    def find_by_year(self, year):
+        """
+        Returns list of labels of the papers from given year
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT label FROM papers WHERE year = ? ORDER BY row",
+                (str(year),)).fetchall()
+        return [ row[0] for row in rows ]
+
+    def row_to_dict(self, description, row):
+        names = dict((column, name) for name, column in CSV_COLUMNS)
+        return dict( (names.get(column[0], column[0]), value)
+                     for column, value in zip(description, row) )
+
+    def close(self):
+        self.connection.close()
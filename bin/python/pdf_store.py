@@ -0,0 +1,307 @@
+"""
+Content-addressed storage of the pdfs of a library.
+
+Every pdf is stored once in <references_dir>/.citerius-objects, under its
+sha256, and <label>/<label>.pdf is a reflink (copy-on-write clone, on btrfs,
+xfs etc.) or a hardlink of the stored object, so the same paper under two
+labels, or the same pdf imported twice, takes the disk space once.
+Objects are read-only. Without reflinks this also makes the hardlinked
+pdfs of the papers read-only, so that an editor has to write a new file
+(which breaks the link) instead of changing the pdf of every label in
+place. An object is checked against its hash before it's reused, and a
+changed one is replaced. The object directory is excluded from git
+(.git/info/exclude). Pdfs are stored when they are downloaded or imported;
+an existing library is converted with the migrate command.
+
+Usage:
+    python pdf_store.py [--config FILE] migrate [--workers N]
+    python pdf_store.py [--config FILE] gc
+    python pdf_store.py selftest
+"""
+import os
+import sys
+import stat
+import shutil
+import hashlib
+import argparse
+import threading
+
+OBJECTS_DIR = ".citerius-objects"
+# ioctl that clones a file on copy-on-write filesystems (linux/fs.h)
+FICLONE = 0x40049409
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+class PdfStore():
+    def __init__(self, parent_dir, reflink=True):
+        """
+        Object store of the pdfs of the library
+        Args:
+            parent_dir (str): references directory (root of the library repo)
+            reflink (bool): try reflinks before hardlinks
+        """
+        self.parent_dir = parent_dir
+        self.reflink = reflink
+        self.objects_dir = os.path.join(parent_dir, OBJECTS_DIR)
+        if not os.path.isdir(self.objects_dir):
+            os.makedirs(self.objects_dir, exist_ok=True)
+            self.exclude_from_git()
+
+    def exclude_from_git(self):
+        """
+        Adds the object directory to .git/info/exclude of the library
+        """
+        git_dir = os.path.join(self.parent_dir, ".git")
+        if not os.path.isdir(git_dir):
+            return
+        exclude_file = os.path.join(git_dir, "info", "exclude")
+        pattern = f"/{OBJECTS_DIR}/"
+        if os.path.exists(exclude_file):
+            with open(exclude_file) as f:
+                if pattern in f.read().splitlines():
+                    return
+        os.makedirs(os.path.dirname(exclude_file), exist_ok=True)
+        with open(exclude_file, "a") as f:
+            f.write(pattern + "\n")
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256 + ".pdf")
+
+    def add(self, path, sha256=None):
+        """
+        Stores the pdf, or replaces it with a link of the stored object
+        if the same pdf is already there
+        Args:
+            path (str): path to the pdf (e.g. <label>/<label>.pdf)
+            sha256 (str): its hash, if it's already known
+        Returns:
+            int: number of bytes reclaimed
+        """
+        sha256 = sha256 or file_sha256(path)
+        object_path = self.object_path(sha256)
+        if not os.path.exists(object_path) and self.create_object(path, object_path):
+            return 0
+        if os.path.samefile(path, object_path):
+            return 0
+        if file_sha256(object_path) != sha256:
+            # Changed in place (e.g. made writable and edited), the pdfs
+            # linked to it keep their content, but it's not reused
+            os.remove(object_path)
+            if self.create_object(path, object_path):
+                return 0
+        size = os.path.getsize(path)
+        method = clone_file(object_path, path, self.reflink)
+        return 0 if method == "copy" else size
+
+    def create_object(self, path, object_path):
+        """
+        Stores the first copy of a pdf as the object
+        Returns:
+            bool: False if another process or thread stored it first
+        """
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        tmp_path, _ = clone_to_tmp(path, object_path, self.reflink)
+        try:
+            # A hardlink shares the mode with the pdf of the paper
+            os.chmod(tmp_path, READ_ONLY)
+            # Unlike os.replace, os.link never overwrites an existing object
+            os.link(tmp_path, object_path)
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+        return True
+
+    def migrate(self, paths, workers=None):
+        """
+        Stores the pdfs of an existing library. The pdfs are hashed in a
+        pool of processes
+        Args:
+            paths (list): paths to the pdfs
+            workers (int): number of processes (None for the number of cpus)
+        Returns:
+            tuple: (number of pdfs, number of duplicates, bytes reclaimed)
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        paths = [ path for path in paths if os.path.exists(path) ]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            hashes = list(executor.map(file_sha256, paths, chunksize=16))
+        reclaimed = 0
+        seen = set()
+        duplicates = 0
+        for path, sha256 in zip(paths, hashes):
+            if sha256 in seen:
+                duplicates += 1
+            seen.add(sha256)
+            reclaimed += self.add(path, sha256)
+        return len(paths), duplicates, reclaimed
+
+    def gc(self, paths, workers=None):
+        """
+        Removes the objects that none of the pdfs is a copy of
+        (e.g. of removed papers), and the ones that don't match their hash.
+        The files are hashed in a pool of processes
+        Args:
+            paths (list): paths to all the pdfs of the library
+            workers (int): number of processes (None for the number of cpus)
+        Returns:
+            tuple: (number of removed objects, bytes freed)
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        inodes = set()
+        unlinked = [] # Reflinks or copies, their hash is needed
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            info = os.stat(path)
+            if info.st_nlink > 1:
+                inodes.add((info.st_dev, info.st_ino))
+            else:
+                unlinked.append(path)
+        object_paths = [ os.path.join(directory, name)
+                         for directory, _, files in os.walk(self.objects_dir)
+                         for name in files if name.endswith(".pdf") ]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            referenced = set(executor.map(file_sha256, unlinked, chunksize=16))
+            object_hashes = list(executor.map(file_sha256, object_paths, chunksize=16))
+        removed, freed = 0, 0
+        for object_path, sha256 in zip(object_paths, object_hashes):
+            info = os.stat(object_path)
+            name = os.path.basename(object_path).removesuffix(".pdf")
+            if sha256 == name and ((info.st_dev, info.st_ino) in inodes or
+                                   name in referenced):
+                continue
+            os.remove(object_path)
+            removed += 1
+            freed += info.st_size
+        return removed, freed
+
+_clone_lock = threading.Lock()
+_clone_counter = 0
+
+def clone_file(source, destination, reflink=True):
+    """
+    Replaces destination by a reflink of source, or by a hardlink if the
+    filesystem can't clone files (or reflink is False), or by a copy as
+    the last resort (e.g. the store is on another filesystem)
+    Returns:
+        str: "reflink", "hardlink" or "copy"
+    """
+    tmp_path, method = clone_to_tmp(source, destination, reflink)
+    try:
+        os.replace(tmp_path, destination)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return method
+
+def clone_to_tmp(source, destination, reflink=True):
+    """
+    Clones source (see clone_file) to a temporary file next to destination
+    Returns:
+        tuple: (path of the temporary file, method)
+    """
+    global _clone_counter
+    with _clone_lock:
+        _clone_counter += 1
+        tmp_path = f"{destination}.{os.getpid()}.{_clone_counter}.tmp"
+    try:
+        method = "reflink"
+        try:
+            import fcntl
+            if not reflink:
+                raise OSError("Reflinks are disabled")
+            with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except (ImportError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            try:
+                method = "hardlink"
+                os.link(source, tmp_path)
+            except OSError:
+                method = "copy"
+                shutil.copyfile(source, tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path, method
+
+def file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def selftest():
+    """
+    Checks the store with hardlinks (as on filesystems without reflinks)
+    in a temporary directory
+    """
+    import tempfile
+    with tempfile.TemporaryDirectory() as parent_dir:
+        paths = []
+        for label, content in (("A", b"%PDF-1 a"), ("B", b"%PDF-1 a"), ("C", b"%PDF-1 c")):
+            os.makedirs(os.path.join(parent_dir, label))
+            paths.append(os.path.join(parent_dir, label, label + ".pdf"))
+            with open(paths[-1], "wb") as f:
+                f.write(content)
+        a, b, c = paths
+        store = PdfStore(parent_dir, reflink=False)
+        assert store.add(a) == 0 and store.add(b) == len(b"%PDF-1 a")
+        sha256 = file_sha256(a)
+        object_path = store.object_path(sha256)
+        assert os.path.samefile(a, object_path) and os.path.samefile(b, object_path)
+        # The shared inode is read-only, so editors can't change it in place
+        assert stat.S_IMODE(os.stat(a).st_mode) == READ_ONLY
+        if os.geteuid() != 0: # root can write anyway
+            try:
+                open(a, "r+b").close()
+                raise AssertionError("Hardlinked pdf is writable")
+            except PermissionError:
+                pass
+        # Edited in place anyway: the changed object isn't reused
+        os.chmod(a, 0o644)
+        with open(a, "r+b") as f:
+            f.write(b"%PDF-1 x")
+        with open(c, "wb") as f:
+            f.write(b"%PDF-1 a")
+        store.add(c)
+        assert file_sha256(object_path) == sha256 and os.path.samefile(c, object_path)
+        assert file_sha256(b) != sha256 # B shared the edited inode
+        # Objects of removed papers are collected
+        os.remove(c)
+        assert store.gc([a, b]) == (1, len(b"%PDF-1 a"))
+        assert not os.path.exists(object_path)
+    print("pdf store: ok")
+
+def main():
+    from config import CiteriusConfig
+    parser = argparse.ArgumentParser(description="Citerius pdf deduplication")
+    parser.add_argument('--config', type=str, default=None,
+                        help='Path to Citerius config file')
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="Store the pdfs of the library once")
+    migrate.add_argument('--workers', type=int, default=None)
+    gc = commands.add_parser("gc", help="Remove objects that no paper uses")
+    gc.add_argument('--workers', type=int, default=None)
+    commands.add_parser("selftest", help="Check the store with hardlinks in a temporary directory")
+    args = parser.parse_args()
+    if args.command == "selftest":
+        selftest()
+        return 0
+
+    citerius = CiteriusConfig(args.config)
+    try:
+        paths = [ citerius.pdf_path(label) for label in citerius.index.labels() ]
+        if args.command == "migrate":
+            n_pdfs, duplicates, reclaimed = citerius.pdf_store.migrate(paths, args.workers)
+            print(f"Stored {n_pdfs} pdf(s), {duplicates} duplicate(s), " + \
+                  f"reclaimed {reclaimed / 2**20:.1f} MB")
+        elif args.command == "gc":
+            removed, freed = citerius.pdf_store.gc(paths, args.workers)
+            print(f"Removed {removed} object(s), freed {freed / 2**20:.1f} MB")
+    finally:
+        citerius.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
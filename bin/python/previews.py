@@ -0,0 +1,389 @@
+"""
+Thumbnails of pdf pages for previews (e.g. in Telescope or fzf, shown
+with the kitty graphics protocol).
+
+Pages are rendered to png by pdftoppm (poppler) at a few fixed widths, and
+kept in <cache_dir>/previews under the sha256 of the pdf content, so the
+same pdf is rendered once even if it's renamed or is in several libraries.
+The total size of the thumbnails is kept under a budget (preview_cache_mb
+in the config) by evicting the least recently used ones.
+Right after a download, the first page and the pages with figure captions
+of the new papers are rendered in a detached process (see prewarm), so
+previews are normally served straight from the cache.
+
+Usage:
+    python previews.py [--config FILE] show LABEL [--page N | --figure N]
+                       [--size small|medium|large] [--path]
+    python previews.py [--config FILE] warm LABEL... [--workers N]
+    python previews.py [--config FILE] stats
+"""
+import os
+import re
+import sys
+import time
+import base64
+import shutil
+import hashlib
+import sqlite3
+import argparse
+import threading
+import subprocess
+
+# Width of the thumbnails in pixels
+SIZES = { "small": 256, "medium": 512, "large": 1024 }
+DEFAULT_SIZE = "medium"
+# Sizes that are rendered ahead of time
+WARM_SIZES = [ "small", "medium" ]
+# Caption at the start of a line, e.g. "Figure 3:" or "FIG. 3."
+CAPTION = re.compile(r'^\s*(?:figure|fig\.)\s*(\d+)\s*[.:]', re.M | re.I)
+# Base64 bytes per chunk of kitty graphics escape sequence
+KITTY_CHUNK_SIZE = 4096
+
+class PreviewCache():
+    def __init__(self, cache_dir, max_size_mb=256):
+        """
+        Cache of page thumbnails. The png files are stored in
+        <cache_dir>/previews, with a sqlite index of their sizes and last
+        accesses, and of the content hashes and figure pages of the pdfs.
+        Args:
+            cache_dir (str): cache directory of Citerius
+            max_size_mb (float): maximal total size of the thumbnails in MB
+        """
+        self.preview_dir = os.path.join(cache_dir, "previews")
+        self.max_size = int(max_size_mb * 2**20)
+        self.lock = threading.RLock()
+        os.makedirs(self.preview_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.preview_dir, "index.sqlite"),
+                                          timeout=30, check_same_thread=False)
+        # Several processes (e.g. prewarm) can write at once
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS pdfs (
+                path TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS figure_pages (
+                sha256 TEXT PRIMARY KEY,
+                pages TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS thumbnails_accessed ON thumbnails(accessed);
+        """)
+        self.connection.commit()
+
+    # Pdfs
+
+    def content_hash(self, pdf_path):
+        """
+        Returns sha256 of the pdf. It's only computed again when the
+        modification time or size of the file changes
+        """
+        pdf_path = os.path.abspath(pdf_path)
+        stat = os.stat(pdf_path)
+        signature = f"{stat.st_mtime_ns}:{stat.st_size}"
+        with self.lock:
+            row = self.connection.execute("SELECT signature, sha256 FROM pdfs WHERE path = ?",
+                                          (pdf_path,)).fetchone()
+        if row is not None and row[0] == signature:
+            return row[1]
+        with open(pdf_path, "rb") as f:
+            sha256 = hashlib.file_digest(f, "sha256").hexdigest()
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO pdfs VALUES (?, ?, ?)",
+                                    (pdf_path, signature, sha256))
+            self.connection.commit()
+        return sha256
+
+    def figure_pages(self, pdf_path, sha256=None):
+        """
+        Returns dictionary figure number -> page (starting from 1) of its
+        caption. The pdf is only scanned once
+        """
+        sha256 = sha256 or self.content_hash(pdf_path)
+        with self.lock:
+            row = self.connection.execute("SELECT pages FROM figure_pages WHERE sha256 = ?",
+                                          (sha256,)).fetchone()
+        if row is not None:
+            return decode_figure_pages(row[0])
+        pages = find_figure_pages(pdf_path)
+        self.store_figure_pages(sha256, pages)
+        return pages
+
+    def store_figure_pages(self, sha256, pages):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO figure_pages VALUES (?, ?)",
+                                    (sha256, encode_figure_pages(pages)))
+            self.connection.commit()
+
+    # Thumbnails
+
+    def thumbnail_name(self, sha256, page, size):
+        return f"{sha256[:2]}/{sha256}-p{page}-{SIZES[size]}.png"
+
+    def thumbnail_path(self, name):
+        return os.path.join(self.preview_dir, name)
+
+    def lookup(self, name):
+        """
+        Returns path of the cached thumbnail (marking it as used),
+        or None if it's not in the cache
+        """
+        path = self.thumbnail_path(name)
+        with self.lock:
+            row = self.connection.execute("SELECT size FROM thumbnails WHERE name = ?",
+                                          (name,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(path):
+                # Removed behind our back
+                self.connection.execute("DELETE FROM thumbnails WHERE name = ?", (name,))
+                self.connection.commit()
+                return None
+            self.connection.execute("UPDATE thumbnails SET accessed = ? WHERE name = ?",
+                                    (time.time(), name))
+            self.connection.commit()
+        return path
+
+    def get(self, pdf_path, page=1, figure=None, size=DEFAULT_SIZE):
+        """
+        Returns path of thumbnail of the page of the pdf, rendering it
+        if it's not in the cache yet
+        Args:
+            pdf_path (str): path to the pdf
+            page (int): page number (starting from 1)
+            figure (int): number of figure, whose caption page is shown
+                instead of page
+            size (str): one of SIZES
+        Raises:
+            ValueError: if there is no such page or figure
+        """
+        if size not in SIZES:
+            raise ValueError(f"Unknown thumbnail size {size}, choose from " + \
+                             ", ".join(SIZES))
+        sha256 = self.content_hash(pdf_path)
+        if figure is not None:
+            pages = self.figure_pages(pdf_path, sha256)
+            if figure not in pages:
+                raise ValueError(f"No caption of figure {figure} found in {pdf_path}")
+            page = pages[figure]
+        name = self.thumbnail_name(sha256, page, size)
+        path = self.lookup(name)
+        if path is not None:
+            return path
+        path = self.thumbnail_path(name)
+        check_pdftoppm()
+        n_bytes = render_page(pdf_path, page, SIZES[size], path)
+        if n_bytes is None:
+            raise ValueError(f"Page {page} of {pdf_path} couldn't be rendered")
+        self.add([ (name, n_bytes) ])
+        return path
+
+    def add(self, thumbnails):
+        """
+        Records rendered thumbnails, then evicts the least recently used
+        ones while the cache is over its budget
+        Args:
+            thumbnails (list): (name, size in bytes) of the thumbnails
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?)",
+                                        ( (name, n_bytes, now) for name, n_bytes in thumbnails ))
+            self.connection.commit()
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            total = self.connection.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM thumbnails").fetchone()[0]
+            if total <= self.max_size:
+                return
+            evicted = []
+            for name, n_bytes in self.connection.execute(
+                    "SELECT name, size FROM thumbnails ORDER BY accessed"):
+                if total <= self.max_size:
+                    break
+                evicted.append(name)
+                total -= n_bytes
+            for name in evicted:
+                try:
+                    os.remove(self.thumbnail_path(name))
+                except FileNotFoundError:
+                    pass
+            self.connection.executemany("DELETE FROM thumbnails WHERE name = ?",
+                                        ( (name,) for name in evicted ))
+            self.connection.commit()
+
+    def warm(self, pdf_paths, sizes=WARM_SIZES, workers=None):
+        """
+        Renders the first page and the figure pages of the pdfs in given
+        sizes, in a pool of processes. Thumbnails that are already in the
+        cache are skipped
+        Returns:
+            int: number of rendered thumbnails
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        check_pdftoppm()
+        pdf_paths = [ path for path in pdf_paths if os.path.exists(path) ]
+        hashes = [ self.content_hash(path) for path in pdf_paths ]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Figures are found first, since their pages are rendered too
+            with self.lock:
+                scanned = set( row[0] for row in self.connection.execute(
+                               "SELECT sha256 FROM figure_pages").fetchall() )
+            to_scan = [ (path, sha256) for path, sha256 in zip(pdf_paths, hashes)
+                        if sha256 not in scanned ]
+            for (_, sha256), pages in zip(to_scan, executor.map(
+                    find_figure_pages, [ path for path, _ in to_scan ])):
+                self.store_figure_pages(sha256, pages)
+
+            jobs = []
+            for path, sha256 in zip(pdf_paths, hashes):
+                pages = sorted(set([1] + list(self.figure_pages(path, sha256).values())))
+                for page in pages:
+                    for size in sizes:
+                        name = self.thumbnail_name(sha256, page, size)
+                        if self.lookup(name) is None:
+                            jobs.append((name, path, page, SIZES[size]))
+            results = executor.map(render_page,
+                                   [ path for _, path, _, _ in jobs ],
+                                   [ page for _, _, page, _ in jobs ],
+                                   [ width for _, _, _, width in jobs ],
+                                   [ self.thumbnail_path(name) for name, _, _, _ in jobs ])
+            rendered = [ (name, n_bytes) for (name, _, _, _), n_bytes in zip(jobs, results)
+                         if n_bytes is not None ]
+        self.add(rendered)
+        return len(rendered)
+
+    def stats(self):
+        """
+        Returns (number of thumbnails, their total size in bytes)
+        """
+        with self.lock:
+            return self.connection.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM thumbnails").fetchone()
+
+    def close(self):
+        self.connection.close()
+
+def check_pdftoppm():
+    if shutil.which("pdftoppm") is None:
+        raise FileNotFoundError("pdftoppm (poppler) is required for the previews")
+
+def render_page(pdf_path, page, width, png_path):
+    """
+    Renders page of the pdf into png of given width
+    Returns:
+        int: size of the png, or None if the page couldn't be rendered
+    """
+    os.makedirs(os.path.dirname(png_path), exist_ok=True)
+    # pdftoppm adds .png to the output name itself
+    tmp_prefix = f"{png_path}.{os.getpid()}.tmp"
+    result = subprocess.run(["pdftoppm", "-png", "-f", str(page), "-l", str(page),
+                             "-scale-to-x", str(width), "-scale-to-y", "-1",
+                             "-singlefile", pdf_path, tmp_prefix],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if result.returncode != 0 or not os.path.exists(tmp_prefix + ".png"):
+        return None
+    os.replace(tmp_prefix + ".png", png_path)
+    return os.path.getsize(png_path)
+
+def find_figure_pages(pdf_path):
+    """
+    Returns dictionary figure number -> page of its caption
+    (the first page with a line starting like "Figure N:")
+    """
+    from search_index import extract_pdf_pages
+    pages = {}
+    for page, text in enumerate(extract_pdf_pages(pdf_path), start=1):
+        for match in CAPTION.finditer(text):
+            pages.setdefault(int(match.group(1)), page)
+    return pages
+
+def encode_figure_pages(pages):
+    return " ".join(f"{figure}:{page}" for figure, page in sorted(pages.items()))
+
+def decode_figure_pages(value):
+    return dict( tuple(map(int, item.split(":"))) for item in value.split() )
+
+def kitty_image(png_path):
+    """
+    Returns escape sequence that shows the png in terminals supporting
+    the kitty graphics protocol. The image data is sent in the sequence
+    itself, so it also works over ssh
+    """
+    with open(png_path, "rb") as f:
+        data = base64.standard_b64encode(f.read())
+    chunks = [ data[i:i+KITTY_CHUNK_SIZE] for i in range(0, len(data), KITTY_CHUNK_SIZE) ] or [b""]
+    sequence = []
+    for i, chunk in enumerate(chunks):
+        more = int(i < len(chunks) - 1)
+        control = f"a=T,f=100,q=2,m={more}" if i == 0 else f"m={more}"
+        sequence.append(f"\x1b_G{control};{chunk.decode()}\x1b\\")
+    return "".join(sequence)
+
+def prewarm(config_file, labels):
+    """
+    Renders thumbnails of the papers in a detached process,
+    so that the caller doesn't wait for it
+    """
+    if len(labels) == 0 or shutil.which("pdftoppm") is None:
+        return
+    command = [ sys.executable, os.path.abspath(__file__) ]
+    if config_file is not None:
+        command += [ "--config", config_file ]
+    command += [ "warm" ] + list(labels)
+    subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+
+def main():
+    from config import CiteriusConfig
+    parser = argparse.ArgumentParser(description="Citerius page previews")
+    parser.add_argument('--config', type=str, default=None,
+                        help='Path to Citerius config file')
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="Show thumbnail of a page of the paper")
+    show.add_argument('label', type=str)
+    show.add_argument('--page', type=int, default=1)
+    show.add_argument('--figure', type=int, default=None,
+                      help='Show the page with the caption of this figure')
+    show.add_argument('--size', choices=list(SIZES), default=DEFAULT_SIZE)
+    show.add_argument('--path', action='store_true',
+                      help='Print path of the png instead of showing it')
+    warm = commands.add_parser("warm", help="Render thumbnails of the papers ahead of time")
+    warm.add_argument('labels', nargs='+')
+    warm.add_argument('--workers', type=int, default=None)
+    commands.add_parser("stats", help="Size of the thumbnail cache")
+    args = parser.parse_args()
+
+    citerius = CiteriusConfig(args.config)
+    try:
+        if args.command == "show":
+            path = citerius.previews.get(citerius.pdf_path(args.label), args.page,
+                                         args.figure, args.size)
+            if args.path:
+                print(path)
+            else:
+                sys.stdout.write(kitty_image(path) + "\n")
+        elif args.command == "warm":
+            citerius.previews.warm([ citerius.pdf_path(label) for label in args.labels ],
+                                   workers=args.workers)
+        elif args.command == "stats":
+            count, n_bytes = citerius.previews.stats()
+            print(f"{count} thumbnail(s), {n_bytes / 2**20:.1f} of " + \
+                  f"{citerius.preview_cache_mb} MB")
+    except (ValueError, FileNotFoundError) as e:
+        print(f"citerius: {e}", file=sys.stderr)
+        return 1
+    finally:
+        citerius.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
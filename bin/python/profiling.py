@@ -0,0 +1,166 @@
+"""
+Lightweight timing of the phases of Citerius operations.
+
+Code marks its phases with span():
+
+    with span("git.commit", files=3) as record:
+        ...
+        record["bytes"] = n_bytes # Optional extra fields
+
+Spans are only recorded once profiling is enabled, either with the --profile
+option of cli.py or with $CITERIUS_PROFILE (a file path, or "-" or 1 for stderr).
+Every finished span is written as a json line (name, parent span, thread,
+start and duration in ms, extra fields), and print_summary() shows count,
+p50/p95 and bytes of every span when the process exits.
+"""
+import os
+import sys
+import atexit
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+PROFILE_ENV = "CITERIUS_PROFILE"
+
+class Profiler():
+    def __init__(self):
+        """
+        Recorded spans of this process (nothing is recorded until enable)
+        """
+        self.enabled = False
+        self.output = None
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local() # Stack of open spans of every thread
+        self.start_time = time.perf_counter()
+
+    def enable(self, output="-"):
+        """
+        Starts recording spans. Their summary is printed when the
+        process exits
+        Args:
+            output (str): file to append json lines to ("-" for stderr,
+                None to only keep the spans for the summary)
+        """
+        with self.lock:
+            if self.output not in (None, sys.stderr):
+                self.output.close()
+            if output == "-":
+                self.output = sys.stderr
+            elif output is not None:
+                self.output = open(output, "a")
+            if not self.enabled:
+                atexit.register(self.print_summary)
+            self.enabled = True
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def record(self, record):
+        with self.lock:
+            self.records.append(record)
+            if self.output is not None:
+                self.output.write(json.dumps(record) + "\n")
+                self.output.flush()
+
+    def summary(self):
+        """
+        Returns dictionary span name -> {"count", "total_ms", "p50_ms",
+        "p95_ms", "max_ms", "bytes"}, in the order the spans were first seen
+        """
+        durations = {}
+        n_bytes = {}
+        with self.lock:
+            for record in self.records:
+                durations.setdefault(record["span"], []).append(record["ms"])
+                if "bytes" in record:
+                    n_bytes[record["span"]] = n_bytes.get(record["span"], 0) + record["bytes"]
+        summary = {}
+        for name, values in durations.items():
+            values = sorted(values)
+            summary[name] = { "count": len(values),
+                              "total_ms": sum(values),
+                              "p50_ms": percentile(values, 50),
+                              "p95_ms": percentile(values, 95),
+                              "max_ms": values[-1],
+                              "bytes": n_bytes.get(name) }
+        return summary
+
+    def print_summary(self, file=None):
+        """
+        Prints table with the summary of the recorded spans
+        (to stderr by default, so that it doesn't mix with the output)
+        """
+        file = file or sys.stderr
+        summary = self.summary()
+        if not summary:
+            return
+        elapsed = (time.perf_counter() - self.start_time) * 1000
+        print(f"\nProfile ({elapsed:.0f} ms since start):", file=file)
+        print(f"{'span':<28} {'count':>6} {'total ms':>10} {'p50 ms':>9} "
+              f"{'p95 ms':>9} {'max ms':>9} {'MB':>8}", file=file)
+        for name, s in summary.items():
+            mb = f"{s['bytes'] / 2**20:8.2f}" if s["bytes"] is not None else f"{'':>8}"
+            print(f"{name:<28} {s['count']:>6} {s['total_ms']:10.1f} "
+                  f"{s['p50_ms']:9.1f} {s['p95_ms']:9.1f} {s['max_ms']:9.1f} {mb}",
+                  file=file)
+
+def percentile(sorted_values, p):
+    """
+    Returns p-th percentile of sorted values (nearest rank)
+    """
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+profiler = Profiler()
+
+@contextmanager
+def span(name, **fields):
+    """
+    Context manager that records the time spent in its block.
+    Yields the dictionary of extra fields of the span, which the block
+    can fill in (e.g. "bytes" are summed up in the summary).
+    Args:
+        name (str): name of the phase, e.g. "arxiv.query"
+        fields: extra fields of the span
+    """
+    if not profiler.enabled:
+        yield fields
+        return
+    stack = profiler.stack()
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield fields
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        end = time.perf_counter()
+        stack.pop()
+        record = { "span": name, "parent": parent,
+                   "thread": threading.current_thread().name,
+                   "start_ms": round((start - profiler.start_time) * 1000, 3),
+                   "ms": round((end - start) * 1000, 3) }
+        record.update(fields)
+        if error is not None:
+            record["error"] = error
+        profiler.record(record)
+
+def enable(output="-"):
+    profiler.enable(output)
+
+def is_enabled():
+    return profiler.enabled
+
+def print_summary(file=None):
+    profiler.print_summary(file)
+
+# Profiling of any Citerius process can be switched on from the environment
+if os.environ.get(PROFILE_ENV, "") not in ("", "0"):
+    enable(os.environ[PROFILE_ENV] if os.environ[PROFILE_ENV] != "1" else "-")
@@ -0,0 +1,320 @@
+"""
+Local record/replay stand-in for the hosts Citerius talks to (arxiv API,
+pdf and source hosts, bibget's metadata services).
+
+When $CITERIUS_STANDIN_URL is set (e.g. http://127.0.0.1:8765), Citerius
+sends its requests to the stand-in instead of the real hosts, with the
+original url encoded in the path: https://arxiv.org/pdf/2101.00001 becomes
+http://127.0.0.1:8765/https/arxiv.org/pdf/2101.00001.
+
+In record mode, the stand-in forwards every request to the real host and
+saves the response into the fixture directory. In replay mode, it serves
+the saved responses only, optionally with added latency, limited bandwidth
+and injected errors, so downloads can be measured deterministically
+without network.
+
+Usage:
+    python replay.py record FIXTURE_DIR [--port PORT]
+    python replay.py replay FIXTURE_DIR [--port PORT] [--latency S]
+                     [--bandwidth BYTES_PER_S] [--error-rate P] [--drop-rate P]
+                     [--seed N]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlsplit
+
+STANDIN_ENV = "CITERIUS_STANDIN_URL"
+CHUNK_SIZE = 1 << 14
+# Response headers that are saved with the fixtures
+SAVED_HEADERS = [ "Content-Type", "Content-Encoding", "Content-Disposition",
+                  "Last-Modified", "ETag" ]
+
+def standin_url(url):
+    """
+    Returns url of the request through the stand-in,
+    or the url itself if the stand-in is not used
+    """
+    standin = os.environ.get(STANDIN_ENV, "")
+    if standin == "":
+        return url
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    query = f"?{parts.query}" if parts.query else ""
+    return f"{standin.rstrip('/')}/{parts.scheme}/{parts.netloc}{path}{query}"
+
+def standin_httpx_client(httpx):
+    """
+    Returns httpx.AsyncClient class, whose requests go through the stand-in
+    (for libraries that create their own clients, like pybibget)
+    """
+    class StandinTransport(httpx.AsyncHTTPTransport):
+        async def handle_async_request(self, request):
+            request.url = httpx.URL(standin_url(str(request.url)))
+            request.headers["Host"] = request.url.netloc.decode()
+            return await super().handle_async_request(request)
+
+    class StandinAsyncClient(httpx.AsyncClient):
+        def __init__(self, *args, **kwargs):
+            kwargs.setdefault("transport", StandinTransport())
+            super().__init__(*args, **kwargs)
+
+    return StandinAsyncClient
+
+def use_standin_in_pybibget():
+    """
+    Makes pybibget send its requests through the stand-in
+    (if $CITERIUS_STANDIN_URL is set)
+    """
+    if os.environ.get(STANDIN_ENV, "") == "":
+        return
+    import types
+    import httpx
+    import pybibget.bibentry as bibentry
+    if getattr(bibentry.httpx, "standin", False):
+        return
+    patched = dict(vars(httpx), standin=True,
+                   AsyncClient=standin_httpx_client(httpx))
+    bibentry.httpx = types.SimpleNamespace(**patched)
+
+class FixtureStore():
+    def __init__(self, fixture_dir):
+        """
+        Saved http responses, one json file (status and headers) and one
+        body file for every request
+        Args:
+            fixture_dir (str): directory of the fixtures
+        """
+        self.fixture_dir = fixture_dir
+        os.makedirs(fixture_dir, exist_ok=True)
+
+    def key(self, method, url):
+        # HEAD requests are answered with the headers of GET
+        method = "GET" if method == "HEAD" else method
+        return hashlib.sha256(f"{method} {url}".encode()).hexdigest()[:32]
+
+    def get(self, method, url):
+        """
+        Returns (status, headers, body) of the saved response, or None
+        """
+        path = os.path.join(self.fixture_dir, self.key(method, url))
+        if not os.path.exists(path + ".json"):
+            return None
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        with open(path + ".body", "rb") as f:
+            body = f.read()
+        return meta["status"], meta["headers"], body
+
+    def put(self, method, url, status, headers, body):
+        path = os.path.join(self.fixture_dir, self.key(method, url))
+        with open(path + ".body.tmp", "wb") as f:
+            f.write(body)
+        os.replace(path + ".body.tmp", path + ".body")
+        with open(path + ".json.tmp", "w") as f:
+            json.dump({ "method": method, "url": url, "status": status,
+                        "headers": headers }, f, indent=4)
+        os.replace(path + ".json.tmp", path + ".json")
+
+class Standin():
+    def __init__(self, fixture_dir, record=False, latency=0.0, bandwidth=None,
+                 error_rate=0.0, drop_rate=0.0, seed=0):
+        """
+        Stand-in server state
+        Args:
+            fixture_dir (str): directory of the fixtures
+            record (bool): forward the requests and save the responses
+                (otherwise only saved responses are served)
+            latency (float): seconds before every response
+            bandwidth (float): bytes per second of every response body
+                (None for no limit)
+            error_rate (float): probability of answering with 503
+            drop_rate (float): probability of closing the connection in
+                the middle of the body
+            seed (int): seed of the injected errors. The same requests get
+                the same errors in every run
+        """
+        self.store = FixtureStore(fixture_dir)
+        self.record = record
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.stats = { "requests": 0, "bytes": 0, "errors": 0, "drops": 0,
+                       "missing": 0 }
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def chance(self, kind, key):
+        """
+        Returns deterministic random number in [0, 1) for the n-th attempt
+        of the request with given key
+        """
+        with self.lock:
+            attempt = self.attempts.get((kind, key), 0)
+            self.attempts[(kind, key)] = attempt + 1
+        return random.Random(f"{self.seed}:{kind}:{key}:{attempt}").random()
+
+    def fetch(self, method, url):
+        """
+        Returns (status, headers, body) from the fixtures, requesting it
+        from the real host first in record mode
+        """
+        response = self.store.get(method, url)
+        if response is not None or not self.record:
+            return response
+        from urllib.request import Request, urlopen
+        from urllib.error import HTTPError
+        request = Request(url, method="GET", headers={ "User-Agent": "citerius" })
+        try:
+            with urlopen(request, timeout=60) as upstream:
+                status, headers, body = upstream.status, upstream.headers, upstream.read()
+        except HTTPError as e:
+            status, headers, body = e.code, e.headers, e.read()
+        headers = dict( (name, headers[name]) for name in SAVED_HEADERS
+                        if headers.get(name) is not None )
+        self.store.put(method, url, status, headers, body)
+        return status, headers, body
+
+def make_handler(standin):
+    from http.server import BaseHTTPRequestHandler
+
+    class StandinHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def upstream_url(self):
+            match = re.match(r'^/(https?)/([^/]+)(/[^?]*)?(\?.*)?$', self.path)
+            if match is None:
+                return None
+            scheme, host, path, query = match.groups()
+            return f"{scheme}://{host}{path or '/'}{query or ''}"
+
+        def do_GET(self):
+            self.respond(send_body=True)
+
+        def do_HEAD(self):
+            self.respond(send_body=False)
+
+        def respond(self, send_body):
+            standin.count("requests")
+            url = self.upstream_url()
+            if url is None:
+                return self.send_simple(400, b"Expected /<scheme>/<host>/<path>")
+            if standin.latency > 0:
+                time.sleep(standin.latency)
+            key = standin.store.key(self.command, url)
+            if standin.error_rate > 0 and standin.chance("error", key) < standin.error_rate:
+                standin.count("errors")
+                return self.send_simple(503, b"Injected error", {"Retry-After": "1"})
+
+            response = standin.fetch(self.command, url)
+            if response is None:
+                standin.count("missing")
+                return self.send_simple(502, f"No fixture for {url}".encode())
+            status, headers, body = response
+
+            # Ranges are served from the saved full response
+            range_match = re.match(r'^bytes=(\d+)-$', self.headers.get("Range", ""))
+            if range_match and status == 200:
+                start = int(range_match.group(1))
+                if start >= len(body):
+                    return self.send_simple(416, b"",
+                                            {"Content-Range": f"bytes */{len(body)}"})
+                headers = dict(headers, **{"Content-Range":
+                               f"bytes {start}-{len(body) - 1}/{len(body)}"})
+                status, body = 206, body[start:]
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.send_body(key, body)
+
+        def send_body(self, key, body):
+            drop_at = None
+            if standin.drop_rate > 0 and standin.chance("drop", key) < standin.drop_rate:
+                drop_at = len(body) // 2
+            for offset in range(0, len(body), CHUNK_SIZE):
+                if drop_at is not None and offset >= drop_at:
+                    standin.count("drops")
+                    self.close_connection = True
+                    return
+                chunk = body[offset:offset+CHUNK_SIZE]
+                self.wfile.write(chunk)
+                standin.count("bytes", len(chunk))
+                if standin.bandwidth:
+                    time.sleep(len(chunk) / standin.bandwidth)
+
+        def send_simple(self, status, body, headers=None):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StandinHandler
+
+def serve(standin, port=0):
+    """
+    Starts the stand-in in a background thread, returns the server
+    (its url is http://127.0.0.1:<server.server_port>)
+    """
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(standin))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Citerius record/replay stand-in")
+    parser.add_argument('mode', choices=["record", "replay"])
+    parser.add_argument('fixture_dir', type=str, help='Directory of the fixtures')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds before every response (replay)')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='Bytes per second of every response (replay)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Probability of 503 response (replay)')
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help='Probability of dropping connection mid-body (replay)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of injected errors')
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        standin = Standin(args.fixture_dir, record=True)
+    else:
+        standin = Standin(args.fixture_dir, latency=args.latency,
+                          bandwidth=args.bandwidth, error_rate=args.error_rate,
+                          drop_rate=args.drop_rate, seed=args.seed)
+    server = serve(standin, args.port)
+    print(f"{args.mode.capitalize()}ing in {args.fixture_dir}. Run Citerius with:")
+    print(f"    export {STANDIN_ENV}=http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(standin.stats), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import os
+import shutil
+import sqlite3
+import threading
+import subprocess
+from utils import CiteriusUtils
+
+class SearchIndex():
+    def __init__(self, parent_dir, index_file):
+        """
+        Full-text index of the pdfs of the library (sqlite FTS5 table with
+        a row for every page). Queries are ranked with BM25.
+        The text is extracted with pdftotext (poppler), and only the papers
+        whose pdf has changed since the last update are extracted again.
+        Args:
+            parent_dir (str): directory of the library
+            index_file (str): path to sqlite file of the index
+        """
+        self.parent_dir = parent_dir
+        self.index_file = index_file
+        self.lock = threading.RLock()
+        self.cutils = CiteriusUtils()
+
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        self.connection = sqlite3.connect(self.index_file, timeout=30,
+                                          check_same_thread=False)
+        self.connection.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(
+                label UNINDEXED, page UNINDEXED, text,
+                tokenize = 'porter unicode61'
+            );
+            CREATE TABLE IF NOT EXISTS papers (
+                id INTEGER PRIMARY KEY,
+                label TEXT UNIQUE NOT NULL,
+                signature TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.connection.commit()
+
+    # Pages of paper with given id have rowids in
+    # [id * MAX_PAGES, (id + 1) * MAX_PAGES), so they can be
+    # deleted without scanning the whole fts table
+    MAX_PAGES = 1 << 20
+
+    def pdf_path(self, label):
+        return os.path.join(self.parent_dir, label, label + ".pdf")
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = ?",
+                                          (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                    (key, value))
+            self.connection.commit()
+
+    # Updates
+
+    def outdated_labels(self, labels):
+        """
+        Returns labels of the papers whose pdf has changed since it was
+        indexed (or wasn't indexed yet)
+        """
+        with self.lock:
+            signatures = dict(self.connection.execute(
+                "SELECT label, signature FROM papers").fetchall())
+        outdated = []
+        for label in labels:
+            pdf_path = self.pdf_path(label)
+            if not os.path.exists(pdf_path):
+                continue
+            if signatures.get(label) != self.cutils.file_signature(pdf_path):
+                outdated.append(label)
+        return outdated
+
+    def update(self, labels, workers=None, prune=True):
+        """
+        Indexes the pdfs of the papers that changed since the last update.
+        The text is extracted in a pool of processes.
+        Args:
+            labels (list of str): labels of the papers in the library
+            workers (int): number of processes (default: number of cpus)
+            prune (bool): remove the papers that are not in labels from
+                the index (set to False if labels are only a part of library)
+        Returns:
+            list of str: labels of the papers that were (re)indexed
+        """
+        check_pdftotext()
+        if prune:
+            with self.lock:
+                indexed = [ row[0] for row in self.connection.execute(
+                            "SELECT label FROM papers").fetchall() ]
+            labels_set = set(labels)
+            self.remove([ label for label in indexed if label not in labels_set ])
+
+        outdated = self.outdated_labels(labels)
+        if len(outdated) == 0:
+            return outdated
+        pdf_paths = [ self.pdf_path(label) for label in outdated ]
+        signatures = [ self.cutils.file_signature(path) for path in pdf_paths ]
+        if len(outdated) == 1 or workers == 1:
+            pages_list = map(extract_pdf_pages, pdf_paths)
+            self.store_pages(outdated, signatures, pages_list)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pages_list = executor.map(extract_pdf_pages, pdf_paths, chunksize=4)
+                self.store_pages(outdated, signatures, pages_list)
+        return outdated
+
+    def store_pages(self, labels, signatures, pages_list):
+        """
+        Replaces the pages of the papers in the index, committing
+        every 50 papers
+        """
+        with self.lock:
+            for i, (label, signature, pages) in enumerate(
+                    zip(labels, signatures, pages_list)):
+                self.remove_pages(label)
+                self.connection.execute(
+                    "INSERT INTO papers (label, signature) VALUES (?, ?) " + \
+                    "ON CONFLICT(label) DO UPDATE SET signature = excluded.signature",
+                    (label, signature))
+                paper_id = self.connection.execute(
+                    "SELECT id FROM papers WHERE label = ?", (label,)).fetchone()[0]
+                self.connection.executemany(
+                    "INSERT INTO pages (rowid, label, page, text) VALUES (?, ?, ?, ?)",
+                    ( (paper_id * self.MAX_PAGES + page, label, page + 1, text) 
+                      for page, text in enumerate(pages[:self.MAX_PAGES])
+                      if text.strip() != "" ))
+                if i % 50 == 49: self.connection.commit()
+            self.connection.commit()
+
+    def remove_pages(self, label):
+        row = self.connection.execute("SELECT id FROM papers WHERE label = ?",
+                                      (label,)).fetchone()
+        if row is not None:
+            self.connection.execute(
+                "DELETE FROM pages WHERE rowid >= ? AND rowid < ?",
+                (row[0] * self.MAX_PAGES, (row[0] + 1) * self.MAX_PAGES))
+
+    def remove(self, labels):
+        """
+        Removes the papers with given labels from the index
+        """
+        if len(labels) == 0:
+            return
+        with self.lock:
+            for label in labels:
+                self.remove_pages(label)
+            self.connection.executemany("DELETE FROM papers WHERE label = ?",
+                                        ( (label,) for label in labels ))
+            self.connection.commit()
+
+    # Lookups
+
+    def search(self, query, limit=20):
+        """
+        Finds the papers that match all the words of the query
+        Args:
+            query (str): words to search for
+            limit (int): maximal number of papers to return
+        Returns:
+            list of (label, page, snippet) of the best matching page of
+            every paper, the best matches first
+        """
+        words = query.split()
+        if len(words) == 0:
+            return []
+        # Every word is quoted, so that the query isn't parsed as FTS5 syntax
+        match = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+        with self.lock:
+            # Pages are sorted by their bm25 rank, and the first (best)
+            # page of every paper is taken until there are enough papers
+            cursor = self.connection.execute("""
+                SELECT label, page, snippet(pages, 2, '[', ']', '...', 12)
+                FROM pages WHERE pages MATCH ? ORDER BY rank
+            """, (match,))
+            results = {}
+            for label, page, snippet in cursor:
+                if label not in results:
+                    results[label] = (label, page, snippet)
+                    if len(results) == limit:
+                        break
+            cursor.close()
+        return list(results.values())
+
+    def labels(self):
+        """
+        Returns list of labels of the indexed papers
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT label FROM papers").fetchall()
+        return [ row[0] for row in rows ]
+
+    def close(self):
+        self.connection.close()
+
+def check_pdftotext():
+    if shutil.which("pdftotext") is None:
+        raise FileNotFoundError("pdftotext (poppler) is required " + \
+                                "for the full-text search")
+
+def extract_pdf_pages(pdf_path):
+    """
+    Returns list of texts of the pages of the pdf
+    (empty list if the text couldn't be extracted)
+    """
+    result = subprocess.run(["pdftotext", "-enc", "UTF-8", pdf_path, "-"],
+                            capture_output=True)
+    if result.returncode != 0:
+        return []
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    # pdftotext ends the last page with a form feed too
+    if pages and pages[-1].strip() == "":
+        pages.pop()
+    return pages
@@ -0,0 +1,78 @@
+import threading
+from config import CiteriusConfig
+
+class CiteriusSession():
+    def __init__(self, config_file=None, refresh=False):
+        """
+        Citerius session, shared by the workflows that change the library
+        many times (bulk downloads, TUI). It holds a single config, with its
+        repo handle and caches, and a set of pending changes. The changes
+        are staged and committed all at once by flush().
+        Can be used as a context manager, which flushes and closes the
+        session in the end.
+        Args:
+            config_file (str): path to json config file
+                (if None, then the default value is $HOME/user/.config/citerius/config.json)
+            refresh (bool): ignore cached arxiv/bibget metadata and refetch it
+        """
+        self.citerius = CiteriusConfig(config_file, refresh)
+        self.citerius.session = self
+        self.lock = threading.RLock()
+        self.pending_paths = []
+        self.pending_messages = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Files are already changed on disk at this point,
+        # so the changes are committed even if something failed
+        self.flush()
+        self.close()
+
+    def stage(self, commit_message=None, paths=()):
+        """
+        Records changes to be committed by the next flush
+        Args:
+            commit_message (str): description of the change (can be None
+                for files that belong to a change described elsewhere)
+            paths (list of str): files to stage in addition to papers.csv
+                and bibliography.bib
+        """
+        with self.lock:
+            for path in paths:
+                if path not in self.pending_paths:
+                    self.pending_paths.append(path)
+            if commit_message:
+                self.pending_messages.append(commit_message)
+
+    def has_pending_changes(self):
+        with self.lock:
+            return len(self.pending_messages) > 0 or len(self.pending_paths) > 0
+
+    def flush(self):
+        """
+        Stages all the pending changes and commits them at once
+        Returns:
+            bool: whether there was anything to commit
+        """
+        with self.lock:
+            if not self.has_pending_changes():
+                return False
+            messages = self.pending_messages
+            if len(messages) == 0:
+                commit_message = "Updated papers"
+            elif len(messages) == 1:
+                commit_message = messages[0]
+            else:
+                commit_message = f"{len(messages)} changes of the library\n\n" + \
+                    "\n".join(f"- {message}" for message in messages)
+            self.citerius.commit_files(commit_message, self.pending_paths)
+            self.pending_paths = []
+            self.pending_messages = []
+            return True
+
+    def close(self):
+        if self.has_pending_changes():
+            print("Warning: closing Citerius session with uncommitted changes")
+        self.citerius.close()
@@ -0,0 +1,146 @@
+"""
+Generator of synthetic Citerius libraries for benchmarks.
+
+Writes papers.csv, bibliography.bib, a directory with a small pdf for every
+downloaded paper, a git repository with the csv and bibtex files committed,
+and a config file pointing at all of it. The content is random but shaped
+like a real library (arxiv papers and papers from links, multi-author
+entries, label collisions resolved the same way users do it).
+
+Usage:
+    python synthetic_library.py DIR [--papers N] [--seed S] [--no-dirs]
+"""
+import os
+import json
+import random
+import argparse
+import subprocess
+
+CSV_HEADER = ("Title,Author,ArXiv Number,Year,Label,"
+              "Download_pdf,Download_src,Download_link\n")
+
+LAST_NAMES = [ "Smith", "Wang", "Garcia", "Mueller", "Ivanov", "Tanaka",
+               "Kim", "Rossi", "Dubois", "Nowak", "Silva", "Cohen", "Patel",
+               "Novak", "Jensen", "Khan", "Lopez", "Okafor", "Berg", "Sato" ]
+WORDS = [ "dark", "matter", "halo", "galaxy", "formation", "cosmic", "web",
+          "simulation", "reionization", "spectrum", "power", "neural",
+          "network", "inference", "bayesian", "lensing", "cluster", "gas",
+          "feedback", "radiative", "transfer", "magnetic", "field", "star",
+          "quasar", "survey", "constraints", "model", "numerical", "method" ]
+
+PDF_TEMPLATE = b"%PDF-1.4\n% Synthetic paper {label}\n%%EOF\n"
+
+def make_papers(n_papers, seed=0):
+    """
+    Returns list of dictionaries with the fields of n_papers random papers
+    """
+    rng = random.Random(seed)
+    papers = []
+    labels = set()
+    for i in range(n_papers):
+        authors = [ (rng.choice(LAST_NAMES), rng.choice("ABCDEFGHJKLMNPRST"))
+                    for _ in range(rng.choice([1, 1, 2, 3, 5, 12])) ]
+        title_words = rng.sample(WORDS, rng.randint(3, 9))
+        title = " ".join(title_words).capitalize()
+        year = str(rng.randint(1990, 2025))
+
+        label = authors[0][0] + title_words[0].capitalize() + year
+        suffix = ord("a")
+        while label in labels:
+            label = authors[0][0] + title_words[0].capitalize() + year + chr(suffix)
+            suffix += 1
+        labels.add(label)
+
+        from_link = rng.random() < 0.1
+        papers.append({
+            "title": title,
+            "authors": authors,
+            "year": year,
+            "label": label,
+            "arxiv": "nan" if from_link else f"{int(year[2:]):02d}{rng.randint(1, 12):02d}.{i % 100000:05d}",
+            "link": f"https://example.org/papers/{i}.pdf" if from_link else "nan",
+            "download_pdf": "y" if rng.random() < 0.9 else "n",
+            "download_src": "y" if not from_link and rng.random() < 0.2 else "n",
+        })
+    return papers
+
+def csv_line(paper):
+    authors = " and ".join(f"{last} {first}" for last, first in paper["authors"])
+    values = [ paper["title"], authors, paper["arxiv"], paper["year"],
+               paper["label"], paper["download_pdf"], paper["download_src"],
+               paper["link"] ]
+    return ",".join(f"\"{value}\"" for value in values) + "\n"
+
+def bibtex_entry(paper):
+    authors = " and ".join(f"{last}, {first}." for last, first in paper["authors"])
+    fields = [ ("author", authors), ("title", paper["title"]),
+               ("year", paper["year"]) ]
+    if paper["arxiv"] != "nan":
+        fields += [ ("eprint", paper["arxiv"]), ("archivePrefix", "arXiv") ]
+    else:
+        fields += [ ("url", paper["link"]) ]
+    body = ",\n".join(f"    {name} = {{{value}}}" for name, value in fields)
+    kind = "article" if paper["arxiv"] != "nan" else "misc"
+    return f"@{kind}{{{paper['label']},\n{body}\n}}\n"
+
+def create_library(parent_dir, n_papers=1000, seed=0, with_dirs=True,
+                   with_git=True):
+    """
+    Creates a synthetic library in parent_dir/references, with its config
+    file (parent_dir/config.json) and cache directory (parent_dir/cache)
+    Returns:
+        path to the config file
+    """
+    ref_dir = os.path.join(parent_dir, "references")
+    os.makedirs(ref_dir)
+    papers = make_papers(n_papers, seed)
+    with open(os.path.join(ref_dir, "papers.csv"), "w") as f:
+        f.write(CSV_HEADER)
+        f.writelines(csv_line(paper) for paper in papers)
+    with open(os.path.join(ref_dir, "bibliography.bib"), "w") as f:
+        f.writelines(bibtex_entry(paper) for paper in papers)
+
+    if with_dirs:
+        for paper in papers:
+            if paper["download_pdf"] != "y":
+                continue
+            paper_dir = os.path.join(ref_dir, paper["label"])
+            os.mkdir(paper_dir)
+            with open(os.path.join(paper_dir, paper["label"] + ".pdf"), "wb") as f:
+                f.write(PDF_TEMPLATE.replace(b"{label}", paper["label"].encode()))
+
+    if with_git:
+        git = [ "git", "-C", ref_dir, "-c", "user.name=Citerius Benchmark",
+                "-c", "user.email=bench@citerius" ]
+        subprocess.run(["git", "init", "-q", ref_dir], check=True)
+        with open(os.path.join(ref_dir, ".gitignore"), "w") as f:
+            f.write("*.pdf\n")
+        subprocess.run(git + ["add", "papers.csv", "bibliography.bib", ".gitignore"],
+                       check=True)
+        subprocess.run(git + ["commit", "-q", "-m", "Synthetic library"], check=True)
+
+    config_file = os.path.join(parent_dir, "config.json")
+    with open(config_file, "w") as f:
+        json.dump({ "references_dir": ref_dir,
+                    "author_name": "Citerius Benchmark",
+                    "author_email": "bench@citerius",
+                    "cache_dir": os.path.join(parent_dir, "cache") }, f)
+    return config_file
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic Citerius library")
+    parser.add_argument('dir', type=str, help='Directory to create the library in')
+    parser.add_argument('--papers', type=int, default=1000,
+                        help='Number of papers in the library')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--no-dirs', action='store_true',
+                        help="Don't create directories with pdfs of the papers")
+    parser.add_argument('--no-git', action='store_true',
+                        help="Don't create git repository")
+    args = parser.parse_args()
+    config_file = create_library(args.dir, args.papers, args.seed,
+                                 not args.no_dirs, not args.no_git)
+    print(config_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import os
+import re
+import sys
+import json
+from utils import CiteriusUtils
+
+INDEX_VERSION = 1
+
+EQUATION_ENVS = [ "equation", "eqnarray", "align" ]
+FIGURE_ENVS = [ "figure" ]
+# Environments, in which every row (ended with \\) has its own number
+MULTILINE_ENVS = [ "eqnarray", "align" ]
+
+# Same pattern as the sed replacement in update_figure_path of
+# fuzzy_find_eqns_figs.sh: {some/dir/fig.png} -> {<parent_dir>/<label>/src/fig.png}
+FIGURE_PATH_PATTERN = re.compile(r'(\{)(.*/)?([^/]+\.(pdf|png|jpg|jpeg))(\})')
+
+class TexIndex():
+    def __init__(self, parent_dir, label, index_file):
+        """
+        Index of equations and figures in the LaTeX source of a paper.
+        The source is parsed once, and the index stores the byte ranges of
+        every numbered equation and figure environment in the main .tex file,
+        so that any item can be read without scanning the file again.
+        The index is rebuilt when the files in src/ or the .tex file change
+        (unless the .tex file's git blob hash stays the same).
+        Args:
+            parent_dir (str): directory of the library
+            label (str): label of the paper
+            index_file (str): path to json file of the index
+        """
+        self.parent_dir = parent_dir
+        self.label = label
+        self.src_dir = os.path.join(parent_dir, label, "src")
+        self.index_file = index_file
+        self.cutils = CiteriusUtils()
+        self.data = None
+
+    # Keeping the index in sync with the source
+
+    def find_tex_file(self):
+        """
+        Returns path to the main .tex file of the source (the one with
+        \\begin{document}, or the first one if there is no such file)
+        """
+        tex_files = sorted( name for name in os.listdir(self.src_dir)
+                            if name.endswith(".tex") and
+                            os.path.isfile(os.path.join(self.src_dir, name)) )
+        if len(tex_files) == 0:
+            raise FileNotFoundError(f"No .tex files found in {self.src_dir}")
+        for name in tex_files:
+            with open(os.path.join(self.src_dir, name), "rb") as f:
+                if b"\\begin{document}" in f.read():
+                    return os.path.join(self.src_dir, name)
+        return os.path.join(self.src_dir, tex_files[0])
+
+    def sync(self):
+        """
+        Loads the index, and rebuilds it if the source has changed
+        """
+        if not os.path.isdir(self.src_dir):
+            raise FileNotFoundError(f"No source found for paper {self.label}")
+        data = self.data
+        if data is None and os.path.exists(self.index_file):
+            with open(self.index_file) as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                data = None
+        src_signature = self.cutils.file_signature(self.src_dir)
+        if (data is not None and data["src_signature"] == src_signature and
+            os.path.exists(data["tex_file"])):
+            signature = self.cutils.file_signature(data["tex_file"])
+            if data["signature"] == signature:
+                self.data = data
+                return
+            # Only modification time has changed (e.g. after git checkout)
+            if data["blob_hash"] == self.cutils.git_blob_hash(data["tex_file"]):
+                data["signature"] = signature
+                self.data = data
+                self.save()
+                return
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        Parses the main .tex file and saves the index
+        """
+        src_signature = self.cutils.file_signature(self.src_dir)
+        tex_file = self.find_tex_file()
+        with open(tex_file, "rb") as f:
+            lines = f.readlines()
+        equations, equation_numbers = self.number_environments(
+                self.scan_environments(lines, EQUATION_ENVS))
+        figures, figure_numbers = self.number_environments(
+                self.scan_environments(lines, FIGURE_ENVS))
+        for figure in figures:
+            text = self.read_range(tex_file, *figure)
+            figure.append([ f"{self.parent_dir}/{self.label}/src/{match.group(3)}"
+                            for match in FIGURE_PATH_PATTERN.finditer(text) ])
+        self.data = {
+            "version": INDEX_VERSION,
+            "tex_file": tex_file,
+            "src_signature": src_signature,
+            "signature": self.cutils.file_signature(tex_file),
+            "blob_hash": self.cutils.git_blob_hash(tex_file),
+            "equations": equations,
+            "equation_numbers": equation_numbers,
+            "figures": figures,
+            "figure_numbers": figure_numbers,
+        }
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        temp_filename = f"{self.index_file}.tmp"
+        with open(temp_filename, "w") as f:
+            json.dump(self.data, f, separators=(",", ":"))
+        os.replace(temp_filename, self.index_file)
+
+    # Parsing
+
+    def scan_environments(self, lines, env_names):
+        """
+        Finds numbered environments with given names. The rules are the
+        same as in fuzzy_find_eqns_figs.sh: starred environments are only
+        numbered if they have a label, environment with several labels
+        gets a number for every label, and every row of eqnarray/align
+        (outside of array) gets its own number.
+        Args:
+            lines (list of bytes): lines of the .tex file
+            env_names (list of str): names of the environments
+        Yields:
+            (start, end, count): byte range of the environment and the
+            number of numbers it takes
+        """
+        begin_pattern = re.compile(r'^\s*\\begin\{(' + "|".join(env_names) + r')(\*?)\}')
+        offset = 0
+        in_env = False
+        in_matrix = False
+        for raw_line in lines:
+            line = raw_line.decode("utf-8", errors="replace").rstrip("\n")
+            line_start = offset
+            offset += len(raw_line)
+            if not in_env:
+                match = begin_pattern.match(line)
+                if match:
+                    current_env = match.group(1)
+                    end_pattern = re.compile(r'^\s*\\end\{' + re.escape(current_env +
+                                             match.group(2)) + r'\}\s*$')
+                    in_env = True
+                    start = line_start
+                    label_count = 0
+                    extra_count = 0
+                    starred = "*" in line
+                    starred_has_label = False
+                continue
+
+            if "\\begin{array}" in line:
+                in_matrix = True
+            elif "\\end{array}" in line:
+                in_matrix = False
+            if "\\label" in line:
+                label_count += 1
+                if starred: starred_has_label = True
+            if (current_env in MULTILINE_ENVS and "\\\\" in line and
+                not in_matrix):
+                extra_count += 1
+
+            if end_pattern.match(line):
+                in_env = False
+                if not starred or starred_has_label:
+                    count = 1 + max(label_count - 1, 0) + extra_count
+                    end = line_start + len(raw_line.rstrip(b"\n"))
+                    yield start, end, count
+
+    def number_environments(self, environments):
+        """
+        Returns list of [start, end] of the environments, and list which
+        maps number - 1 to the index of environment with that number
+        """
+        ranges = []
+        numbers = []
+        for start, end, count in environments:
+            numbers.extend([len(ranges)] * count)
+            ranges.append([start, end])
+        return ranges, numbers
+
+    def read_range(self, file_path, start, end):
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start).decode("utf-8", errors="replace")
+
+    # Lookups
+
+    def get_item(self, item):
+        """
+        Returns the text of an item, e.g. "e12" (12th equation) or "f5"
+        (5th figure, with the paths of its images pointing to the source
+        directory), or None if there is no such item
+        """
+        if self.data is None:
+            self.sync()
+        kind, number = item[:1], item[1:]
+        if kind not in ("e", "f"):
+            raise ValueError(f"Unknown item type: {kind}")
+        if not number.isdigit() or int(number) < 1:
+            return None
+        prefix = "equation" if kind == "e" else "figure"
+        numbers = self.data[f"{prefix}_numbers"]
+        if int(number) > len(numbers):
+            return None
+        environment = self.data[f"{prefix}s"][numbers[int(number) - 1]]
+        text = self.read_range(self.data["tex_file"], *environment[:2])
+        if kind == "f":
+            replacement = f"\\1{self.parent_dir}/{self.label}/src/\\3\\5"
+            text = FIGURE_PATH_PATTERN.sub(replacement, text)
+        return text
+
+    def find_items(self, input_line):
+        """
+        Returns list of texts of the items in input line (e.g. "f5 e12"),
+        items that weren't found are skipped
+        """
+        texts = []
+        for item in input_line.split():
+            text = self.get_item(item)
+            if text is not None:
+                texts.append(text)
+        return texts
+
+if __name__ == "__main__":
+    # Usage: tex_index.py <parent_dir> <label> <items> [config_file]
+    from cache import library_state_dir
+    parent_dir, label, input_line = sys.argv[1:4]
+    cache_dir = None
+    if len(sys.argv) > 4:
+        with open(sys.argv[4]) as f:
+            cache_dir = json.load(f).get("cache_dir")
+        if cache_dir is not None: cache_dir = os.path.expanduser(cache_dir)
+    index_file = os.path.join(library_state_dir(parent_dir, cache_dir), 
+                              "tex", f"{label}.json")
+    tex_index = TexIndex(parent_dir, label, index_file)
+    try:
+        for item in input_line.split():
+            try:
+                text = tex_index.get_item(item)
+            except ValueError as e:
+                print(e)
+                continue
+            if text is not None:
+                print(text)
+    except FileNotFoundError as e:
+        print(e)
+        sys.exit(1)
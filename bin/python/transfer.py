@@ -0,0 +1,301 @@
+import os
+import time
+import shutil
+from urllib.parse import urlsplit
+from profiling import span
+
+CHUNK_SIZE = 1 << 16
+USER_AGENT = "citerius"
+# Longest wait for Retry-After of a rate-limited or unavailable server, in seconds
+MAX_RETRY_AFTER = 120
+
+class DownloadError(IOError):
+    pass
+
+def is_valid_pdf(file_path):
+    """
+    Checks that the file looks like a complete pdf
+    (starts with %PDF- header and has %%EOF marker near its end)
+    """
+    try:
+        with open(file_path, "rb") as f:
+            if f.read(5) != b"%PDF-":
+                return False
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 2048))
+            return b"%%EOF" in f.read()
+    except OSError:
+        return False
+
+def open_url(url, offset=0, timeout=60):
+    """
+    Opens url for reading, asking the server to start from byte offset
+    Returns:
+        (response, resumed): resumed is False if the server ignored the
+        range and sends the whole file
+    """
+    from urllib.request import Request, urlopen
+    from replay import standin_url
+    url = standin_url(url)
+    headers = { "User-Agent": USER_AGENT }
+    if offset > 0:
+        headers["Range"] = f"bytes={offset}-"
+    response = urlopen(Request(url, headers=headers), timeout=timeout)
+    return response, offset > 0 and response.status == 206
+
+def is_transient(error):
+    """
+    Checks whether the HTTP error is worth retrying
+    (rate limit or server error, e.g. arxiv's 503 with Retry-After)
+    """
+    return error.code == 429 or 500 <= error.code < 600
+
+def retry_delay(error, attempt):
+    """
+    Returns seconds to wait before the next attempt: Retry-After of the
+    response if it has one, otherwise exponential backoff
+    """
+    retry_after = error.headers.get("Retry-After") if error.headers else None
+    if retry_after:
+        if retry_after.strip().isdigit():
+            return min(int(retry_after), MAX_RETRY_AFTER)
+        from email.utils import parsedate_to_datetime
+        try:
+            wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            return min(max(wait, 0), MAX_RETRY_AFTER)
+        except (TypeError, ValueError):
+            pass
+    return 2 ** attempt
+
+def download_file(url, file_path, validate=None, retries=3,
+                  timeout=60, progress=None):
+    """
+    Downloads the file in chunks to <file_path>.part and moves it to
+    file_path once it's complete, so that file_path never contains
+    a truncated file. If a previous download was interrupted, it is resumed
+    from the end of the .part file (if the server supports ranges).
+    Args:
+        url (str): url of the file
+        file_path (str): where to save the file
+        validate (function): file path -> bool, check of the downloaded file
+            (e.g. is_valid_pdf). Invalid files are removed
+        retries (int): number of retries after a connection error,
+            rate limit (429) or server error (5xx)
+        timeout (float): connection timeout in seconds
+        progress (function): called as progress(downloaded_bytes, total_bytes)
+            after every chunk (total_bytes is None if it's unknown)
+    """
+    from urllib.error import HTTPError, URLError
+    from http.client import HTTPException
+    with span("transfer.download", host=urlsplit(url).netloc) as record:
+        part_path = file_path + ".part"
+        record["bytes"] = 0
+        for attempt in range(retries + 1):
+            record["attempts"] = attempt + 1
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            try:
+                response, resumed = open_url(url, offset, timeout)
+            except HTTPError as e:
+                if e.code == 416 and offset > 0:
+                    # The .part file already has the whole file
+                    break
+                if not is_transient(e) or attempt == retries:
+                    raise DownloadError(f"Failed to download {url}: {e}") from e
+                time.sleep(retry_delay(e, attempt))
+                continue
+            except (URLError, OSError, HTTPException) as e:
+                if attempt == retries:
+                    raise DownloadError(f"Failed to download {url}: {e}") from e
+                time.sleep(2 ** attempt)
+                continue
+
+            if not resumed: offset = 0
+            if resumed: record["resumed"] = True
+            length = response.headers.get("Content-Length")
+            total = offset + int(length) if length and length.isdigit() else None
+            downloaded = offset
+            try:
+                with response, open(part_path, "ab" if resumed else "wb") as f:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        record["bytes"] += len(chunk)
+                        if progress: progress(downloaded, total)
+            except (OSError, HTTPException) as e:
+                if attempt == retries:
+                    raise DownloadError(f"Failed to download {url}: {e}") from e
+                time.sleep(2 ** attempt)
+                continue
+            if total is not None and downloaded < total:
+                if attempt == retries:
+                    raise DownloadError(f"Download of {url} ended at " + \
+                                        f"{downloaded} of {total} bytes")
+                continue
+            break
+
+        if validate is not None and not validate(part_path):
+            os.remove(part_path)
+            raise DownloadError(f"File downloaded from {url} is not valid")
+        os.replace(part_path, file_path)
+        return file_path
+
+def open_source_url(url, retries=3, timeout=60):
+    """
+    Opens url, retrying connection errors, rate limits and server errors
+    """
+    from urllib.error import HTTPError
+    for attempt in range(retries + 1):
+        try:
+            response, _ = open_url(url, timeout=timeout)
+            return response
+        except HTTPError as e:
+            if not is_transient(e) or attempt == retries:
+                raise DownloadError(f"Failed to download {url}: {e}") from e
+            time.sleep(retry_delay(e, attempt))
+        except OSError as e:
+            if attempt == retries:
+                raise DownloadError(f"Failed to download {url}: {e}") from e
+            time.sleep(2 ** attempt)
+
+class SizeLimitExceeded(DownloadError):
+    pass
+
+class CappedWriter():
+    """
+    Counts the bytes written to the files of a single extraction,
+    and raises SizeLimitExceeded once they exceed max_bytes
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.written = 0
+
+    def add(self, n_bytes):
+        self.written += n_bytes
+        if self.max_bytes is not None and self.written > self.max_bytes:
+            raise SizeLimitExceeded(f"Extracted files exceed the limit " + \
+                                    f"of {self.max_bytes} bytes")
+
+    def copy(self, source, file_path):
+        with open(file_path, "wb") as f:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                self.add(len(chunk))
+                f.write(chunk)
+
+class PrefixedStream():
+    """
+    Stream that returns already read bytes (prefix) before the rest of
+    the underlying stream, so that the beginning of a non-seekable stream
+    can be inspected
+    """
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data = self.prefix + self.stream.read()
+            self.prefix = b""
+            return data
+        data = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        return data
+
+def read_head(stream, n_bytes):
+    """
+    Reads first n_bytes of the stream (fewer only if the stream ends)
+    """
+    head = b""
+    while len(head) < n_bytes:
+        chunk = stream.read(n_bytes - len(head))
+        if not chunk:
+            break
+        head += chunk
+    return head
+
+def is_safe_member(member, dest_dir):
+    """
+    Checks that the tar member is a regular file or directory
+    that would be extracted inside dest_dir
+    """
+    if not (member.isfile() or member.isdir()):
+        return False
+    name = member.name
+    if os.path.isabs(name) or ".." in name.replace("\\", "/").split("/"):
+        return False
+    dest_dir = os.path.realpath(dest_dir)
+    target = os.path.realpath(os.path.join(dest_dir, name))
+    return os.path.commonpath([dest_dir, target]) == dest_dir
+
+def extract_tar_stream(stream, dest_dir, writer):
+    """
+    Extracts tar archive from a non-seekable stream, member by member.
+    Links, devices and members with paths outside of dest_dir are skipped.
+    """
+    import tarfile
+    with tarfile.open(fileobj=stream, mode="r|") as tar:
+        for member in tar:
+            if not is_safe_member(member, dest_dir):
+                print(f"Skipping unsafe member of the archive: {member.name}")
+                continue
+            path = os.path.join(dest_dir, member.name)
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            writer.copy(tar.extractfile(member), path)
+
+def extract_source(url, dest_dir, single_file_name="main", 
+                   max_bytes=None, retries=3, timeout=60):
+    """
+    Downloads the source of the paper and extracts it into dest_dir while 
+    it is being downloaded, without saving the archive. Arxiv sources are
+    gzipped tar archives, gzipped single .tex files, or (rarely) 
+    uncompressed files, which are all supported.
+    The files are extracted into a temporary directory first, which 
+    replaces dest_dir once the extraction is complete.
+    Args:
+        url (str): url of the source
+        dest_dir (str): directory to extract the source to (its previous
+            content is replaced)
+        single_file_name (str): name (without extension) of the file, if 
+            the source is a single file instead of an archive
+        max_bytes (int): maximal total size of the extracted files 
+            (None for no limit)
+        retries (int): number of retries of the request after a connection
+            error, rate limit or server error (an interrupted extraction
+            isn't resumed)
+        timeout (float): connection timeout in seconds
+    """
+    import gzip
+    with span("transfer.source", host=urlsplit(url).netloc) as record:
+        part_dir = dest_dir + ".part"
+        shutil.rmtree(part_dir, ignore_errors=True)
+        os.makedirs(part_dir)
+        writer = CappedWriter(max_bytes)
+        try:
+            response = open_source_url(url, retries, timeout)
+            with response:
+                stream = response
+                head = read_head(stream, 2)
+                if head == b"\x1f\x8b":
+                    stream = gzip.GzipFile(fileobj=PrefixedStream(head, stream))
+                    head = b""
+                head += read_head(stream, 512 - len(head))
+                stream = PrefixedStream(head, stream)
+                if head[257:262] == b"ustar":
+                    extract_tar_stream(stream, part_dir, writer)
+                else:
+                    extension = ".pdf" if head.startswith(b"%PDF-") else ".tex"
+                    writer.copy(stream, os.path.join(part_dir, 
+                                                     single_file_name + extension))
+            if os.path.isdir(dest_dir):
+                shutil.rmtree(dest_dir)
+            os.replace(part_dir, dest_dir)
+        except BaseException:
+            shutil.rmtree(part_dir, ignore_errors=True)
+            raise
+        # Source is extracted while it's downloaded, so the span covers both
+        record["bytes"] = writer.written
+        return writer.written
@@ -1,7 +1,11 @@
+import os
 import sys
+import shutil
+import threading
+import subprocess
 from functools import partial
 from typing import List, Tuple
-from readchar import readkey
+from readchar import readkey, key
 from rich.console import Console
 from rich.panel import Panel
 from rich.style import Style
@@ -11,12 +15,98 @@ from rich.layout import Layout
 from rich.ansi import AnsiDecoder
 from rich.color import Color
 from time import sleep
+from fuzzy import FuzzyFilter
+from jobs import JobRunner
+
+# Redraws per second while background jobs are running
+JOB_REFRESH_RATE = 4
+
+class PaperBrowser:
+    def __init__(self, rows, short_author, title, on_select):
+        """
+        Paper list filtered as you type. Only the rows that fit on the
+        screen are formatted and rendered, so the size of the library
+        only matters to the filter
+        Args:
+            rows (list of tuples): (label, author, year, title) of the papers
+            short_author (function): shortens the authors for display
+            title (str): title of the panel
+            on_select (function): called with the label of the chosen paper
+        """
+        self.rows = rows
+        self.short_author = short_author
+        self.title = title
+        self.on_select = on_select
+        self.filter = FuzzyFilter([ " ".join(map(str, row)) for row in rows ])
+        self.query = ""
+        self.matches = self.filter.filter("")
+        self.cursor = 0
+        self.offset = 0 # Index of the first visible match
+
+    def set_query(self, query: str):
+        self.query = query
+        self.matches = self.filter.filter(query)
+        self.cursor = 0
+        self.offset = 0
+
+    def move(self, direction: int):
+        if len(self.matches) > 0:
+            self.cursor = max(0, min(len(self.matches) - 1, self.cursor + direction))
+
+    def selected_label(self):
+        if len(self.matches) == 0:
+            return None
+        return self.rows[self.matches[self.cursor]][0]
+
+    def render(self, height: int) -> Panel:
+        """
+        Returns panel with the query and the visible window of the matches
+        Args:
+            height (int): number of rows that fit into the panel
+        """
+        # Scroll just enough to keep the cursor visible
+        if self.cursor < self.offset:
+            self.offset = self.cursor
+        elif self.cursor >= self.offset + height:
+            self.offset = self.cursor - height + 1
+
+        text = Text(no_wrap=True, overflow="ellipsis")
+        text.append("> ", style="bold bright_cyan")
+        text.append(self.query)
+        text.append("█", style="bright_cyan")
+        text.append(f"  {len(self.matches)}/{len(self.rows)}\n", style="bright_black")
+        for i in range(self.offset, min(self.offset + height, len(self.matches))):
+            label, author, year, title = self.rows[self.matches[i]]
+            line = f"{label:<28.28} {self.short_author(author):<20.20} {str(year):<4.4}  {title}"
+            if i == self.cursor:
+                text.append(f"⮞ {line}\n", style="bright_white on rgb(40,40,40) bold")
+            else:
+                text.append(f"  {line}\n", style="bright_black")
+        return Panel(text, title=f"[bold]{self.title}[/]",
+                     style="on rgb(20,20,20)", padding=(0, 1))
 
 class CiteriusTUI:
-    def __init__(self):
+    def __init__(self, config_file=None):
+        """
+        Args:
+            config_file (str): path to json config file
+                (if None, then the default value is $HOME/.config/citerius/config.json)
+        """
         self.console = Console()
         self.layout = Layout()
         self.running = True
+        self.config_file = config_file
+        self.session = None # Opened by the first action that needs the library
+        self.session_lock = threading.Lock()
+        self.browser = None # PaperBrowser, when the paper list is shown
+        self.prompt = None # (message, typed text, on_submit), when asking for input
+        self.jobs = JobRunner()
+        self.limiter = None # Shared by all the downloads
+        self.reserved_labels = set() # Labels of the additions in progress
+        self.live = None
+        self.draw_lock = threading.Lock() # Drawing is paused while an editor runs
+        self.paused = False
+        self.quit_warned = False
         
         # Menu state
         self.current_menu = []
@@ -34,6 +124,34 @@ class CiteriusTUI:
             'q': self._exit,
             'h': partial(self._set_status, "Help: j/k - Navigate | Enter - Select | q - Quit"),
         }
+        # In the paper list, the letters go to the query
+        self.BROWSER_BINDINGS = {
+            key.UP: partial(self._move_browser, -1),
+            key.DOWN: partial(self._move_browser, 1),
+            key.CTRL_P: partial(self._move_browser, -1),
+            key.CTRL_N: partial(self._move_browser, 1),
+            key.PAGE_UP: partial(self._move_browser_page, -1),
+            key.PAGE_DOWN: partial(self._move_browser_page, 1),
+            key.BACKSPACE: self._delete_query_char,
+            '\x08': self._delete_query_char,
+            key.CTRL_U: partial(self._set_query, ""),
+            '\r': self._select_paper,
+            '\n': self._select_paper,
+            # readkey waits for the rest of escape sequence after Esc
+            key.ESC: self._close_browser,
+            key.ESC + key.ESC: self._close_browser,
+            key.CTRL_G: self._close_browser,
+        }
+        self.PROMPT_BINDINGS = {
+            key.BACKSPACE: self._delete_prompt_char,
+            '\x08': self._delete_prompt_char,
+            key.CTRL_U: self._clear_prompt,
+            '\r': self._submit_prompt,
+            '\n': self._submit_prompt,
+            key.ESC: self._close_prompt,
+            key.ESC + key.ESC: self._close_prompt,
+            key.CTRL_G: self._close_prompt,
+        }
         
         # Styles
         self.styles = {
@@ -87,6 +205,13 @@ class CiteriusTUI:
             action()
 
     def _exit(self):
+        n_active = len(self.jobs.active_jobs())
+        if n_active > 0 and not self.quit_warned:
+            # Jobs are finished before exit, so the user is told first
+            self.quit_warned = True
+            self._set_status(f"{n_active} job(s) are still running or queued. " + \
+                             "Quit again to finish them and exit")
+            return
         self.running = False
 
     def _create_header(self) -> Text:
@@ -111,7 +236,12 @@ class CiteriusTUI:
         )
 
     def _create_status_bar(self) -> Panel:
-        status_text = Text(self.status_message, style=self.styles['status'])
+        if self.prompt is not None:
+            message, text, _ = self.prompt
+            status_text = Text(f"{message}: ", style="bold bright_cyan")
+            status_text.append(text + "█")
+        else:
+            status_text = Text(self.status_message, style=self.styles['status'])
         return Panel(
             status_text,
             style="dim",
@@ -119,27 +249,197 @@ class CiteriusTUI:
             padding=(0, 1)
         )
 
+    def _jobs_height(self) -> int:
+        n_jobs = len(self.jobs.visible_jobs())
+        return n_jobs + 2 if n_jobs > 0 else 0
+
+    def _browser_height(self) -> int:
+        # Terminal minus header, jobs, status bar, panel borders and query line
+        return max(1, self.console.size.height - 5 - self._jobs_height() - 3 - 2 - 1)
+
     def _build_interface(self) -> Layout:
         self.layout.split(
             Layout(self._create_header(), name="header", size=5),
             Layout(self._create_menu_panel(), name="main"),
+            # The runner renders its own panel, every time the screen is drawn
+            Layout(self.jobs, name="jobs", size=2, visible=False),
             Layout(self._create_status_bar(), name="status", size=3)
         )
         return self.layout
 
+    def _update_interface(self):
+        # The layout is built once, only its parts are replaced
+        if self.browser is not None:
+            self.layout["main"].update(self.browser.render(self._browser_height()))
+        else:
+            self.layout["main"].update(self._create_menu_panel())
+        jobs_height = self._jobs_height()
+        self.layout["jobs"].visible = jobs_height > 0
+        self.layout["jobs"].size = jobs_height
+        self.layout["status"].update(self._create_status_bar())
+
+    def _refresh(self):
+        with self.draw_lock:
+            if not self.paused:
+                self.live.refresh()
+
+    def _refresh_jobs(self):
+        """
+        Redraws the screen while jobs are running (the key loop only
+        redraws after a key is pressed)
+        """
+        version = 0
+        while self.running:
+            new_version = self.jobs.wait_for_update(version, timeout=0.5)
+            if new_version != version or self.jobs.active_jobs():
+                self._refresh()
+                version = new_version
+            sleep(1 / JOB_REFRESH_RATE)
+
+    def _run_in_terminal(self, function, *args):
+        """
+        Calls function with the screen given back to the terminal 
+        (e.g. for an editor), returns its result
+        """
+        with self.draw_lock:
+            self.paused = True
+            self.live.stop()
+        self.jobs.restore_output()
+        try:
+            return function(*args)
+        finally:
+            self.jobs.capture_output()
+            with self.draw_lock:
+                self.live.start()
+                self.paused = False
+
     def _set_status(self, message: str):
         self.status_message = message
 
     def _clear_status(self):
         self.status_message = ""
 
+    def _get_session(self):
+        # Jobs that start at once must share one session (and its lock)
+        with self.session_lock:
+            if self.session is None:
+                from session import CiteriusSession
+                self.session = CiteriusSession(self.config_file)
+        return self.session
+
+    def _get_limiter(self):
+        if self.limiter is None:
+            from paper_downloader import HostRateLimiter
+            self.limiter = HostRateLimiter()
+        return self.limiter
+
+    def _reserve_label(self, session, label, explicit):
+        """
+        Reserves label for an addition, so that two jobs never download
+        into the same directory. Default labels that are taken get a letter
+        suffix (e.g. Smith2020a), explicitly given ones fail the job.
+        Call with session.lock held
+        """
+        def is_taken(label):
+            return label in self.reserved_labels or \
+                os.path.exists(os.path.join(session.citerius.parent_dir, label)) or \
+                session.citerius.get_paper_info(label) is not None
+        if is_taken(label):
+            if explicit:
+                raise ValueError(f"There is already a paper with the label {label}")
+            label = next( label + suffix for suffix in suffixes()
+                          if not is_taken(label + suffix) )
+        self.reserved_labels.add(label)
+        return label
+
+    # Input prompt (in the status bar)
+
+    def _ask(self, message: str, on_submit):
+        self.prompt = (message, "", on_submit)
+
+    def _close_prompt(self):
+        self.prompt = None
+
+    def _clear_prompt(self):
+        self.prompt = (self.prompt[0], "", self.prompt[2])
+
+    def _delete_prompt_char(self):
+        self.prompt = (self.prompt[0], self.prompt[1][:-1], self.prompt[2])
+
+    def _submit_prompt(self):
+        _, text, on_submit = self.prompt
+        self.prompt = None
+        on_submit(text.strip())
+
+    def _handle_prompt_key(self, pressed: str):
+        if pressed in self.PROMPT_BINDINGS:
+            self.PROMPT_BINDINGS[pressed]()
+        elif len(pressed) == 1 and pressed.isprintable():
+            self.prompt = (self.prompt[0], self.prompt[1] + pressed, self.prompt[2])
+
+    # Paper list
+
+    def _open_browser(self, title: str, on_select):
+        citerius = self._get_session().citerius
+        citerius.index.sync()
+        self.browser = PaperBrowser(citerius.index.citation_rows(),
+                                    citerius.cutils.short_author, title, on_select)
+        self._set_status("Type to filter | ↑/↓ - Navigate | Enter - Select | Esc Esc/Ctrl-g - Back")
+
+    def _close_browser(self):
+        self.browser = None
+        self._clear_status()
+
+    def _move_browser(self, direction: int):
+        self.browser.move(direction)
+
+    def _move_browser_page(self, direction: int):
+        self.browser.move(direction * self._browser_height())
+
+    def _set_query(self, query: str):
+        self.browser.set_query(query)
+
+    def _delete_query_char(self):
+        self.browser.set_query(self.browser.query[:-1])
+
+    def _select_paper(self):
+        label = self.browser.selected_label()
+        if label is None:
+            return
+        on_select = self.browser.on_select
+        self._close_browser()
+        on_select(label)
+
+    def _handle_browser_key(self, pressed: str):
+        if pressed in self.BROWSER_BINDINGS:
+            self.BROWSER_BINDINGS[pressed]()
+        elif len(pressed) == 1 and pressed.isprintable():
+            self.browser.set_query(self.browser.query + pressed)
+
     def main_loop(self):
-        with Live(self.layout, refresh_per_second=24, screen=True) as live:
+        self._build_interface()
+        # Output of the jobs goes to the jobs panel instead of the screen
+        # (the console keeps writing to the terminal)
+        self.console.file = sys.stdout
+        self.jobs.capture_output()
+        self.live = Live(self.layout, auto_refresh=False, screen=True,
+                         console=self.console, redirect_stdout=False,
+                         redirect_stderr=False)
+        self.live.start()
+        threading.Thread(target=self._refresh_jobs, daemon=True).start()
+        try:
             while self.running:
-                self.layout.update(self._build_interface())
+                # Redrawn after every key, and by _refresh_jobs while
+                # the jobs are running
+                self._update_interface()
+                self._refresh()
                 key = readkey()
                 
-                if key in self.BINDINGS:
+                if self.prompt is not None:
+                    self._handle_prompt_key(key)
+                elif self.browser is not None:
+                    self._handle_browser_key(key)
+                elif key in self.BINDINGS:
                     self.BINDINGS[key]()
                 #elif key == '\x1b':  # Escape character
                 #    key += readkey()  # Read [
@@ -149,11 +449,19 @@ class CiteriusTUI:
                 #        self._move_selection(-1)
                 #    elif key == '\x1b[B':  # Down arrow
                 #        self._move_selection(1)
-                
-                # Auto-clear status messages after delay
-                if self.status_message and "..." in self.status_message:
-                    sleep(1)
-                    self._clear_status()
+        finally:
+            self.running = False
+            with self.draw_lock:
+                self.live.stop()
+            self.jobs.restore_output()
+            n_active = len(self.jobs.active_jobs())
+            if n_active > 0:
+                print(f"Waiting for {n_active} job(s)...")
+            # Queued additions are finished too, nothing is dropped silently
+            self.jobs.shutdown(wait=True)
+            if self.session is not None:
+                self.session.flush()
+                self.session.close()
 
     # Menu handlers
     def browse_papers_menu(self): self._set_menu('browse')
@@ -162,36 +470,178 @@ class CiteriusTUI:
 
     # Action methods
     def fuzzy_find_paper(self): 
-        self._set_status("🔍 Launching fuzzy find interface...")
-        sleep(1)
+        self._open_browser("🔍 Read Paper", self.open_paper)
+
+    def open_paper(self, label: str):
+        path = os.path.join(self._get_session().citerius.parent_dir, label, f"{label}.pdf")
+        if not os.path.exists(path):
+            self._set_status(f"No pdf of {label} found")
+            return
+        try:
+            subprocess.Popen(["zathura", path], stdin=subprocess.DEVNULL,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                             start_new_session=True)
+            self._set_status(f"Opened {label}")
+        except FileNotFoundError:
+            self._set_status(f"zathura not found, the pdf is {path}")
 
     def get_paper_label(self):
-        self._set_status("🏷️ Fetching paper labels...")
-        sleep(1)
+        self._open_browser("🏷️ Get Paper Label", self.show_label)
+
+    def show_label(self, label: str):
+        self._set_status(f"Label: {label}")
 
     def remove_paper(self):
-        self._set_status("🗑️ Removing selected paper...")
-        sleep(1)
+        self._open_browser("🗑️ Remove Paper", self.confirm_removal)
+
+    def confirm_removal(self, label: str):
+        def on_answer(answer):
+            if answer.lower() == 'y':
+                self.jobs.submit(f"🗑️ Remove {label}", self.remove_job, label)
+            else:
+                self._set_status(f"{label} was not removed")
+        self._ask(f"Remove {label}? (y/N)", on_answer)
 
     def add_arxiv_paper(self):
-        self._set_status("📄 Adding arXiv paper...")
-        sleep(1)
+        def on_submit(arxiv_id):
+            if arxiv_id:
+                self.jobs.submit(f"📄 arXiv {arxiv_id}", self.download_job,
+                                 arxiv_id, None, ['y', 'n', "", 'n'])
+                self._set_status(f"Queued {arxiv_id}, you can keep browsing")
+        self._ask("arXiv id", on_submit)
 
     def add_web_paper(self):
-        self._set_status("🌍 Adding web link...")
-        sleep(1)
+        def on_submit(link):
+            if link:
+                self._add_with_bibtex(f"🌍 {link}", link, ['y', 'n', "", 'n'])
+        self._ask("Link to the pdf", on_submit)
 
     def add_pdf_paper(self):
-        self._set_status("📂 Adding PDF document...")
-        sleep(1)
+        def on_submit(path):
+            if path:
+                path = os.path.expanduser(path)
+                if not os.path.isfile(path):
+                    self._set_status(f"No file {path} found")
+                    return
+                self._add_with_bibtex(f"📂 {os.path.basename(path)}", path,
+                                      ['n', 'n', "", 'n'])
+        self._ask("Path to the pdf", on_submit)
+
+    def _add_with_bibtex(self, title, download_id, download_params):
+        """
+        Asks for the bibliography info in the editor (in the foreground),
+        then adds the paper in the background
+        """
+        from paper_downloader import PaperDownloader
+        try:
+            paper_download = self._run_in_terminal(partial(
+                PaperDownloader, self.config_file, download_id, no_commits=True,
+                defer_records=True, session=self._get_session()))
+        except (Exception, SystemExit) as e:
+            self._set_status(f"The paper was not added: {e}")
+            return
+        self.jobs.submit(title, self.download_job, download_id, paper_download,
+                         download_params)
+        self._set_status(f"Queued {paper_download.default_label}")
 
     def sync_repository(self):
-        self._set_status("🔄 Syncing with remote repository...")
-        sleep(1)
+        self.jobs.submit("🔄 Sync with remote", self.sync_job)
+
+    # Jobs (run by the workers of self.jobs)
+
+    def download_job(self, job, download_id, paper_download, download_params):
+        """
+        Downloads the paper, then appends its records and commits them.
+        Only one job changes the library at a time
+        """
+        from paper_downloader import PaperDownloader
+        session = self._get_session()
+        progress = job.file_progress(download_id)
+        if paper_download is None:
+            job.set_message("Looking up the paper")
+            paper_download = PaperDownloader(self.config_file, download_id, 
+                                             no_commits=True, defer_records=True,
+                                             session=session, progress=progress)
+        else:
+            paper_download.progress = progress
+        pdf, src, label, *rest = download_params
+        with session.lock:
+            label = self._reserve_label(session, label or paper_download.default_label,
+                                        explicit=bool(label))
+        try:
+            host = self._get_limiter().host_for_paper(paper_download.arxiv_id,
+                                                      paper_download.download_link)
+            if host is not None:
+                job.set_message(f"Waiting for {host}")
+            with self._get_limiter().slot(host):
+                try:
+                    paper_download.download_paper_without_user_input(pdf, src, label, *rest)
+                except BaseException:
+                    if paper_download.record_pending:
+                        shutil.rmtree(paper_download.download_dir, ignore_errors=True)
+                    raise
+            with session.lock:
+                if paper_download.record_pending:
+                    paper_download.append_bibtex()
+                session.citerius.git_update_files(f"Added paper with label {label}")
+                session.flush()
+                session.citerius.update_search_index([label])
+        finally:
+            with session.lock:
+                self.reserved_labels.discard(label)
+        session.citerius.prewarm_previews([label])
+        job.set_message(f"Added {label}")
+        return label
+
+    def remove_job(self, job, label):
+        session = self._get_session()
+        with session.lock:
+            removed = session.citerius.remove_papers([label])
+            session.flush()
+        job.set_message(f"Removed {label}" if removed else f"{label} was not found")
+        return removed
+
+    def sync_job(self, job):
+        """
+        Pulls the library from its remote and downloads the papers that 
+        are missing on disk
+        """
+        from paper_downloader import BulkDownloader
+        session = self._get_session()
+        repo = session.citerius.repo
+        with session.lock:
+            session.flush()
+            job.set_message("Pulling from the remote")
+            # Nobody can answer a password prompt in the background
+            with repo.git.custom_environment(GIT_TERMINAL_PROMPT="0"):
+                repo.remote().pull()
+        bulk_download = BulkDownloader(self.config_file, workers=2, session=session,
+                                       limiter=self._get_limiter(),
+                                       progress=job.file_progress)
+        failed_ids = bulk_download.download_from_citerius()
+        if failed_ids:
+            raise RuntimeError(f"Failed to restore {len(failed_ids)} paper(s): " + \
+                               ", ".join(failed_ids))
+        job.set_message("Library is up to date")
+
+def suffixes():
+    """
+    Yields label suffixes a, b, ..., z, aa, ab, ...
+    """
+    from itertools import count, product
+    from string import ascii_lowercase
+    for length in count(1):
+        for letters in product(ascii_lowercase, repeat=length):
+            yield "".join(letters)
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Citerius TUI")
+    parser.add_argument('--config', type=str, default=None,
+                        help='Path to Citerius config file')
+    args = parser.parse_args()
     try:
-        app = CiteriusTUI()
+        app = CiteriusTUI(args.config)
         app.main_loop()
     except KeyboardInterrupt:
         sys.exit(0)
@@ -1,11 +1,26 @@
 import tempfile
 import subprocess
-import asyncio
 import os
 import re
-import pybibget as pbg
+import csv
+import threading
+import hashlib
+from profiling import span
+
+# Maximal number of ids in a single arxiv API query
+ARXIV_PAGE_SIZE = 100
 
 class CiteriusUtils():
+    def __init__(self, cache=None):
+        """
+        Citerius utilities class.
+        Args:
+            cache (CiteriusCache): cache for arxiv/bibget lookups 
+                (if None, nothing is cached)
+        """
+        self.cache = cache
+        self.lookup_lock = threading.Lock() # Event loop can't be shared by threads
+
     def get_user_input_via_editor(self, initial_content="", editor=None):
         # Determine the editor to use (defaults to vim or $EDITOR environment variable)
         if editor is None:
@@ -39,15 +54,125 @@ class CiteriusUtils():
         """
         Takes in paper arxiv id, returns string with bibget citation
         """
-        
-        keys = [arxiv_addr]
-        
-        bibget = pbg.Bibget(mathscinet=True)
-        bib_data = asyncio.run(bibget.citations(keys))
-        number_of_entries = len(bib_data.entries)
-        bib_data = bib_data.to_string('bibtex')
-    
-        return bib_data
+        citations = self.get_citations_from_arxiv_ids([arxiv_addr])
+        return citations.get(arxiv_addr, "")
+
+    def get_citations_from_arxiv_ids(self, arxiv_ids):
+        """
+        Takes in a list of arxiv ids, returns dictionary 
+        arxiv id -> string with bibget citation.
+        All the ids are resolved with a single bibget call, which runs on 
+        the event loop that is kept for the lifetime of this class. 
+        Ids that couldn't be resolved are missing from the dictionary.
+        """
+        keys = list(dict.fromkeys(arxiv_ids)) # Remove duplicates, keep order
+        citations = self.get_cached("bibtex", keys)
+        keys = [ key for key in keys if key not in citations ]
+        if len(keys) == 0:
+            return citations
+
+        with self.lookup_lock, span("bibget.lookup", ids=len(keys)):
+            bib_data = self.get_event_loop().run_until_complete(
+                    self.get_bibget().citations(keys))
+
+        # bibget uses the arxiv id itself as the key of the entry
+        import pybtex.database as pbt
+        for key in keys:
+            if key in bib_data.entries:
+                entry_data = pbt.BibliographyData({key: bib_data.entries[key]})
+                citations[key] = entry_data.to_string('bibtex')
+                self.set_cached("bibtex", key, citations[key])
+        return citations
+
+    def get_arxiv_results_from_ids(self, arxiv_ids):
+        """
+        Takes in a list of arxiv ids, returns dictionary 
+        arxiv id -> arxiv.Result.
+        Ids are queried in pages of up to ARXIV_PAGE_SIZE ids with a single 
+        id_list query per page, through the client shared by all the lookups 
+        of this class. Ids that weren't found are missing from the dictionary.
+        """
+        keys = list(dict.fromkeys(arxiv_ids)) # Remove duplicates, keep order
+        results = self.get_cached("arxiv", keys)
+        keys = [ key for key in keys if key not in results ]
+        import arxiv
+        client = self.get_arxiv_client()
+        for i in range(0, len(keys), ARXIV_PAGE_SIZE):
+            page_keys = keys[i:i+ARXIV_PAGE_SIZE]
+            search = arxiv.Search(id_list=page_keys, max_results=len(page_keys))
+            with span("arxiv.query", ids=len(page_keys)):
+                page_results = list(client.results(search))
+            for result in page_results:
+                short_id = result.get_short_id()
+                unversioned_id = re.sub(r'v\d+$', '', short_id)
+                for key in page_keys:
+                    # Ids without version resolve to the latest one
+                    if key == short_id or key == unversioned_id:
+                        results[key] = result
+                        self.set_cached("arxiv", key, result)
+        return results
+
+    def get_cached(self, kind, keys):
+        """
+        Returns dictionary key -> cached value of given kind 
+        for all the keys that are in the cache
+        """
+        values = {}
+        if self.cache is None:
+            return values
+        for key in keys:
+            value = self.cache.get(f"{kind}:{key}")
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set_cached(self, kind, key, value):
+        """
+        Stores value of given kind in the cache
+        """
+        if self.cache is not None:
+            self.cache.set(f"{kind}:{key}", value)
+
+    def get_arxiv_client(self):
+        """
+        Returns arxiv API client, shared by all the lookups of this class
+        """
+        if getattr(self, "arxiv_client", None) is None:
+            import arxiv
+            from replay import standin_url
+            self.arxiv_client = arxiv.Client(page_size=ARXIV_PAGE_SIZE)
+            # Requests go to the local stand-in, if it's used
+            self.arxiv_client.query_url_format = standin_url(
+                    self.arxiv_client.query_url_format)
+        return self.arxiv_client
+
+    def get_bibget(self):
+        """
+        Returns bibget instance, shared by all the lookups of this class
+        """
+        if getattr(self, "bibget", None) is None:
+            import pybibget as pbg
+            from replay import use_standin_in_pybibget
+            use_standin_in_pybibget()
+            self.bibget = pbg.Bibget(mathscinet=True)
+        return self.bibget
+
+    def get_event_loop(self):
+        """
+        Returns event loop, shared by all the lookups of this class
+        """
+        if getattr(self, "event_loop", None) is None:
+            import asyncio
+            self.event_loop = asyncio.new_event_loop()
+        return self.event_loop
+
+    def close(self):
+        """
+        Closes the event loop used for bibget lookups
+        """
+        if getattr(self, "event_loop", None) is not None:
+            self.event_loop.close()
+            self.event_loop = None
     
     def obtain_label_from_bibentry(self, bib_entry):
         """
@@ -83,9 +208,7 @@ class CiteriusUtils():
         # Compile with flags to handle multiline entries
         regex = re.compile(pattern, flags=re.DOTALL | re.MULTILINE)
         # Search for the pattern in the content
-        content_str = ""
-        for line in content:
-            content_str += line
+        content_str = "".join(content)
         match = regex.search(content_str)
         return match.group(0) if match else None
     
@@ -123,6 +246,91 @@ class CiteriusUtils():
         # Replace the original file with the temporary file
         os.replace(temp_filename, filename)
 
+    def remove_csv_rows(self, file_path, labels, label_column="Label"):
+        """
+        Removes all the rows with given labels from csv file in a single pass.
+        Lines of the remaining rows are copied unchanged.
+        Args:
+            file_path (str): path to csv file (with header)
+            labels (set of str): labels of the rows to remove
+            label_column (str): name of the column with labels
+        Returns:
+            list of int: numbers of the removed rows (without header)
+        """
+        temp_filename = f"{file_path}.tmp"
+        removed_rows = []
+        with open(file_path, 'r', newline='') as infile, \
+             open(temp_filename, 'w', newline='') as outfile:
+            header_line = infile.readline()
+            outfile.write(header_line)
+            label_idx = next(csv.reader([header_line])).index(label_column)
+            for row_number, line in enumerate(infile):
+                values = next(csv.reader([line]), [])
+                if len(values) > label_idx and values[label_idx] in labels:
+                    removed_rows.append(row_number)
+                else:
+                    outfile.write(line)
+
+        os.replace(temp_filename, file_path)
+        return removed_rows
+
+    def file_signature(self, file_path):
+        """
+        Returns string that changes whenever the file is modified 
+        (based on its modification time and size)
+        """
+        stat = os.stat(file_path)
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def git_blob_hash(self, file_path):
+        """
+        Returns hash of the file, as it would be computed by git 
+        (i.e. git hash-object)
+        """
+        blob_hash = hashlib.sha1(f"blob {os.path.getsize(file_path)}\0".encode())
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                blob_hash.update(block)
+        return blob_hash.hexdigest()
+
+    def get_remote_file_size(self, url, timeout=10):
+        """
+        Returns size of the file at url in bytes (from Content-Length of
+        a HEAD request), or None if the server doesn't report it
+        """
+        from urllib.request import Request, urlopen
+        from replay import standin_url
+        try:
+            with urlopen(Request(standin_url(url), method="HEAD"), 
+                         timeout=timeout) as response:
+                size = response.headers.get("Content-Length")
+        except Exception:
+            return None
+        return int(size) if size and size.isdigit() else None
+
+    def short_author(self, authors):
+        """
+        Returns short form of the authors from papers.csv
+        ("Doe J and Last F and ..." -> "Doe et al.")
+        """
+        if str(authors).lower() in ("", "nan"):
+            return ""
+        # Only the first two authors matter
+        authors = str(authors).split(" and ", 2)
+        last_names = [ (author.split(None, 1) or [""])[0] for author in authors[:2] ]
+        if len(authors) == 1:
+            return last_names[0]
+        if len(authors) == 2:
+            return f"{last_names[0]} and {last_names[1]}"
+        return f"{last_names[0]} et al."
+
+    def is_arxiv_id(self, string):
+        """
+        Checks if the passed string is in arxiv id format (without printing)
+        """
+        pattern = r'^(\d{4}\.\d{4,5}(v\d+)?|\d{7}(v\d+)?)$'
+        return re.match(pattern, string) != None and not os.path.isfile(string)
+
     def check_if_string_is_arxiv_id(self, string):
         """
         Checks if the passed string is in arxiv id format.
@@ -131,12 +339,11 @@ class CiteriusUtils():
             arxiv_id, download_link: a tuple of strings as they should
             be set in PaperDownloader class (i.e. one of them should be 'nan')
         """
-        pattern = r'^(\d{4}\.\d{4,5}(v\d+)?|\d{7}(v\d+)?)$'
         if os.path.isfile(string):
             arxiv_id = "nan"
             download_link = "nan"
             print(f"Identified file as {string}")
-        elif re.match(pattern, string) == None:
+        elif not self.is_arxiv_id(string):
             arxiv_id = "nan"
             download_link = string
             print(f"Identified download link as {download_link}")
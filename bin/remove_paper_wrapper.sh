@@ -8,4 +8,15 @@ SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 PYTHON_DIR="$SCRIPT_DIR/python"
 PYTHON="python3.12"
 
-$PYTHON $PYTHON_DIR/remove_paper.py "$parent_dir"
+# Papers are chosen with fzf (multi-select with Tab) and removed by 
+# Citerius daemon, which is started on the first call
+selection=$("$PYTHON" "$PYTHON_DIR/client.py" fzf --multi) || exit 0
+# One label per line, passed on without word splitting or globbing
+mapfile -t labels <<< "$selection"
+printf '%s\n' "${labels[@]}"
+read -p "You are about to remove the papers above. Are you sure? (y/N): " answer
+if [[ "$answer" == "y" || "$answer" == "Y" ]]; then
+    "$PYTHON" "$PYTHON_DIR/client.py" remove "${labels[@]}"
+else
+    echo "You answered '$answer'. The papers will not be removed."
+fi
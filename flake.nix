@@ -105,6 +105,7 @@
           buildInputs = with pkgs; [
             pythonEnv
             pybibget
+            poppler_utils
           ];
         };
       }
@@ -13,6 +13,272 @@ function! citerius#InitPaths()
 endfunction
 
 let g:citerius_source_dir = expand('<sfile>:p:h') . '/..'
+let g:citerius_python = get(g:, 'citerius_python', 'python3.12')
+let g:citerius_config = get(g:, 'citerius_config', '') " Empty for the default config
+let g:citerius_pdf_viewer = get(g:, 'citerius_pdf_viewer', 'zathura')
+let g:citerius_max_completions = get(g:, 'citerius_max_completions', 200)
+
+" Requests to Citerius daemon. The path of its socket is asked from client.py
+" once (which also starts the daemon if it's not running), after that the
+" requests go straight to the socket, without starting python.
+
+function! s:ClientArgs(args) abort
+	let l:command = [g:citerius_python, g:citerius_source_dir . '/bin/python/client.py']
+	if g:citerius_config !=# ''
+		let l:command += ['--config', expand(g:citerius_config)]
+	endif
+	return l:command + a:args
+endfunction
+
+function! s:ClientCommand(args) abort
+	return join(map(s:ClientArgs(a:args), 'shellescape(v:val)'))
+endfunction
+
+function! s:Socket() abort
+	if !exists('s:socket')
+		let l:output = systemlist(s:ClientCommand(['socket']))
+		if v:shell_error || empty(l:output)
+			throw join(l:output, "\n")
+		endif
+		let s:socket = l:output[-1]
+	endif
+	return s:socket
+endfunction
+
+function! s:OnNvimData(channel, data, event) abort
+	" The first item continues the last (unfinished) line
+	let s:nvim_response[-1] .= a:data[0]
+	call extend(s:nvim_response, a:data[1:])
+endfunction
+
+function! s:SendRaw(message) abort
+	" Returns the response line, or v:null if the daemon is not reachable
+	if has('nvim')
+		try
+			let l:channel = sockconnect('pipe', s:Socket(), {'on_data': function('s:OnNvimData')})
+		catch
+			return v:null
+		endtry
+		let s:nvim_response = ['']
+		call chansend(l:channel, a:message . "\n")
+		let l:status = wait(60000, {-> len(s:nvim_response) > 1})
+		call chanclose(l:channel)
+		return l:status == 0 ? s:nvim_response[0] : v:null
+	elseif has('channel')
+		let l:channel = ch_open('unix:' . s:Socket(), {'mode': 'nl'})
+		if ch_status(l:channel) !=# 'open'
+			return v:null
+		endif
+		let l:response = ch_evalraw(l:channel, a:message . "\n", {'timeout': 60000})
+		call ch_close(l:channel)
+		return l:response ==# '' ? v:null : l:response
+	endif
+	" No channels, every request goes through client.py
+	let l:message = json_decode(a:message)
+	let l:output = system(s:ClientCommand(['request', l:message.op, json_encode(l:message.args)]))
+	if v:shell_error
+		throw substitute(l:output, '\n$', '', '')
+	endif
+	return json_encode({'ok': v:true, 'result': json_decode(l:output)})
+endfunction
+
+function! citerius#Request(op, ...) abort
+	" Sends request to the daemon (see bin/python/daemon.py), returns its result
+	let l:message = json_encode({'op': a:op, 'args': a:0 > 0 ? a:1 : {}})
+	try
+		let l:response = s:SendRaw(l:message)
+		if l:response is v:null
+			" The daemon was stopped since the last request, start it again
+			unlet! s:socket
+			let l:response = s:SendRaw(l:message)
+		endif
+	catch
+		throw 'citerius: ' . v:exception
+	endtry
+	if l:response is v:null
+		throw 'citerius: daemon is not responding'
+	endif
+	let l:response = json_decode(l:response)
+	if !l:response.ok
+		throw 'citerius: ' . l:response.error
+	endif
+	return l:response.result
+endfunction
+
+" Label cache. Citerius rewrites it (labels.tsv in the state directory of
+" the library) at every commit. It is read by a background job, and the
+" completion only works with the copy in memory, so it doesn't wait for
+" anything.
+
+let s:labels = [] " Completion items, user_data is the lowercase line
+let s:label_cache_file = ''
+let s:label_cache_time = -1
+let s:loading = 0
+
+function! s:StartJob(command, Callback) abort
+	" Runs command in the background, calls Callback with its output lines
+	if has('nvim')
+		call jobstart(a:command, {'stdout_buffered': v:true,
+			\ 'on_stdout': {channel, data, event -> a:Callback(data)}})
+	else
+		let l:output = []
+		call job_start(a:command, {'out_mode': 'nl', 'err_io': 'null',
+			\ 'out_cb': {channel, line -> add(l:output, line)},
+			\ 'close_cb': {channel -> a:Callback(l:output)}})
+	endif
+endfunction
+
+function! citerius#LoadLabels(refresh) abort
+	" Starts reading the label cache, if it changed since the last read.
+	" With refresh, the daemon is asked to check the cache first (e.g. if 
+	" papers.csv was changed by git pull)
+	if s:loading
+		return
+	endif
+	if s:label_cache_file ==# '' || a:refresh
+		let s:loading = 1
+		call s:StartJob(s:ClientArgs(['label-cache']), function('s:OnLabelCachePath'))
+		return
+	endif
+	let l:time = getftime(s:label_cache_file)
+	if l:time == s:label_cache_time
+		return
+	endif
+	let s:loading = 1
+	let s:label_cache_time = l:time
+	call s:StartJob(['cat', s:label_cache_file], function('s:OnLabelCache'))
+endfunction
+
+function! s:OnLabelCachePath(lines) abort
+	let s:loading = 0
+	let l:lines = filter(copy(a:lines), 'v:val !=# ""')
+	if empty(l:lines) || !filereadable(l:lines[-1])
+		echomsg 'citerius: label cache is not available'
+		return
+	endif
+	let s:label_cache_file = l:lines[-1]
+	call citerius#LoadLabels(0)
+endfunction
+
+function! s:OnLabelCache(lines) abort
+	let l:items = []
+	for l:line in a:lines
+		if l:line ==# '' || l:line[0] ==# '#'
+			continue
+		endif
+		let l:fields = split(l:line, "\t", 1) + ['', '', '']
+		call add(l:items, {'word': l:fields[0], 'menu': l:fields[1] . ' ' . l:fields[2],
+			\ 'info': l:fields[3], 'user_data': tolower(l:line)})
+	endfor
+	let s:labels = l:items
+	let s:loading = 0
+endfunction
+
+function! citerius#FindLabels(base) abort
+	" Returns completion items of the papers whose label, author, year or 
+	" title match base (fuzzy if Vim can do it), best matches first
+	if a:base ==# ''
+		return s:labels[: g:citerius_max_completions - 1]
+	endif
+	if exists('*matchfuzzy')
+		return matchfuzzy(s:labels, a:base, {'key': 'user_data', 
+			\ 'limit': g:citerius_max_completions})
+	endif
+	let l:base = tolower(a:base)
+	return filter(copy(s:labels), 'stridx(v:val.user_data, l:base) >= 0')[: g:citerius_max_completions - 1]
+endfunction
+
+function! citerius#Complete(findstart, base) abort
+	" Completefunc/omnifunc for the keys of \cite{...} (and \citep, \autocite etc.)
+	if a:findstart
+		let l:before = strpart(getline('.'), 0, col('.') - 1)
+		let l:start = matchend(l:before, '\v\\\a*cite\a*\*?(\[[^]]*\])*\{([^}]*,)?\s*\ze[^,}]*$')
+		return l:start < 0 ? -3 : l:start
+	endif
+	call citerius#LoadLabels(0)
+	" Vim only filters by prefix of the label, so the items are asked 
+	" again on every typed character
+	return {'words': citerius#FindLabels(a:base), 'refresh': 'always'}
+endfunction
+
+function! citerius#PickMenu() abort
+	" Shows all the papers in completion menu (call from insert mode)
+	call complete(col('.'), s:labels)
+	return ''
+endfunction
+
+function! citerius#Pick() abort
+	" Citation picker: fzf (if fzf.vim is installed) over the label cache, 
+	" otherwise \cite{} with completion menu of all the papers
+	call citerius#LoadLabels(0)
+	if exists('*fzf#run') && s:label_cache_file !=# ''
+		call fzf#run(fzf#wrap({'source': 'grep -v "^#" ' . shellescape(s:label_cache_file),
+			\ 'options': ['--delimiter', "\t", '--prompt', 'Cite> '],
+			\ 'sink': {line -> citerius#Cite(split(line, "\t")[0])}}))
+	else
+		call feedkeys("a\\cite{}\<Left>\<C-r>=citerius#PickMenu()\<CR>", 'n')
+	endif
+endfunction
+
+function! citerius#SetupBuffer() abort
+	" Other completion plugins (e.g. vimtex) are not overridden
+	if &l:completefunc ==# ''
+		setlocal completefunc=citerius#Complete
+	endif
+	if &l:omnifunc ==# ''
+		setlocal omnifunc=citerius#Complete
+	endif
+	call citerius#LoadLabels(1)
+endfunction
+
+augroup citerius
+	autocmd!
+	autocmd FileType tex,plaintex,bib,markdown,pandoc call citerius#SetupBuffer()
+augroup END
+
+function! citerius#CompleteLabels(arglead, cmdline, cursorpos) abort
+	let l:labels = empty(s:labels) ? citerius#Request('labels') : map(copy(s:labels), 'v:val.word')
+	return filter(l:labels, 'stridx(v:val, a:arglead) == 0')
+endfunction
+
+function! citerius#Cite(label) abort
+	" Inserts \cite{label} after the cursor
+	let l:line = getline('.')
+	let l:col = col('.')
+	call setline('.', strpart(l:line, 0, l:col) . '\cite{' . a:label . '}' . strpart(l:line, l:col))
+endfunction
+
+function! citerius#Bibtex(label) abort
+	" Puts bibtex entry of the paper below the cursor
+	let l:entry = citerius#Request('bibtex', {'label': a:label})
+	call append(line('.'), split(l:entry, "\n"))
+endfunction
+
+function! citerius#Info(label) abort
+	let l:info = citerius#Request('info', {'label': a:label})
+	echo l:info.Title . ' (' . l:info.Author . ', ' . l:info.Year . ')'
+endfunction
+
+function! citerius#OpenPdf(label) abort
+	let l:path = citerius#Request('pdf', {'label': a:label})
+	if has('nvim')
+		call jobstart([g:citerius_pdf_viewer, l:path], {'detach': 1})
+	else
+		call job_start([g:citerius_pdf_viewer, l:path], {'stoponexit': ''})
+	endif
+endfunction
+
+function! citerius#StopDaemon() abort
+	call citerius#Request('shutdown')
+	unlet! s:socket
+endfunction
+
+command! -nargs=1 -complete=customlist,citerius#CompleteLabels CiteriusCite call citerius#Cite(<q-args>)
+command! -nargs=1 -complete=customlist,citerius#CompleteLabels CiteriusBibtex call citerius#Bibtex(<q-args>)
+command! -nargs=1 -complete=customlist,citerius#CompleteLabels CiteriusInfo call citerius#Info(<q-args>)
+command! -nargs=1 -complete=customlist,citerius#CompleteLabels CiteriusOpen call citerius#OpenPdf(<q-args>)
+command! CiteriusStopDaemon call citerius#StopDaemon()
+command! CiteriusPick call citerius#Pick()
 
 "command! CiteriusCleanup call citerius#CiteriusCleanup()
 "command! CiteriusGitPush call citerius#CiteriusGitPush()